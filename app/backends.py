@@ -0,0 +1,147 @@
+# app/backends.py
+import os
+
+import numpy as np
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from app.config import ML_BACKEND, ML_THREADS, ONNX_CACHE_DIR
+
+
+class ClassifierBackend:
+    """Interface shared by all prompt-injection classifier backends.
+
+    A backend owns the tokenizer and the model. `predict()` receives the
+    tokenized features of one length bucket and returns the injection
+    probability (class 1) for each of them.
+    """
+
+    name = "base"
+
+    def __init__(self, model_name, threads=ML_THREADS):
+        self.model_name = model_name
+        self.threads = threads
+        self.tokenizer = None
+
+    @property
+    def cache_tag(self):
+        """Identifies model + backend, since backends can disagree slightly on scores."""
+        return f"{self.model_name}:{self.name}"
+
+    def load(self):
+        raise NotImplementedError
+
+    def predict(self, features):
+        raise NotImplementedError
+
+
+class TorchBackend(ClassifierBackend):
+    """Full-precision PyTorch model on CPU (the original path)."""
+
+    name = "torch"
+
+    def load(self):
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+        # FORCE CPU USAGE
+        self.device = torch.device("cpu")
+        self.model.to(self.device)
+        self.model.eval()
+        return self
+
+    def predict(self, features):
+        batch = self.tokenizer.pad(features, return_tensors="pt").to(self.device)
+        with torch.no_grad():
+            logits = self.model(**batch).logits
+        # Probability of class 1 (INJECTION)
+        return torch.nn.functional.softmax(logits, dim=-1)[:, 1].tolist()
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """PyTorch with dynamic int8 quantization of the Linear layers."""
+
+    name = "torch-int8"
+
+    def load(self):
+        super().load()
+        self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        return self
+
+
+class OnnxBackend(ClassifierBackend):
+    """ONNX Runtime session over a one-time export of the PyTorch model."""
+
+    name = "onnx"
+
+    def __init__(self, model_name, threads=ML_THREADS, cache_dir=ONNX_CACHE_DIR):
+        super().__init__(model_name, threads)
+        self.path = os.path.join(cache_dir, model_name.replace("/", "__"), "model.onnx")
+
+    def export(self):
+        """Writes the ONNX graph next to the other data files (skipped if present)."""
+        if os.path.exists(self.path):
+            return self.path
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        model = AutoModelForSequenceClassification.from_pretrained(self.model_name).eval()
+        sample = self.tokenizer(["export sample"], return_tensors="pt")
+        names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+        axes = {name: {0: "batch", 1: "sequence"} for name in names}
+        axes["logits"] = {0: "batch"}
+        tmp_path = self.path + ".tmp"
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in names),
+            tmp_path,
+            input_names=names,
+            output_names=["logits"],
+            dynamic_axes=axes,
+            opset_version=17,
+            dynamo=False,
+        )
+        os.replace(tmp_path, self.path)
+        return self.path
+
+    def load(self):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The 'onnx' backend needs onnxruntime: pip install onnxruntime") from e
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.export()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [item.name for item in self.session.get_inputs()]
+        return self
+
+    def predict(self, features):
+        batch = self.tokenizer.pad(features, return_tensors="np")
+        inputs = {name: batch[name].astype("int64") for name in self.input_names}
+        logits = self.session.run(["logits"], inputs)[0]
+        exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        probs = exp / exp.sum(axis=-1, keepdims=True)
+        return probs[:, 1].tolist()
+
+
+BACKENDS = {
+    TorchBackend.name: TorchBackend,
+    QuantizedTorchBackend.name: QuantizedTorchBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+def build_backend(model_name, name=ML_BACKEND, threads=None):
+    """Instantiates (without loading) the configured classifier backend.
+
+    threads overrides ML_THREADS for this backend; None keeps the configured value.
+    """
+    try:
+        backend_cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown ML backend {name!r}; choose one of {sorted(BACKENDS)}") from None
+    return backend_cls(model_name) if threads is None else backend_cls(model_name, threads=threads)
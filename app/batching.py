@@ -0,0 +1,313 @@
+# app/batching.py
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from app.config import (
+    ML_BATCH_BUCKETS,
+    ML_BATCH_WINDOW_MS,
+    ML_LONG_PROMPTS,
+    ML_MAX_BATCH,
+    ML_MAX_LENGTH,
+    ML_MAX_WINDOWS,
+    ML_THRESHOLD,
+    ML_WINDOW_AGGREGATION,
+    ML_WINDOW_BATCH,
+    ML_WINDOW_SIZE,
+    ML_WINDOW_STRIDE,
+    ML_WINDOW_TOPK,
+)
+from app.metrics import ML_BATCH_SIZE
+from app.tracing import current_trace
+
+WINDOW_AGGREGATIONS = ("max", "topk_mean")
+
+
+class BatchStats:
+    """Per-batch size/latency counters for the micro-batcher."""
+
+    def __init__(self, recent=256):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.prompts = 0
+        self.size_counts = Counter()
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.recent = deque(maxlen=recent)  # (batch size, seconds)
+        self.long_prompts = 0
+        self.windows = 0
+        self.early_stops = 0
+
+    def record(self, size, seconds):
+        ML_BATCH_SIZE.observe(size)
+        with self._lock:
+            self.batches += 1
+            self.prompts += size
+            self.size_counts[size] += 1
+            self.total_latency += seconds
+            self.max_latency = max(self.max_latency, seconds)
+            self.recent.append((size, seconds))
+
+    def record_windows(self, windows, early_stop):
+        with self._lock:
+            self.long_prompts += 1
+            self.windows += windows
+            self.early_stops += int(early_stop)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "prompts": self.prompts,
+                "avg_batch_size": self.prompts / self.batches if self.batches else 0.0,
+                "avg_batch_latency_ms": 1000 * self.total_latency / self.batches if self.batches else 0.0,
+                "max_batch_latency_ms": 1000 * self.max_latency,
+                "batch_sizes": dict(sorted(self.size_counts.items())),
+                "long_prompts": self.long_prompts,
+                "windows_scored": self.windows,
+                "window_early_stops": self.early_stops,
+            }
+
+
+class MicroBatcher:
+    """Collects concurrent ml_layer calls into padded, length-bucketed forward passes.
+
+    Callers block in `score()` while a single worker thread gathers every prompt
+    that arrives within `window_ms` (up to `max_batch`), groups them by token
+    length so one long prompt does not pad the whole batch, and runs one
+    backend forward pass per bucket.
+
+    Prompts longer than `max_length` tokens are not truncated: they are split
+    into overlapping windows (see `score_windows`) when `long_prompts` is on.
+    The worker hands them to a separate window thread, so short prompts
+    queued behind a long one are not held up by its windows.
+    """
+
+    def __init__(self, backend, window_ms=ML_BATCH_WINDOW_MS, max_batch=ML_MAX_BATCH,
+                 buckets=ML_BATCH_BUCKETS, max_length=ML_MAX_LENGTH, long_prompts=ML_LONG_PROMPTS,
+                 window_size=ML_WINDOW_SIZE, window_stride=ML_WINDOW_STRIDE, max_windows=ML_MAX_WINDOWS, window_batch=ML_WINDOW_BATCH,
+                 aggregation=ML_WINDOW_AGGREGATION, topk=ML_WINDOW_TOPK, threshold=ML_THRESHOLD):
+        if aggregation not in WINDOW_AGGREGATIONS:
+            raise ValueError(f"aggregation must be one of {WINDOW_AGGREGATIONS}, got {aggregation!r}")
+        self.backend = backend
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.buckets = sorted(buckets) or [max_length]
+        self.max_length = max_length
+        self.long_prompts = long_prompts
+        self.window_size = min(window_size, max_length)
+        self.window_stride = max(1, window_stride)
+        self.max_windows = max(1, max_windows)
+        self.window_batch = max(1, window_batch)
+        self.aggregation = aggregation
+        self.topk = max(1, topk)
+        self.threshold = threshold
+        self.stats = BatchStats()
+        self._template = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._windows = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    # --- PUBLIC API ---
+    def submit(self, prompt):
+        """Queues a prompt and returns a Future resolving to its injection score."""
+        self._ensure_worker()
+        future = Future()
+        # The caller's trace rides along so the worker can attach batch spans to it.
+        self._queue.put((prompt, future, current_trace()))
+        return future
+
+    def score(self, prompt, timeout=None):
+        """Blocks until the prompt's batch has run and returns its injection score."""
+        return self.submit(prompt).result(timeout=timeout)
+
+    def score_batch(self, prompts, timings=None, on_long=None):
+        """Scores a list of prompts synchronously, bucketing by token length.
+
+        If `timings` is a dict, it receives perf_counter() (start, end) pairs
+        for the "tokenize" and "forward" phases. If `on_long` is given, prompts
+        that need windows are passed to `on_long(position, ids)` instead of
+        being scored here, and their scores are left as None.
+        """
+        if not prompts:
+            return []
+        prefix, suffix, _ = self._special_tokens()
+        room = self.max_length - len(prefix) - len(suffix)
+        started = time.perf_counter()
+        token_ids = self.backend.tokenizer(list(prompts), add_special_tokens=False)["input_ids"]
+        tokenized = time.perf_counter()
+        scores = [0.0] * len(prompts)
+        short = []
+        for position, ids in enumerate(token_ids):
+            if len(ids) > room and self.long_prompts:
+                if on_long is None:
+                    scores[position] = self.score_windows(ids)
+                else:
+                    scores[position] = None
+                    on_long(position, ids)
+            else:
+                short.append((position, ids[:room]))
+        for bucket in self._bucketize([ids for _, ids in short]):
+            features = [self._features(short[i][1]) for i in bucket]
+            # Dynamic padding: the backend pads each bucket only to its own longest prompt.
+            probs = self.backend.predict(features)
+            for i, prob in zip(bucket, probs):
+                scores[short[i][0]] = prob
+        if timings is not None:
+            timings["tokenize"] = (started, tokenized)
+            timings["forward"] = (tokenized, time.perf_counter())
+        return scores
+
+    # --- LONG PROMPTS ---
+    def window_starts(self, length):
+        """Start offsets of the windows covering `length` content tokens, tail first."""
+        prefix, suffix, _ = self._special_tokens()
+        size = self.window_size - len(prefix) - len(suffix)
+        if length <= size:
+            return [0]
+        last = length - size
+        starts = list(range(0, last, self.window_stride)) + [last]
+        if len(starts) > self.max_windows:
+            # Cap the cost: spread the allowed windows evenly, always keeping the last one.
+            if self.max_windows == 1:
+                starts = [last]
+            else:
+                step = (len(starts) - 1) / (self.max_windows - 1)
+                starts = [starts[round(i * step)] for i in range(self.max_windows)]
+        # Padding attacks put benign filler first and the payload last: score the tail first.
+        return starts[::-1]
+
+    def score_windows(self, ids):
+        """Scores a long prompt from overlapping token windows.
+
+        Windows are scored `window_batch` at a time and aggregated with
+        `aggregation`. Scoring stops as soon as the aggregate is guaranteed to
+        stay above the threshold whatever the remaining windows score.
+        """
+        prefix, suffix, _ = self._special_tokens()
+        size = self.window_size - len(prefix) - len(suffix)
+        starts = self.window_starts(len(ids))
+        scores = []
+        early_stop = False
+        for offset in range(0, len(starts), self.window_batch):
+            chunk = starts[offset:offset + self.window_batch]
+            scores.extend(self.backend.predict([self._features(ids[start:start + size]) for start in chunk]))
+            if offset + self.window_batch < len(starts) and self._lower_bound(scores) > self.threshold:
+                early_stop = True
+                break
+        self.stats.record_windows(len(scores), early_stop)
+        return self._aggregate(scores)
+
+    def _aggregate(self, scores):
+        if self.aggregation == "max":
+            return max(scores)
+        top = sorted(scores, reverse=True)[: self.topk]
+        return sum(top) / len(top)
+
+    def _lower_bound(self, scores):
+        # Adding windows can only raise max; for top-k mean, the sum of the best
+        # k seen so far divided by k never exceeds the final value.
+        if self.aggregation == "max":
+            return max(scores)
+        return sum(sorted(scores, reverse=True)[: self.topk]) / self.topk
+
+    def _special_tokens(self):
+        """(prefix ids, suffix ids, returns token_type_ids) of the tokenizer's single-sequence template."""
+        if self._template is None:
+            tokenizer = self.backend.tokenizer
+            full = tokenizer("a")
+            plain = tokenizer("a", add_special_tokens=False)["input_ids"]
+            ids = full["input_ids"]
+            split = next(i for i in range(len(ids) - len(plain) + 1) if ids[i:i + len(plain)] == plain)
+            self._template = (ids[:split], ids[split + len(plain):], "token_type_ids" in full)
+        return self._template
+
+    def _features(self, ids):
+        prefix, suffix, type_ids = self._special_tokens()
+        input_ids = prefix + list(ids) + suffix
+        features = {"input_ids": input_ids, "attention_mask": [1] * len(input_ids)}
+        if type_ids:
+            features["token_type_ids"] = [0] * len(input_ids)
+        return features
+
+    # --- WORKER ---
+    def _bucketize(self, input_ids):
+        prefix, suffix, _ = self._special_tokens()
+        groups = {}
+        for position, ids in enumerate(input_ids):
+            length = len(ids) + len(prefix) + len(suffix)
+            bucket = min(bisect_left(self.buckets, length), len(self.buckets) - 1)
+            groups.setdefault(bucket, []).append(position)
+        return [groups[bucket] for bucket in sorted(groups)]
+
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so a forked worker starts its own.
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                # One thread: long prompts queue behind each other, never behind (or ahead of) short ones.
+                self._windows = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ml-windows")
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="ml-batcher", daemon=True)
+            self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            live = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not live:
+                continue
+            started = time.perf_counter()
+            timings = {}
+            long = []
+            try:
+                scores = self.score_batch([prompt for prompt, _, _ in live], timings,
+                                          on_long=lambda position, ids: long.append((position, ids)))
+            except Exception as e:
+                for _, future, _ in live:
+                    future.set_exception(e)
+                continue
+            for position, ids in long:
+                _, future, trace = live[position]
+                self._windows.submit(self._score_long, ids, future, trace)
+            self.stats.record(len(live), time.perf_counter() - started)
+            for _, _, trace in live:
+                if trace is not None:
+                    for phase, (start, end) in timings.items():
+                        trace.add_span(f"ml.{phase}", start, end, parent="ml", batch_size=len(live))
+            for (_, future, _), score in zip(live, scores):
+                if score is not None:
+                    future.set_result(score)
+
+    def _score_long(self, ids, future, trace):
+        started = time.perf_counter()
+        try:
+            score = self.score_windows(ids)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        if trace is not None:
+            trace.add_span("ml.windows", started, time.perf_counter(), parent="ml")
+        future.set_result(score)
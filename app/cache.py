@@ -0,0 +1,178 @@
+# app/cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import (
+    CACHE_DISK_MAX_ENTRIES,
+    CACHE_DISK_PATH,
+    CACHE_MAX_BYTES,
+    CACHE_MAX_ENTRIES,
+    CACHE_TTL,
+)
+
+# Rough per-entry bookkeeping cost (OrderedDict node, tuple, key object).
+_ENTRY_OVERHEAD = 200
+# How many writes between expired-row sweeps of the disk tier.
+_DISK_PRUNE_EVERY = 1000
+
+
+def verdict_key(prompt, rules_version, model_name):
+    """Cache key: changes whenever the prompt, active rules or model changes."""
+    material = "\0".join((rules_version, model_name, prompt))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class _DiskTier:
+    """SQLite-backed second tier so a restarted worker keeps its warm cache."""
+
+    def __init__(self, path, max_entries):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            "key TEXT PRIMARY KEY, verdict TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key, now):
+        """Returns (verdict, expires_at) for a live entry, else None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT verdict, expires_at FROM verdicts WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, key, verdict, expires_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO verdicts (key, verdict, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(verdict), expires_at),
+            )
+            self._writes += 1
+            if self._writes % _DISK_PRUNE_EVERY == 0:
+                self._prune(time.time())
+            self._conn.commit()
+
+    def _prune(self, now):
+        self._conn.execute("DELETE FROM verdicts WHERE expires_at <= ?", (now,))
+        self._conn.execute(
+            "DELETE FROM verdicts WHERE key IN ("
+            "SELECT key FROM verdicts ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM verdicts")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class VerdictCache:
+    """Bounded LRU + TTL cache of layer verdicts, with an optional SQLite tier.
+
+    Bounded both by entry count and by approximate bytes; the least recently
+    used entries are evicted first. Verdicts are plain dicts so they can be
+    persisted to the disk tier as JSON.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL,
+                 disk_path=CACHE_DISK_PATH, disk_max_entries=CACHE_DISK_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(1, max_bytes)
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, verdict)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_hits = 0
+        self._disk = _DiskTier(disk_path, disk_max_entries) if disk_path else None
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                self._remove(key)
+                self.expirations += 1
+        if self._disk is not None:
+            found = self._disk.get(key, now)
+            if found is not None:
+                verdict, expires_at = found
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    # Promoted with its stored expiry: reads never extend an entry's life.
+                    self._insert(key, verdict, expires_at)
+                return verdict
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, verdict):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._insert(key, verdict, expires_at)
+        if self._disk is not None:
+            self._disk.put(key, verdict, expires_at)
+
+    def _insert(self, key, verdict, expires_at):
+        if key in self._entries:
+            self._remove(key)
+        size = len(key) + len(json.dumps(verdict)) + _ENTRY_OVERHEAD
+        self._entries[key] = (expires_at, size, verdict)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self._disk is not None:
+            self._disk.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "disk_hits": self.disk_hits,
+            }
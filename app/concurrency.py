@@ -0,0 +1,96 @@
+# app/concurrency.py
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from app.config import PIPELINE_MAX_IN_FLIGHT, PIPELINE_MAX_QUEUE, PIPELINE_QUEUE_TIMEOUT, PIPELINE_WORKERS
+
+# Bounded pool for the CPU-bound defense layers, so they never run on the event loop.
+cpu_executor = ThreadPoolExecutor(max_workers=max(1, PIPELINE_WORKERS), thread_name_prefix="defense-layer")
+
+
+async def run_blocking(func, *args):
+    """Runs a blocking layer call on the bounded executor."""
+    loop = asyncio.get_running_loop()
+    # Carry context variables (the request trace) over to the worker thread.
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(cpu_executor, context.run, func, *args)
+
+
+class AdmissionController:
+    """Caps in-flight requests; extra requests queue briefly, then get a 429."""
+
+    def __init__(self, max_in_flight=PIPELINE_MAX_IN_FLIGHT, max_queue=PIPELINE_MAX_QUEUE,
+                 queue_timeout=PIPELINE_QUEUE_TIMEOUT):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = max(0.0, queue_timeout)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = None
+
+    def _reject(self, reason):
+        self.rejected += 1
+        raise HTTPException(status_code=429, detail=reason, headers={"Retry-After": "1"})
+
+    async def acquire(self):
+        """Takes a slot or raises a 429 HTTPException."""
+        # Created lazily so the semaphore binds to the serving event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue or self.queue_timeout == 0:
+                self._reject("Server busy: too many requests in flight")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject("Server busy: timed out waiting for capacity")
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def snapshot(self):
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "max_in_flight": self.max_in_flight,
+        }
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """StreamingResponse that holds an admission slot until the response has ended.
+
+    The slot is released here rather than in the body generator: a generator
+    that never started (client gone before the first chunk, send failure)
+    never runs its `finally`.
+    """
+
+    def __init__(self, content, admission, **kwargs):
+        super().__init__(content, **kwargs)
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.admission.release()
@@ -0,0 +1,203 @@
+# app/config.py
+import os
+from dotenv import load_dotenv
+
+# Load .env before any setting is read so every module sees the same values.
+load_dotenv()
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return int(default)
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# --- CONFIGURATION ---
+# Every setting can be overridden through the environment (PROMPTSHIELD_*).
+
+# Layer 1: Static rules live in the rule store (app/rulestore.py, tables in logs.db).
+# These JSON files are imported into it once, on first run.
+RULES_PATH = os.getenv("PROMPTSHIELD_RULES_PATH", "data/rules.json")
+RULES_PENDING_PATH = os.getenv("PROMPTSHIELD_RULES_PENDING_PATH", "data/pending_rules.json")
+# Seconds between rule store version checks (one indexed MAX(version) read per check).
+RULES_RELOAD_INTERVAL = _env_float("PROMPTSHIELD_RULES_RELOAD_INTERVAL", 1.0)
+# Maximum number of regexes folded into one combined scan.
+RULES_COMBINE_CHUNK = _env_int("PROMPTSHIELD_RULES_COMBINE_CHUNK", 200)
+# Seconds between adding in-memory per-rule hit counts to the rule_hits table.
+RULE_HITS_FLUSH_INTERVAL = _env_float("PROMPTSHIELD_RULE_HITS_FLUSH_INTERVAL", 30.0)
+
+# Layer 2: ML classifier
+# We use a smaller model compatible with CPUs. 
+# If 'deepset/deberta-v3-base-injection' causes errors, switch to "facebook/bart-large-mnli" 
+# or a generic sentiment model for demonstration.
+MODEL_NAME = os.getenv("PROMPTSHIELD_MODEL_NAME", "protectai/deberta-v3-base-prompt-injection-v2")
+# Injection probability above which a prompt is blocked.
+ML_THRESHOLD = _env_float("PROMPTSHIELD_ML_THRESHOLD", 0.90)
+ML_MAX_LENGTH = _env_int("PROMPTSHIELD_ML_MAX_LENGTH", 512)
+# "lazy" (first request), "startup" (background load when the server starts)
+# or "preload" (at import, for a pre-fork master sharing weights copy-on-write).
+MODEL_LOAD_MODE = os.getenv("PROMPTSHIELD_MODEL_LOAD", "startup")
+# Run representative inputs through the model before reporting ready.
+MODEL_WARMUP = _env_bool("PROMPTSHIELD_MODEL_WARMUP", True)
+# Seconds before a failed model load is retried.
+MODEL_RETRY_INTERVAL = _env_float("PROMPTSHIELD_MODEL_RETRY_INTERVAL", 30.0)
+# Inference backend: "torch" (fp32), "torch-int8" (dynamic quantization) or "onnx".
+ML_BACKEND = os.getenv("PROMPTSHIELD_ML_BACKEND", "torch")
+# Intra-op threads for the backend (0 keeps the library default).
+ML_THREADS = _env_int("PROMPTSHIELD_ML_THREADS", 0)
+# Where the ONNX backend stores its one-time model export.
+ONNX_CACHE_DIR = os.getenv("PROMPTSHIELD_ONNX_CACHE_DIR", "data/onnx")
+# How long the batcher waits for more prompts after the first one arrives.
+ML_BATCH_WINDOW_MS = _env_float("PROMPTSHIELD_ML_BATCH_WINDOW_MS", 5.0)
+ML_MAX_BATCH = _env_int("PROMPTSHIELD_ML_MAX_BATCH", 16)
+# Token-length bucket boundaries; prompts are only padded within their bucket.
+ML_BATCH_BUCKETS = [
+    int(size) for size in os.getenv("PROMPTSHIELD_ML_BATCH_BUCKETS", "32,64,128,256,512").split(",") if size.strip()
+]
+# Prompts longer than ML_MAX_LENGTH tokens are scored as overlapping windows
+# instead of being truncated (which would let padding hide a payload).
+ML_LONG_PROMPTS = _env_bool("PROMPTSHIELD_ML_LONG_PROMPTS", True)
+ML_WINDOW_SIZE = _env_int("PROMPTSHIELD_ML_WINDOW_SIZE", 512)
+ML_WINDOW_STRIDE = _env_int("PROMPTSHIELD_ML_WINDOW_STRIDE", 256)
+# Worst-case cost bound: at most this many windows per prompt.
+ML_MAX_WINDOWS = _env_int("PROMPTSHIELD_ML_MAX_WINDOWS", 32)
+# Windows per forward pass; early stopping is checked between passes.
+ML_WINDOW_BATCH = _env_int("PROMPTSHIELD_ML_WINDOW_BATCH", 8)
+# "max" or "topk_mean" (mean of the ML_WINDOW_TOPK highest window scores).
+ML_WINDOW_AGGREGATION = os.getenv("PROMPTSHIELD_ML_WINDOW_AGGREGATION", "max")
+ML_WINDOW_TOPK = _env_int("PROMPTSHIELD_ML_WINDOW_TOPK", 3)
+
+# Request pipeline
+# Threads for the blocking layers; keep >= ML max batch so batches can fill.
+PIPELINE_WORKERS = _env_int("PROMPTSHIELD_PIPELINE_WORKERS", 16)
+# Admission control: requests beyond the in-flight limit queue, then get a 429.
+PIPELINE_MAX_IN_FLIGHT = _env_int("PROMPTSHIELD_MAX_IN_FLIGHT", 64)
+PIPELINE_MAX_QUEUE = _env_int("PROMPTSHIELD_MAX_QUEUE", 128)
+PIPELINE_QUEUE_TIMEOUT = _env_float("PROMPTSHIELD_QUEUE_TIMEOUT", 2.0)
+# Layer routing (app/pipeline.py); PIPELINE_ROUTES overrides any of these per route, as JSON:
+#   {"/generate": {"mode": "speculative", "prescore": "skip"}}
+# "sequential" runs ML before the LLM call; "speculative" starts the LLM call
+# while ML runs and discards it if ML blocks (non-streaming routes only).
+PIPELINE_MODE = os.getenv("PROMPTSHIELD_PIPELINE_MODE", "sequential")
+# For prompts the pre-score marks as low risk: "off" (ML as usual), "skip" (no ML)
+# or "downgrade" (ML with PIPELINE_DOWNGRADE_TIMEOUT, failing open).
+PIPELINE_PRESCORE = os.getenv("PROMPTSHIELD_PIPELINE_PRESCORE", "off")
+# Low risk means at most this many characters and no override/imperative vocabulary.
+PRESCORE_MAX_CHARS = _env_int("PROMPTSHIELD_PRESCORE_MAX_CHARS", 160)
+PIPELINE_DOWNGRADE_TIMEOUT = _env_float("PROMPTSHIELD_PIPELINE_DOWNGRADE_TIMEOUT", 0.05)
+# Per-layer time limits in seconds (0 = none). Static rules and fingerprints always
+# fail closed (503); the ML policy is "closed" (503) or "open" (treat as passed).
+SCREEN_TIMEOUT = _env_float("PROMPTSHIELD_SCREEN_TIMEOUT", 0.0)
+ML_TIMEOUT = _env_float("PROMPTSHIELD_ML_TIMEOUT", 0.0)
+ML_TIMEOUT_POLICY = os.getenv("PROMPTSHIELD_ML_TIMEOUT_POLICY", "closed")
+PIPELINE_ROUTES = os.getenv("PROMPTSHIELD_PIPELINE_ROUTES", "")
+
+# Bulk screening (/scan/batch and tools/scan.py)
+# Largest JSON batch accepted in one request.
+SCAN_MAX_PROMPTS = _env_int("PROMPTSHIELD_SCAN_MAX_PROMPTS", 1000)
+# NDJSON uploads are parsed as they arrive but held until the body ends, so they are capped too.
+SCAN_NDJSON_MAX_PROMPTS = _env_int("PROMPTSHIELD_SCAN_NDJSON_MAX_PROMPTS", 100000)
+SCAN_NDJSON_MAX_BYTES = _env_int("PROMPTSHIELD_SCAN_NDJSON_MAX_BYTES", 64 * 1024 * 1024)
+# Prompts per batched ML pass while scanning.
+SCAN_CHUNK_SIZE = _env_int("PROMPTSHIELD_SCAN_CHUNK_SIZE", 64)
+
+# Layer 3: LLM gateway
+# "groq" for the real API, "fake" for the local FakeStreamingLLM (tests, benchmarks).
+LLM_PROVIDER = os.getenv("PROMPTSHIELD_LLM_PROVIDER", "groq")
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+LLM_MODEL = os.getenv("PROMPTSHIELD_LLM_MODEL", "llama-3.3-70b-versatile")
+LLM_TEMPERATURE = _env_float("PROMPTSHIELD_LLM_TEMPERATURE", 0.7)
+LLM_MAX_TOKENS = _env_int("PROMPTSHIELD_LLM_MAX_TOKENS", 1024)
+LLM_TIMEOUT = _env_float("PROMPTSHIELD_LLM_TIMEOUT", 30.0)
+LLM_MAX_CONNECTIONS = _env_int("PROMPTSHIELD_LLM_MAX_CONNECTIONS", 32)
+# Simulated latency of the fake provider.
+FAKE_LLM_FIRST_TOKEN_DELAY = _env_float("PROMPTSHIELD_FAKE_LLM_FIRST_TOKEN_DELAY", 0.05)
+FAKE_LLM_TOKEN_DELAY = _env_float("PROMPTSHIELD_FAKE_LLM_TOKEN_DELAY", 0.01)
+# Fraction of fake provider calls that fail with a connection error (gateway testing).
+FAKE_LLM_FAILURE_RATE = _env_float("PROMPTSHIELD_FAKE_LLM_FAILURE_RATE", 0.0)
+# Concurrent identical requests share one upstream call (app/gateway.py).
+LLM_COALESCE = _env_bool("PROMPTSHIELD_LLM_COALESCE", True)
+# Seconds a response is reused for the same model, system prompt, parameters and prompt
+# (0 disables; with temperature > 0 this trades answer variety for upstream calls).
+LLM_CACHE_TTL = _env_float("PROMPTSHIELD_LLM_CACHE_TTL", 0.0)
+LLM_CACHE_MAX_ENTRIES = _env_int("PROMPTSHIELD_LLM_CACHE_MAX_ENTRIES", 10000)
+LLM_CACHE_MAX_BYTES = _env_int("PROMPTSHIELD_LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+# Upstream calls in flight at once; further calls wait for a slot.
+LLM_MAX_CONCURRENCY = _env_int("PROMPTSHIELD_LLM_MAX_CONCURRENCY", 32)
+# Retries of timeouts, connection errors, 429s and 5xx, with full-jitter exponential backoff.
+LLM_MAX_RETRIES = _env_int("PROMPTSHIELD_LLM_MAX_RETRIES", 2)
+LLM_BACKOFF_BASE = _env_float("PROMPTSHIELD_LLM_BACKOFF_BASE", 0.25)
+LLM_BACKOFF_MAX = _env_float("PROMPTSHIELD_LLM_BACKOFF_MAX", 4.0)
+# Consecutive failed upstream calls that open the circuit, and seconds until a trial call.
+LLM_BREAKER_THRESHOLD = _env_int("PROMPTSHIELD_LLM_BREAKER_THRESHOLD", 5)
+LLM_BREAKER_COOLDOWN = _env_float("PROMPTSHIELD_LLM_BREAKER_COOLDOWN", 30.0)
+
+# Verdict cache (Layers 1-2)
+CACHE_ENABLED = _env_bool("PROMPTSHIELD_CACHE_ENABLED", True)
+CACHE_MAX_ENTRIES = _env_int("PROMPTSHIELD_CACHE_MAX_ENTRIES", 10000)
+CACHE_MAX_BYTES = _env_int("PROMPTSHIELD_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+CACHE_TTL = _env_float("PROMPTSHIELD_CACHE_TTL", 600.0)
+# Optional SQLite file for a warm cache across restarts (empty disables it).
+CACHE_DISK_PATH = os.getenv("PROMPTSHIELD_CACHE_DISK_PATH", "")
+CACHE_DISK_MAX_ENTRIES = _env_int("PROMPTSHIELD_CACHE_DISK_MAX_ENTRIES", 200000)
+
+# Known-attack fingerprints (app/fingerprints.py), checked between Layers 1 and 2
+FINGERPRINT_ENABLED = _env_bool("PROMPTSHIELD_FINGERPRINT_ENABLED", True)
+FINGERPRINT_PATH = os.getenv("PROMPTSHIELD_FINGERPRINT_PATH", "data/fingerprints.npz")
+# Oldest fingerprints are evicted beyond this (about 100 bytes of memory each).
+FINGERPRINT_MAX_ENTRIES = _env_int("PROMPTSHIELD_FINGERPRINT_MAX_ENTRIES", 200000)
+# SimHash bits (of 64) two prompts may differ by and still count as the same attack.
+# Case, punctuation or a changed word in a 15-word prompt is typically 0-6 bits; unrelated prompts ~32.
+FINGERPRINT_MAX_DISTANCE = _env_int("PROMPTSHIELD_FINGERPRINT_MAX_DISTANCE", 6)
+# Shorter prompts only match exactly (after normalization).
+FINGERPRINT_MIN_TOKENS = _env_int("PROMPTSHIELD_FINGERPRINT_MIN_TOKENS", 6)
+# Seconds between picking up events logged by other workers (0 = no background refresh or preload).
+FINGERPRINT_REFRESH_INTERVAL = _env_float("PROMPTSHIELD_FINGERPRINT_REFRESH_INTERVAL", 5.0)
+
+# Attack log writer
+LOG_BATCH_SIZE = _env_int("PROMPTSHIELD_LOG_BATCH_SIZE", 256)
+LOG_FLUSH_INTERVAL = _env_float("PROMPTSHIELD_LOG_FLUSH_INTERVAL", 0.5)
+LOG_MAX_QUEUE = _env_int("PROMPTSHIELD_LOG_MAX_QUEUE", 10000)
+# "drop_oldest" never slows the block path; "block" waits up to LOG_BLOCK_TIMEOUT.
+LOG_BACKPRESSURE = os.getenv("PROMPTSHIELD_LOG_BACKPRESSURE", "drop_oldest")
+LOG_BLOCK_TIMEOUT = _env_float("PROMPTSHIELD_LOG_BLOCK_TIMEOUT", 1.0)
+
+# Request tracing and profiling
+TRACE_ENABLED = _env_bool("PROMPTSHIELD_TRACE_ENABLED", True)
+# Requests slower than this are always written to the trace file...
+TRACE_SLOW_MS = _env_float("PROMPTSHIELD_TRACE_SLOW_MS", 1000.0)
+# ...plus this random fraction of all other requests.
+TRACE_SAMPLE_RATE = _env_float("PROMPTSHIELD_TRACE_SAMPLE_RATE", 0.01)
+TRACE_PATH = os.getenv("PROMPTSHIELD_TRACE_PATH", "data/traces/traces.jsonl")
+TRACE_MAX_BYTES = _env_int("PROMPTSHIELD_TRACE_MAX_BYTES", 10 * 1024 * 1024)
+TRACE_BACKUPS = _env_int("PROMPTSHIELD_TRACE_BACKUPS", 5)
+# Stack-sample 1 in N requests (0 disables profiling).
+PROFILE_EVERY = _env_int("PROMPTSHIELD_PROFILE_EVERY", 0)
+PROFILE_INTERVAL_MS = _env_float("PROMPTSHIELD_PROFILE_INTERVAL_MS", 5.0)
+PROFILE_DIR = os.getenv("PROMPTSHIELD_PROFILE_DIR", "data/profiles")
+
+# Attack log retention (app/retention.py)
+# Raw events older than this move from logs.db to compressed daily archives.
+RETENTION_DAYS = _env_float("PROMPTSHIELD_RETENTION_DAYS", 30.0)
+ARCHIVE_DIR = os.getenv("PROMPTSHIELD_ARCHIVE_DIR", "data/archive")
+# Rows archived and deleted per short write transaction.
+RETENTION_BATCH_SIZE = _env_int("PROMPTSHIELD_RETENTION_BATCH_SIZE", 500)
+# Pause between batches so the API's log writer is never locked out for long.
+RETENTION_BATCH_PAUSE = _env_float("PROMPTSHIELD_RETENTION_BATCH_PAUSE", 0.05)
+# Hours are rolled up only once this many minutes have passed since they ended.
+ROLLUP_LAG_MINUTES = _env_int("PROMPTSHIELD_ROLLUP_LAG_MINUTES", 5)
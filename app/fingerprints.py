@@ -0,0 +1,325 @@
+# app/fingerprints.py
+"""Fingerprints of already-blocked prompts, checked before the ML classifier.
+
+Attackers often resend a blocked prompt with trivial edits (case, spacing,
+punctuation, a changed word or two). Each blocked prompt is reduced to:
+
+- an exact hash of its normalized text (see app/normalize.py, then
+  punctuation and whitespace collapsed), and
+- a 64-bit SimHash over character 4-grams of that text, whose Hamming
+  distance to another prompt's SimHash grows with how much the texts differ.
+
+Fingerprints live in fixed-size numpy arrays used as a ring buffer, so memory
+is bounded and the oldest entries are overwritten first. A near lookup is one
+vectorized XOR + popcount over the whole buffer (well under a millisecond for
+200k entries). The buffer is fed by the attack log writer as events are
+written, picks up events logged by other workers from the database, and is
+kept in a compact .npz file so workers start with it already built.
+
+Static rule blocks are stored with the rule that blocks them. When a rule
+is rejected, rolled back or dropped by the optimizer, its entries are
+evicted on the next lookup, so its false positives do not stay blocked
+through near matches.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import select
+
+from app.config import (
+    FINGERPRINT_MAX_DISTANCE,
+    FINGERPRINT_MAX_ENTRIES,
+    FINGERPRINT_MIN_TOKENS,
+    FINGERPRINT_PATH,
+    FINGERPRINT_REFRESH_INTERVAL,
+)
+from app.models import FlaggedPrompt, engine
+from app.normalize import normalize
+
+# Only prompts these layers judged malicious. Output Validator events log an
+# innocent-looking prompt, and our own hits are left out so the index never
+# drifts by chaining variants of variants.
+INDEXED_LAYERS = ("Static Rule Checker", "ML Classifier")
+SHINGLE_CHARS = 4
+SAVE_INTERVAL = 60.0
+
+_WORD = re.compile(r"[^\W_]+")
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+
+def _popcount_bytes(values):
+    """Set bits per uint64, for numpy < 2 (no np.bitwise_count)."""
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+_popcount = getattr(np, "bitwise_count", _popcount_bytes)
+
+
+# --- FINGERPRINTS ---
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def simhash(text):
+    """64-bit SimHash of the character 4-grams of already normalized text."""
+    shingles = [text[i:i + SHINGLE_CHARS] for i in range(max(1, len(text) - SHINGLE_CHARS + 1))]
+    hashes = np.fromiter((_hash64(s) for s in shingles), dtype=np.uint64, count=len(shingles))
+    bits = (hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)
+    votes = 2 * bits.sum(axis=0, dtype=np.int64) - len(shingles)
+    return np.packbits(votes > 0, bitorder="little").view("<u8")[0]
+
+
+def fingerprint(text):
+    """Returns (exact hash, simhash or None if too short for near matching).
+
+    text is a raw string or a NormalizedText.
+    """
+    tokens = _WORD.findall(normalize(text).text)
+    normalized = " ".join(tokens)
+    near = simhash(normalized) if len(tokens) >= FINGERPRINT_MIN_TOKENS else None
+    return _hash64(normalized), near
+
+
+# --- INDEX ---
+class FingerprintIndex:
+    """Bounded in-memory index of blocked prompts; the oldest entries are overwritten first.
+
+    `rules` returns the active CompiledRuleSet (e.g. `rule_engine.current`).
+    Without it, static rule blocks are indexed without their rule and never
+    evicted. A `refresh_interval` of 0 disables the background refresh.
+    """
+
+    def __init__(self, path=FINGERPRINT_PATH, max_entries=FINGERPRINT_MAX_ENTRIES,
+                 max_distance=FINGERPRINT_MAX_DISTANCE, refresh_interval=FINGERPRINT_REFRESH_INTERVAL,
+                 rules=None, db=engine):
+        self.path = path
+        self.capacity = max(1, max_entries)
+        self.max_distance = max_distance
+        self.refresh_interval = refresh_interval
+        self.rules = rules
+        self.engine = db
+        self._ids = np.zeros(self.capacity, dtype=np.int64)
+        self._exact_hashes = np.zeros(self.capacity, dtype=np.uint64)
+        self._near = np.zeros(self.capacity, dtype=np.uint64)
+        self._has_near = np.zeros(self.capacity, dtype=bool)
+        self._live = np.zeros(self.capacity, dtype=bool)
+        self._patterns = [""] * self.capacity  # blocking static rule, "" for other layers
+        self._rules_version = None  # rule set the entries were last checked against
+        self._exact = {}  # exact hash -> slot
+        self._size = 0
+        self._next = 0  # slot written next, i.e. the oldest once the buffer is full
+        self._lock = threading.Lock()
+        self._db_mark = 0  # highest flagged_prompts id read from the database
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._thread = None
+        self._pid = None
+        # Stats
+        self.lookups = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+
+    def __len__(self):
+        return self._size
+
+    # --- UPDATES ---
+    def _insert(self, event_id, exact, near, pattern=""):
+        if exact in self._exact:
+            return  # already known; the first event id stays the reason
+        slot = self._next
+        if self._size == self.capacity:
+            evicted = int(self._exact_hashes[slot])
+            if self._exact.get(evicted) == slot:
+                del self._exact[evicted]
+        else:
+            self._size += 1
+        self._ids[slot] = event_id
+        self._exact_hashes[slot] = exact
+        self._near[slot] = near if near is not None else 0
+        self._has_near[slot] = near is not None
+        self._live[slot] = True
+        self._patterns[slot] = pattern
+        self._exact[exact] = slot
+        self._next = (slot + 1) % self.capacity
+        self._dirty = True
+
+    def add(self, event_id, prompt, layer="ML Classifier"):
+        """Indexes one blocked prompt; static blocks only while an active rule still matches them."""
+        normalized = normalize(prompt)
+        pattern = ""
+        if layer == "Static Rule Checker" and self.rules is not None:
+            pattern = self.rules().match_normalized(normalized)
+            if pattern is None:
+                return  # its rule is gone, so it is no longer a known attack
+        exact, near = fingerprint(normalized)
+        with self._lock:
+            self._insert(event_id, exact, near, pattern)
+
+    def add_events(self, events):
+        """Attack log writer listener: indexes newly written blocks."""
+        for event in events:
+            if event.get("id") is not None and event["prompt"] and event["blocked_layer"] in INDEXED_LAYERS:
+                self.add(event["id"], event["prompt"], event["blocked_layer"])
+
+    def _evict_inactive_rules(self, ruleset):
+        # Called under the lock; cheap unless the rule set changed since the last call.
+        if ruleset.version == self._rules_version:
+            return
+        active = set(ruleset.patterns)
+        evicted = 0
+        for slot in np.flatnonzero(self._live[:self._size]).tolist():
+            pattern = self._patterns[slot]
+            if pattern and pattern not in active:
+                exact = int(self._exact_hashes[slot])
+                if self._exact.get(exact) == slot:
+                    del self._exact[exact]
+                self._live[slot] = False
+                self._has_near[slot] = False
+                self._patterns[slot] = ""
+                evicted += 1
+        self._rules_version = ruleset.version
+        if evicted:
+            self._dirty = True
+            print(f"Fingerprint index: evicted {evicted} entries of rules no longer active")
+
+    # --- LOOKUP ---
+    def lookup(self, prompt):
+        """Returns (event_id, "exact" | "near", distance) for a known attack, else None.
+
+        prompt is a raw string or a NormalizedText.
+        """
+        self._ensure_worker()
+        exact, near = fingerprint(prompt)
+        ruleset = self.rules() if self.rules is not None else None
+        with self._lock:
+            if ruleset is not None:
+                self._evict_inactive_rules(ruleset)
+            self.lookups += 1
+            slot = self._exact.get(exact)
+            if slot is not None:
+                self.exact_hits += 1
+                return int(self._ids[slot]), "exact", 0
+            if near is None or not self._size:
+                return None
+            distances = _popcount(self._near[:self._size] ^ near)
+            candidates = np.flatnonzero(distances <= self.max_distance)
+            candidates = candidates[self._has_near[candidates]]
+            if not len(candidates):
+                return None
+            best = candidates[distances[candidates].argmin()]
+            self.near_hits += 1
+            return int(self._ids[best]), "near", int(distances[best])
+
+    # --- PERSISTENCE ---
+    def _ordered(self, array):
+        # Oldest first, so a reload keeps the eviction order.
+        if self._size < self.capacity:
+            return array[:self._size].copy()
+        return np.roll(array, -self._next)
+
+    def load(self):
+        try:
+            with np.load(self.path) as data:
+                ids, exact, near, has_near = data["id"], data["exact"], data["simhash"], data["has_near"]
+                patterns = data["pattern"]
+                db_mark = int(data["db_mark"])
+        except (OSError, ValueError, KeyError):
+            return False  # files without rule patterns are rebuilt from logs.db
+        keep = slice(max(0, len(ids) - self.capacity), None)
+        with self._lock:
+            for event_id, e, n, h, p in zip(ids[keep].tolist(), exact[keep].tolist(), near[keep].tolist(),
+                                            has_near[keep].tolist(), patterns[keep].tolist()):
+                self._insert(event_id, e, n if h else None, p)
+            self._db_mark = max(self._db_mark, db_mark)
+            self._dirty = False
+        return True
+
+    def save(self):
+        with self._lock:
+            live = self._ordered(self._live)
+            arrays = {
+                "id": self._ordered(self._ids)[live],
+                "exact": self._ordered(self._exact_hashes)[live],
+                "simhash": self._ordered(self._near)[live],
+                "has_near": self._ordered(self._has_near)[live],
+                # Unicode array, so the file loads without pickle.
+                "pattern": self._ordered(np.array(self._patterns, dtype=str))[live],
+                "db_mark": np.int64(self._db_mark),
+            }
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp.npz"  # np.savez appends .npz to names without it
+        np.savez(tmp, **arrays)
+        os.replace(tmp, self.path)
+
+    def catch_up(self, batch_size=5000):
+        """Indexes blocks logged since the last refresh (including by other workers)."""
+        table = FlaggedPrompt.__table__
+        added = 0
+        while True:
+            query = (
+                select(table.c.id, table.c.prompt, table.c.blocked_layer)
+                .where(table.c.id > self._db_mark, table.c.blocked_layer.in_(INDEXED_LAYERS))
+                .order_by(table.c.id)
+                .limit(batch_size)
+            )
+            with self.engine.connect() as conn:
+                rows = conn.execute(query).all()
+            for event_id, prompt, layer in rows:
+                if prompt:
+                    self.add(event_id, prompt, layer)
+            added += len(rows)
+            if rows:
+                self._db_mark = rows[-1][0]
+            if len(rows) < batch_size:
+                return added
+
+    # --- WORKER ---
+    def _ensure_worker(self):
+        # Like the attack log writer: threads do not survive fork(), so each worker starts its own.
+        if not self.refresh_interval or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="fingerprint-refresh", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        started = time.perf_counter()
+        loaded = self.load()
+        try:
+            added = self.catch_up()
+        except Exception as e:
+            added = 0
+            print(f"Fingerprint index catch-up failed: {e}")
+        print(f"Fingerprint index ready: {len(self)} entries "
+              f"({'loaded from ' + self.path if loaded else 'built from logs.db'}, {added} new) "
+              f"in {time.perf_counter() - started:.2f}s")
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.catch_up()
+                if self._dirty and time.monotonic() - self._saved_at >= SAVE_INTERVAL:
+                    self.save()
+            except Exception as e:
+                print(f"Fingerprint index refresh failed: {e}")
+
+    def close(self):
+        """Persists the index if it changed (used on shutdown)."""
+        if self._dirty:
+            self.save()
+
+    def stats(self):
+        return {
+            "entries": len(self),
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+        }
@@ -0,0 +1,287 @@
+# app/gateway.py
+"""Layer 3 gateway: the one path from the pipeline to the LLM provider.
+
+- Single-flight: concurrent identical requests share one upstream call,
+  which is cancelled once every caller waiting on it has gone.
+- Optional TTL response cache, keyed on model, system prompt, parameters and prompt.
+- Bounded concurrency toward the provider.
+- Retries of transient errors (timeouts, dropped connections, 429, 5xx) with
+  full-jitter exponential backoff, honoring Retry-After.
+- Circuit breaker: after LLM_BREAKER_THRESHOLD consecutive failed calls,
+  requests fail fast with LLMUnavailable for LLM_BREAKER_COOLDOWN seconds,
+  then a single trial call decides whether to close the circuit again.
+
+Responses still go through Layer 4 in the caller. Works with any client
+exposing `chat.completions.create`, including the local FakeStreamingLLM.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import time
+from contextlib import aclosing
+
+import httpx
+from groq import APIConnectionError, APIStatusError
+
+from app.cache import VerdictCache
+from app.config import (
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+    LLM_BREAKER_COOLDOWN,
+    LLM_BREAKER_THRESHOLD,
+    LLM_CACHE_MAX_BYTES,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_TTL,
+    LLM_COALESCE,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES,
+)
+from app.llm import completion_params, stream_completion
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailable(Exception):
+    """The provider is failing (circuit open or retries exhausted); retry after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def response_key(params):
+    """Cache/coalescing key: every parameter that can change the response."""
+    material = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def is_retryable(error):
+    if isinstance(error, (APIConnectionError, httpx.TransportError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class LLMGateway:
+    """Coalescing, caching, rate-limited and circuit-broken access to one LLM client."""
+
+    def __init__(self, client, coalesce=LLM_COALESCE, cache_ttl=LLM_CACHE_TTL,
+                 cache_max_entries=LLM_CACHE_MAX_ENTRIES, cache_max_bytes=LLM_CACHE_MAX_BYTES,
+                 max_concurrency=LLM_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX,
+                 breaker_threshold=LLM_BREAKER_THRESHOLD, breaker_cooldown=LLM_BREAKER_COOLDOWN):
+        self.client = client
+        self.coalesce = coalesce
+        # Same LRU+TTL structure as the verdict cache, holding {"content": ...} dicts.
+        self.cache = VerdictCache(max_entries=cache_max_entries, max_bytes=cache_max_bytes, ttl=cache_ttl,
+                                  disk_path=None) if cache_ttl > 0 else None
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = max(1, breaker_threshold)
+        self.breaker_cooldown = breaker_cooldown
+        self._inflight = {}  # key -> task running the upstream call
+        self._waiters = {}  # running upstream task -> callers still awaiting it
+        self._semaphore = None
+        self._consecutive_failures = 0
+        self._opened_at = None  # monotonic time the circuit opened; None while closed
+        self._trial = False  # a half-open trial call is in flight
+        # Stats
+        self.requests = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.failures = 0
+        self.short_circuited = 0
+        self.abandoned = 0
+        self.circuit_opens = 0
+        self.in_flight = 0
+
+    # --- CIRCUIT BREAKER ---
+    @property
+    def circuit(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.breaker_cooldown:
+            return "open"
+        return "half_open"
+
+    def _before_call(self):
+        """Raises LLMUnavailable while the circuit is open; returns True for a half-open trial call."""
+        state = self.circuit
+        if state == "open" or (state == "half_open" and self._trial):
+            self.short_circuited += 1
+            remaining = self.breaker_cooldown - (time.monotonic() - self._opened_at)
+            raise LLMUnavailable("LLM provider circuit is open", retry_after=max(1.0, remaining))
+        if state == "half_open":
+            self._trial = True  # let exactly one call probe the provider
+            return True
+        return False
+
+    def _record_success(self):
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def _record_failure(self):
+        self.failures += 1
+        self._consecutive_failures += 1
+        if self._trial or self._consecutive_failures >= self.breaker_threshold:
+            if self._opened_at is None or self._trial:
+                self.circuit_opens += 1
+                print(f"LLM circuit opened after {self._consecutive_failures} consecutive failures")
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+    # --- UPSTREAM ---
+    def _slot(self):
+        # Created lazily so the semaphore binds to the serving event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        hinted = _retry_after(error)
+        return min(self.backoff_max, hinted) if hinted is not None else delay
+
+    async def _call(self, params):
+        attempt = 0
+        while True:
+            trial = self._before_call()
+            async with self._slot():
+                self.upstream_calls += 1
+                self.in_flight += 1
+                try:
+                    completion = await self.client.chat.completions.create(**params)
+                except asyncio.CancelledError:
+                    if trial:
+                        self._trial = False  # no verdict on the provider; let the next call probe
+                    raise
+                except Exception as e:
+                    error = e
+                else:
+                    self._record_success()
+                    return completion.choices[0].message.content
+                finally:
+                    self.in_flight -= 1
+            if not is_retryable(error):
+                # The provider answered, so it is up; the request itself is at fault.
+                self._record_success()
+                raise error
+            self._record_failure()
+            if attempt >= self.max_retries:
+                raise LLMUnavailable(f"LLM provider failed after {attempt + 1} attempts: {error}") from error
+            self.retries += 1
+            await asyncio.sleep(self._backoff(attempt, error))
+            attempt += 1
+
+    # --- API ---
+    async def complete(self, user_prompt):
+        """Returns the response text for user_prompt.
+
+        Raises LLMUnavailable while the provider is failing, or the provider's
+        own error for requests it rejects (e.g. a 400).
+        """
+        self.requests += 1
+        params = completion_params(user_prompt)
+        key = response_key(params)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached["content"]
+        if not self.coalesce:
+            return await self._fetch(key, params)
+        task = self._inflight.get(key)
+        if task is None:
+            # A task of its own, so a disconnecting first caller does not cancel the others.
+            task = asyncio.ensure_future(self._fetch(key, params))
+            self._inflight[key] = task
+            self._waiters[task] = 0
+            task.add_done_callback(lambda done: self._fetch_done(key, done))
+        else:
+            self.coalesced += 1
+        self._waiters[task] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if not task.done():
+                self._waiters[task] -= 1
+                if not self._waiters[task]:
+                    # The last caller left (disconnected, or a discarded speculative call):
+                    # stop paying for a response nobody will read.
+                    self.abandoned += 1
+                    if self._inflight.get(key) is task:
+                        del self._inflight[key]
+                    task.cancel()
+
+    def _fetch_done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        self._waiters.pop(task, None)
+        if not task.cancelled():
+            task.exception()  # mark it retrieved: every caller that wanted it may have gone
+
+    async def _fetch(self, key, params):
+        content = await self._call(params)
+        if self.cache is not None:
+            self.cache.put(key, {"content": content})
+        return content
+
+    async def stream(self, user_prompt):
+        """Yields response pieces; shares the concurrency limit and circuit breaker.
+
+        Streams are neither coalesced, cached nor retried: pieces already
+        forwarded to the client cannot be replayed.
+        """
+        self.requests += 1
+        trial = self._before_call()
+        async with self._slot():
+            self.upstream_calls += 1
+            self.in_flight += 1
+            try:
+                async with aclosing(stream_completion(self.client, user_prompt)) as pieces:
+                    async for piece in pieces:
+                        yield piece
+            except Exception as e:
+                if is_retryable(e):
+                    self._record_failure()
+                else:
+                    self._record_success()
+                raise
+            else:
+                self._record_success()
+            finally:
+                self.in_flight -= 1
+                if trial and self._trial:
+                    self._trial = False  # consumer stopped early: no verdict on the provider
+
+    def stats(self):
+        saved = self.coalesced + self.cache_hits
+        return {
+            "requests": self.requests,
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "cache_hits": self.cache_hits,
+            "cache_hit_rate": self.cache_hits / self.requests if self.requests else 0.0,
+            "saved_calls": saved,
+            "savings_rate": saved / self.requests if self.requests else 0.0,
+            "retries": self.retries,
+            "failures": self.failures,
+            "short_circuited": self.short_circuited,
+            "abandoned": self.abandoned,
+            "circuit": self.circuit,
+            "circuit_opens": self.circuit_opens,
+            "in_flight": self.in_flight,
+        }
@@ -1,83 +1,317 @@
 # app/layers.py
-import json
-import re
-import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from app.models import SessionLocal, FlaggedPrompt
-
-# --- CONFIGURATION ---
-# We use a smaller model compatible with CPUs. 
-# If 'deepset/deberta-v3-base-injection' causes errors, switch to "facebook/bart-large-mnli" 
-# or a generic sentiment model for demonstration.
-MODEL_NAME = "protectai/deberta-v3-base-prompt-injection-v2" 
-
-print("Loading ML Model... (This may take a minute)")
-try:
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
-    # FORCE CPU USAGE
-    device = torch.device("cpu")
-    model.to(device)
-except Exception as e:
-    print(f"Error downloading model: {e}. Check internet connection.")
-
-def log_attack(prompt, layer, score=1.0, blocked_content=None):
-    """Saves blocked prompt/response metadata to database."""
-    db = SessionLocal()
-    entry = FlaggedPrompt(
-        prompt=prompt,
-        blocked_layer=layer,
-        confidence_score=score,
-        blocked_content=blocked_content,
-    )
-    db.add(entry)
-    db.commit()
-    db.close()
+import time
 
-def load_rules():
-    """Reads latest regex rules from JSON"""
+from app.logwriter import attack_log
+from app.rules import RuleEngine, RuleHitCounter
+from app.rulestore import rule_store
+from app.lifecycle import ModelManager, ModelUnavailable
+from app.cache import VerdictCache, verdict_key
+from app.fingerprints import FingerprintIndex
+from app.normalize import normalize
+from app.metrics import LAYER_LATENCY, VERDICTS
+from app.tracing import span
+from app.config import CACHE_ENABLED, FINGERPRINT_ENABLED, ML_BACKEND, ML_THRESHOLD, MODEL_LOAD_MODE, MODEL_NAME
+
+# The classifier is loaded on demand ("lazy"), at server startup ("startup"),
+# or right here at import so a pre-fork master can share it ("preload").
+model_manager = ModelManager(MODEL_NAME, ML_BACKEND)
+if MODEL_LOAD_MODE == "preload":
     try:
-        with open("data/rules.json", "r") as f:
-            data = json.load(f)
-            return data.get("patterns", [])
-    except:
-        return []
+        model_manager.load()
+        model_manager.share_with_workers()
+    except ModelUnavailable:
+        pass
+
+def log_attack(prompt, layer, score=1.0, blocked_content=None, matched_event_id=None):
+    """Queues blocked prompt/response metadata for the batched database writer."""
+    # Only the enqueue is on the request path; the bulk INSERT runs on the writer thread.
+    with span("db.log", layer=layer):
+        attack_log.submit(prompt, layer, score, blocked_content, matched_event_id)
+
+def flush_attack_log():
+    """Writes out every queued event, rule hit count and fingerprint (used on shutdown)."""
+    attack_log.close()
+    rule_hits.flush()
+    if fingerprint_index is not None:
+        fingerprint_index.close()
+
+# Compiled once, rebuilt only when the rule store's version changes.
+rule_engine = RuleEngine(rule_store)
+rule_hits = RuleHitCounter()
+# Every static hit is also logged, so the writer thread flushes the counts off the request path.
+attack_log.add_listener(rule_hits.flush_due)
+
+def load_rules():
+    """Returns the currently active regex rules."""
+    return rule_engine.current().patterns
+
+# Bound once: recording is then a bisect and an add on the hot path.
+_STATIC_LATENCY = LAYER_LATENCY.labels("static")
+_NORMALIZE_LATENCY = LAYER_LATENCY.labels("normalize")
+_FINGERPRINT_LATENCY = LAYER_LATENCY.labels("fingerprint")
+_ML_LATENCY = LAYER_LATENCY.labels("ml")
+_OUTPUT_LATENCY = LAYER_LATENCY.labels("output")
+
+def _count_verdict(layer, blocked):
+    VERDICTS.labels(layer, "blocked" if blocked else "passed").inc()
+
+# --- NORMALIZATION (once per request, shared by every layer) ---
+def _normalize(text):
+    started = time.perf_counter()
+    with span("normalize"):
+        normalized = normalize(text)
+    _NORMALIZE_LATENCY.observe(time.perf_counter() - started)
+    return normalized
 
 # --- LAYER 1: STATIC CHECKER ---
+def _static_verdict(normalized, ruleset):
+    started = time.perf_counter()
+    with span("static"):
+        pattern = ruleset.match_normalized(normalized)
+    _STATIC_LATENCY.observe(time.perf_counter() - started)
+    _count_verdict("static", pattern is not None)
+    if pattern is not None:
+        rule_hits.hit(pattern)
+        log_attack(normalized.raw, "Static Rule Checker", 1.0)
+        return {"safe": False, "layer": "Static Rule Checker", "score": 1.0,
+                "details": f"Blocked by Static Rule: '{pattern}'"}
+    return {"safe": True, "layer": None, "score": 0.0, "details": "Safe"}
+
 def static_layer(prompt):
-    patterns = load_rules()
-    for pattern in patterns:
-        if re.search(pattern, prompt, re.IGNORECASE):
-            log_attack(prompt, "Static Rule Checker", 1.0)
-            return False, f"Blocked by Static Rule: '{pattern}'"
-    return True, "Safe"
+    verdict = _static_verdict(_normalize(prompt), rule_engine.current())
+    return verdict["safe"], verdict["details"]
+
+# --- KNOWN-ATTACK FINGERPRINTS (between Layers 1 and 2) ---
+# Resent variants of already-blocked prompts are stopped without an ML pass.
+fingerprint_index = FingerprintIndex(rules=rule_engine.current) if FINGERPRINT_ENABLED else None
+if fingerprint_index is not None:
+    attack_log.add_listener(fingerprint_index.add_events)
+
+def _fingerprint_match(normalized):
+    started = time.perf_counter()
+    with span("fingerprint"):
+        match = fingerprint_index.lookup(normalized)
+    _FINGERPRINT_LATENCY.observe(time.perf_counter() - started)
+    _count_verdict("fingerprint", match is not None)
+    if match is None:
+        return None
+    event_id, kind, distance = match
+    return {"safe": False, "layer": "Fingerprint Index", "score": 1.0, "event_id": event_id,
+            "details": f"Blocked as a variant of known attack #{event_id} ({kind} match, distance {distance})"}
+
+def _fingerprint_verdict(normalized):
+    verdict = _fingerprint_match(normalized) if fingerprint_index is not None else None
+    if verdict is None:
+        return {"safe": True, "layer": None, "score": 0.0, "details": "Safe"}
+    # The matched id goes into the row so the block can be audited from flagged_prompts.
+    log_attack(normalized.raw, verdict["layer"], verdict["score"], matched_event_id=verdict["event_id"])
+    return verdict
 
 # --- LAYER 2: ML CLASSIFIER ---
+def _model_input(normalized):
+    # The classifier reads natural (cased) text; it only gets the folded view
+    # when normalization undid obfuscation it would otherwise be fooled by.
+    return normalized.text if normalized.obfuscated else normalized.raw
+
+def _scanned_text(normalized):
+    # Everything Layers 1-2 look at: the rule views and the classifier input.
+    return "\0".join(dict.fromkeys(normalized.views + (_model_input(normalized),)))
+
+def _ml_verdict(normalized):
+    # Concurrent ml_layer calls share padded, length-bucketed forward passes.
+    started = time.perf_counter()
+    with span("ml"):
+        injection_score = model_manager.batcher().score(_model_input(normalized))
+    _ML_LATENCY.observe(time.perf_counter() - started)
+    _count_verdict("ml", injection_score > ML_THRESHOLD)
+
+    if injection_score > ML_THRESHOLD:
+        log_attack(normalized.raw, "ML Classifier", injection_score)
+        return {"safe": False, "layer": "ML Classifier", "score": injection_score,
+                "details": f"Blocked by ML (Confidence: {injection_score:.2f})"}
+    return {"safe": True, "layer": None, "score": injection_score, "details": "Safe"}
+
 def ml_layer(prompt):
-    inputs = tokenizer(prompt, return_tensors="pt", truncation=True, max_length=512).to(device)
-    with torch.no_grad():
-        outputs = model(**inputs)
-    
-    # Get probability of class 1 (INJECTION)
-    probs = torch.nn.functional.softmax(outputs.logits, dim=-1)
-    injection_score = probs[0][1].item() 
-    
-    if injection_score > 0.90:
-        log_attack(prompt, "ML Classifier", injection_score)
-        return False, f"Blocked by ML (Confidence: {injection_score:.2f})"
-    return True, "Safe"
+    verdict = _ml_verdict(_normalize(prompt))
+    return verdict["safe"], verdict["details"]
+
+# --- LAYERS 1-2 BEHIND THE VERDICT CACHE ---
+verdict_cache = VerdictCache() if CACHE_ENABLED else None
+
+class Screening:
+    """Layers 1-2 for one prompt, split so the pipeline can run ML alongside other work.
+
+    `verdict` is set once a layer (or the cache) has decided; None means
+    only the ML classifier is left to run.
+    """
+
+    __slots__ = ("normalized", "ruleset", "key", "verdict")
+
+    def __init__(self, normalized, ruleset, key, verdict=None):
+        self.normalized = normalized
+        self.ruleset = ruleset
+        self.key = key
+        self.verdict = verdict
+
+def prescreen(prompt):
+    """Verdict cache, static rules and fingerprints: everything before the ML classifier."""
+    ruleset = rule_engine.current()
+    normalized = _normalize(prompt)
+    key = None
+    if verdict_cache is not None:
+        # Keyed on rules version and model, so rule or model changes never serve stale verdicts,
+        # and on every text the layers scan, so a hit always stands for the same inputs.
+        key = verdict_key(_scanned_text(normalized), ruleset.version, model_manager.cache_tag)
+        with span("cache"):
+            verdict = verdict_cache.get(key)
+        if verdict is not None:
+            _count_verdict("cache", not verdict["safe"])
+            if not verdict["safe"]:
+                # A repeated attack is still an attack; keep the log and dashboard counts complete.
+                log_attack(prompt, verdict["layer"], verdict["score"], matched_event_id=verdict.get("event_id"))
+            return Screening(normalized, ruleset, key, verdict)
+
+    verdict = _static_verdict(normalized, ruleset)
+    if verdict["safe"]:
+        verdict = _fingerprint_verdict(normalized)
+    if verdict["safe"]:
+        return Screening(normalized, ruleset, key)
+    if key is not None:
+        verdict_cache.put(key, verdict)
+    return Screening(normalized, ruleset, key, verdict)
+
+def finish_screen(screening):
+    """Runs the ML classifier if no earlier layer decided; returns the verdict dict."""
+    if screening.verdict is None:
+        verdict = _ml_verdict(screening.normalized)
+        if screening.key is not None:
+            verdict_cache.put(screening.key, verdict)
+        screening.verdict = verdict
+    return screening.verdict
+
+def screen_prompt(prompt):
+    """Runs Layers 1-2, answering repeated prompts from the verdict cache.
+
+    Returns (is_safe, layer, details); layer is None for safe prompts.
+    """
+    verdict = finish_screen(prescreen(prompt))
+    return verdict["safe"], verdict["layer"], verdict["details"]
+
+# --- BULK SCREENING ---
+def scan_prompts(prompts):
+    """Layers 1-2 over many prompts at once, with one batched ML pass.
+
+    Used for offline/bulk screening: nothing is logged, cached or sent to the
+    LLM. Returns one verdict dict per prompt, in order.
+    """
+    ruleset = rule_engine.current()
+    verdicts = [None] * len(prompts)
+    normalized = [normalize(prompt) for prompt in prompts]
+    pending = []
+    for position, prompt in enumerate(normalized):
+        pattern = ruleset.match_normalized(prompt)
+        if pattern is not None:
+            verdicts[position] = {"status": "blocked", "layer": "Static Rule Checker", "score": 1.0,
+                                  "details": f"Blocked by Static Rule: '{pattern}'"}
+            continue
+        verdict = _fingerprint_match(prompt) if fingerprint_index is not None else None
+        if verdict is not None:
+            verdicts[position] = {"status": "blocked", "layer": verdict["layer"], "score": verdict["score"],
+                                  "details": verdict["details"]}
+        else:
+            pending.append(position)
+    if pending:
+        scores = model_manager.batcher().score_batch([_model_input(normalized[position]) for position in pending])
+        for position, score in zip(pending, scores):
+            if score > ML_THRESHOLD:
+                verdicts[position] = {"status": "blocked", "layer": "ML Classifier", "score": score,
+                                      "details": f"Blocked by ML (Confidence: {score:.2f})"}
+            else:
+                verdicts[position] = {"status": "safe", "layer": None, "score": score, "details": "Safe"}
+    return verdicts
 
 # --- LAYER 4: OUTPUT VALIDATOR ---
+SENSITIVE_WORDS = ["password", "aws_key", "secret_token"]
+
+def _normalized_words(words):
+    return [normalize(word).text for word in words]
+
+_SENSITIVE_NORMALIZED = _normalized_words(SENSITIVE_WORDS)
+
 def output_layer(response_text, original_prompt):
-    sensitive_words = ["password", "aws_key", "secret_token"]
-    for word in sensitive_words:
-        if word in response_text.lower():
-            # Log user prompt separately from the sensitive model response for clarity
+    started = time.perf_counter()
+    with span("output"):
+        # Homoglyph, zero-width and spaced-out spellings ("p a s s w o r d") are caught too.
+        normalized = normalize(response_text).text
+        leaked = any(word in normalized for word in _SENSITIVE_NORMALIZED)
+    _OUTPUT_LATENCY.observe(time.perf_counter() - started)
+    _count_verdict("output", leaked)
+    if leaked:
+        # Log user prompt separately from the sensitive model response for clarity
+        log_attack(
+            original_prompt,
+            "Output Validator",
+            1.0,
+            blocked_content=response_text,
+        )
+        return False, "Blocked: Data Leakage Detected"
+    return True, "Safe"
+
+class StreamingOutputValidator:
+    """Incremental Layer 4 for streamed responses.
+
+    `feed()` returns only text that is proven safe: the raw text behind the
+    last `holdback` normalized characters is held back until the next chunk
+    arrives, so a sensitive word split across chunk boundaries is caught
+    before any part of it is emitted. Counting in normalized characters keeps
+    the word's start held however many invisible characters or combining
+    marks are stuffed into it.
+    """
+
+    def __init__(self, original_prompt, sensitive_words=SENSITIVE_WORDS):
+        self.original_prompt = original_prompt
+        self.sensitive_words = _normalized_words(sensitive_words)
+        longest = max((len(word) for word in self.sensitive_words), default=1)
+        self.holdback = longest - 1
+        self.leaked = False
+        self.seconds = 0.0  # validation time summed over all chunks
+        self._pending = ""
+        self._parts = []
+
+    def feed(self, chunk):
+        """Returns (is_safe, text safe to forward now)."""
+        if self.leaked:
+            return False, ""
+        started = time.perf_counter()
+        self._parts.append(chunk)
+        window = self._pending + chunk
+        normalized = normalize(window)
+        if any(word in normalized.text for word in self.sensitive_words):
+            self.leaked = True
+            self._record(started)
             log_attack(
-                original_prompt,
+                self.original_prompt,
                 "Output Validator",
                 1.0,
-                blocked_content=response_text,
+                blocked_content="".join(self._parts),
             )
-            return False, "Blocked: Data Leakage Detected"
-    return True, "Safe"
\ No newline at end of file
+            return False, ""
+        keep = len(normalized.text) - self.holdback
+        cut = normalized.offsets[keep] if keep > 0 else 0
+        self._pending = window[cut:]
+        self.seconds += time.perf_counter() - started
+        return True, window[:cut]
+
+    def finish(self):
+        """Releases the held-back tail once the stream has ended cleanly."""
+        if self.leaked:
+            return ""
+        self._record(time.perf_counter())
+        tail, self._pending = self._pending, ""
+        return tail
+
+    def _record(self, started):
+        # One observation per stream, like output_layer() for a whole response.
+        self.seconds += time.perf_counter() - started
+        _OUTPUT_LATENCY.observe(self.seconds)
+        _count_verdict("output", self.leaked)
@@ -0,0 +1,138 @@
+# app/llm.py
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+import httpx
+from groq import AsyncGroq, DefaultAsyncHttpxClient
+
+from app.config import (
+    FAKE_LLM_FAILURE_RATE,
+    FAKE_LLM_FIRST_TOKEN_DELAY,
+    FAKE_LLM_TOKEN_DELAY,
+    GROQ_API_KEY,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_TOKENS,
+    LLM_MODEL,
+    LLM_PROVIDER,
+    LLM_TEMPERATURE,
+    LLM_TIMEOUT,
+)
+
+SYSTEM_PROMPT = "You are a helpful, friendly, and knowledgeable AI assistant. Provide clear, concise, and accurate responses to user queries."
+
+FALLBACK_RESPONSE = "I'm having trouble processing your request right now. Please try again later."
+
+
+def build_messages(user_prompt):
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": user_prompt
+        }
+    ]
+
+
+def completion_params(user_prompt):
+    """Keyword arguments for chat.completions.create, shared by all call sites."""
+    return {
+        "model": LLM_MODEL,
+        "messages": build_messages(user_prompt),
+        "temperature": LLM_TEMPERATURE,
+        "max_tokens": LLM_MAX_TOKENS,
+    }
+
+
+# --- FAKE PROVIDER ---
+class FakeStreamingLLM:
+    """Local stand-in for the Groq chat API (no network, deterministic output).
+
+    Mirrors the `client.chat.completions.create(...)` surface for both the
+    plain and `stream=True` forms, replying "Processed: <prompt>" one word at
+    a time after configurable delays. `failure_rate` of the calls raise
+    ConnectionError after the first-token delay, like a dropped connection.
+    """
+
+    def __init__(self, first_token_delay=FAKE_LLM_FIRST_TOKEN_DELAY, token_delay=FAKE_LLM_TOKEN_DELAY,
+                 reply=None, failure_rate=FAKE_LLM_FAILURE_RATE):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.reply = reply
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.failures = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _text(self, messages):
+        if self.reply is not None:
+            return self.reply(messages) if callable(self.reply) else self.reply
+        return f"Processed: {messages[-1]['content']}"
+
+    def _pieces(self, text):
+        words = text.split(" ")
+        return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+    async def _create(self, messages, stream=False, **params):
+        self.calls += 1
+        if self.failure_rate and random.random() < self.failure_rate:
+            self.failures += 1
+            await asyncio.sleep(self.first_token_delay)
+            raise ConnectionError("fake provider: connection dropped")
+        text = self._text(messages)
+        if stream:
+            return self._stream(text)
+        await asyncio.sleep(self.first_token_delay + self.token_delay * len(self._pieces(text)))
+        message = SimpleNamespace(role="assistant", content=text)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")],
+                               created=int(time.time()))
+
+    async def _stream(self, text):
+        await asyncio.sleep(self.first_token_delay)
+        for piece in self._pieces(text):
+            delta = SimpleNamespace(content=piece)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)])
+            await asyncio.sleep(self.token_delay)
+
+    async def close(self):
+        pass
+
+
+def build_llm_client(provider=LLM_PROVIDER):
+    """Returns the chat client for the configured provider ("groq" or "fake")."""
+    if provider == "fake":
+        return FakeStreamingLLM()
+    # Async Groq client over one pooled HTTP connection set, shared by all requests
+    return AsyncGroq(
+        api_key=GROQ_API_KEY,
+        timeout=LLM_TIMEOUT,
+        # Retries happen only in the gateway (app/gateway.py), which also counts them for the breaker.
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+            ),
+        ),
+    )
+
+
+async def stream_completion(client, user_prompt):
+    """Yields response text pieces as the provider streams them."""
+    stream = await client.chat.completions.create(stream=True, **completion_params(user_prompt))
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            piece = chunk.choices[0].delta.content
+            if piece:
+                yield piece
+    finally:
+        # Release the upstream connection even when the consumer stops early.
+        close = getattr(stream, "close", None) or getattr(stream, "aclose", None)
+        if close is not None:
+            await close()
@@ -0,0 +1,181 @@
+# app/logwriter.py
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app.config import (
+    LOG_BACKPRESSURE,
+    LOG_BATCH_SIZE,
+    LOG_BLOCK_TIMEOUT,
+    LOG_FLUSH_INTERVAL,
+    LOG_MAX_QUEUE,
+)
+from app.metrics import DB_WRITE_LATENCY
+from app.models import FlaggedPrompt, engine
+
+BACKPRESSURE_POLICIES = ("drop_oldest", "block")
+
+
+class AttackLogWriter:
+    """Background writer that turns attack events into bulk INSERTs.
+
+    Events are buffered in memory and flushed when `batch_size` events are
+    waiting or `flush_interval` seconds have passed, whichever comes first.
+    When the buffer is full, "drop_oldest" discards the oldest event while
+    "block" makes the caller wait up to `block_timeout` before dropping the
+    new one.
+    """
+
+    def __init__(self, engine=engine, table=FlaggedPrompt.__table__, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, max_queue=LOG_MAX_QUEUE,
+                 backpressure=LOG_BACKPRESSURE, block_timeout=LOG_BLOCK_TIMEOUT):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"backpressure must be one of {BACKPRESSURE_POLICIES}, got {backpressure!r}")
+        self.engine = engine
+        self.table = table
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_queue = max(1, max_queue)
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+        self._events = deque()
+        self._cond = threading.Condition()
+        self._closing = False
+        self._thread = None
+        self._pid = None
+        self._listeners = []
+        # Stats
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.max_depth = 0
+        self.last_flush_size = 0
+        self.total_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    # --- PRODUCER SIDE ---
+    def submit(self, prompt, layer, score=1.0, blocked_content=None, matched_event_id=None):
+        """Queues one event; returns False if it had to be dropped."""
+        event = {
+            "prompt": prompt,
+            "blocked_layer": layer,
+            "confidence_score": score,
+            "blocked_content": blocked_content,
+            "matched_event_id": matched_event_id,
+            "timestamp": datetime.utcnow(),
+        }
+        self._ensure_worker()
+        with self._cond:
+            if len(self._events) >= self.max_queue:
+                if self.backpressure == "drop_oldest":
+                    self._events.popleft()
+                    self.dropped += 1
+                elif not self._cond.wait_for(lambda: len(self._events) < self.max_queue or self._closing,
+                                             timeout=self.block_timeout):
+                    self.dropped += 1
+                    return False
+            self._events.append(event)
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._events))
+            if len(self._events) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def add_listener(self, fn):
+        """Calls fn(events) on the writer thread after each successful flush.
+
+        Each event dict then carries the "id" of its flagged_prompts row.
+        """
+        self._listeners.append(fn)
+
+    # --- WORKER ---
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so a forked worker starts its own.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._closing = False
+            self._thread = threading.Thread(target=self._run, name="attack-log-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._events) >= self.batch_size or self._closing,
+                                    timeout=self.flush_interval)
+                batch = [self._events.popleft() for _ in range(min(self.batch_size, len(self._events)))]
+                done = self._closing and not self._events
+                self._cond.notify_all()  # wake producers blocked on a full buffer
+            if batch:
+                self._flush(batch)
+            if done:
+                return
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            with self.engine.begin() as conn:
+                if self._listeners:
+                    # Still one multi-row INSERT; RETURNING hands listeners the new row ids.
+                    statement = insert(self.table).returning(self.table.c.id, sort_by_parameter_order=True)
+                    for event, row_id in zip(batch, conn.execute(statement, batch).scalars().all()):
+                        event["id"] = row_id
+                else:
+                    conn.execute(insert(self.table), batch)
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"Attack log flush failed ({len(batch)} events): {e}")
+            return
+        elapsed = time.perf_counter() - started
+        DB_WRITE_LATENCY.observe(elapsed)
+        self.written += len(batch)
+        self.flushes += 1
+        self.last_flush_size = len(batch)
+        self.total_flush_latency += elapsed
+        self.max_flush_latency = max(self.max_flush_latency, elapsed)
+        for listener in self._listeners:
+            try:
+                listener(batch)
+            except Exception as e:
+                print(f"Attack log listener failed: {e}")
+
+    # --- LIFECYCLE ---
+    def close(self, timeout=10.0):
+        """Flushes everything still buffered and stops the worker."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and self._pid == os.getpid():
+            thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        with self._cond:
+            depth = len(self._events)
+        return {
+            "queue_depth": depth,
+            "max_queue_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_flush_size": self.last_flush_size,
+            "avg_flush_latency_ms": 1000 * self.total_flush_latency / self.flushes if self.flushes else 0.0,
+            "max_flush_latency_ms": 1000 * self.max_flush_latency,
+        }
+
+
+attack_log = AttackLogWriter()
+atexit.register(attack_log.close)
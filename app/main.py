@@ -1,81 +1,333 @@
 # app/main.py
-from fastapi import FastAPI
+import codecs
+import json
+import time
+from contextlib import aclosing, asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
-from app.layers import static_layer, ml_layer, output_layer
-import os
-from groq import Groq
-from dotenv import load_dotenv
+from app.concurrency import AdmissionController, AdmittedStreamingResponse, cpu_executor, run_blocking
+from app.config import (
+    MODEL_LOAD_MODE,
+    SCAN_CHUNK_SIZE,
+    SCAN_MAX_PROMPTS,
+    SCAN_NDJSON_MAX_BYTES,
+    SCAN_NDJSON_MAX_PROMPTS,
+)
+from app.layers import output_layer, flush_attack_log, StreamingOutputValidator
+from app.layers import model_manager, ModelUnavailable, scan_prompts, verdict_cache, fingerprint_index
+from app.logwriter import attack_log
+from app.metrics import CONTENT_TYPE, LAYER_LATENCY, REGISTRY, REQUEST_LATENCY, REQUESTS
+from app.gateway import LLMGateway, LLMUnavailable
+from app.llm import FALLBACK_RESPONSE, build_llm_client
+from app.pipeline import LayerTimeout, PipelineExecutor
+from app.scanning import parse_record, scan_records
+from app.tracing import TracingMiddleware, current_trace
 
-load_dotenv()
+BLOCK_MESSAGES = {
+    "Static Rule Checker": "⚠️ Potential security threat detected",
+    "ML Classifier": "⚠️ AI security system flagged this prompt as potentially malicious",
+    "Fingerprint Index": "⚠️ Prompt matches a previously blocked attack",
+    "Output Validator": "⚠️ Response blocked due to potential data leakage",
+}
 
-app = FastAPI(title="PromptShield API")
 
-# Initialize Groq client
-groq_client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+@asynccontextmanager
+async def lifespan(app):
+    if MODEL_LOAD_MODE == "startup":
+        # Serve liveness immediately; /readyz turns green once the model is warm.
+        model_manager.load_in_background()
+    yield
+    # Drain background work before the worker exits.
+    await llm_client.close()
+    cpu_executor.shutdown(wait=True)
+    flush_attack_log()
+
+
+app = FastAPI(title="PromptShield API", lifespan=lifespan)
+# Request IDs (X-Request-ID), per-layer spans and slow-request trace files
+app.add_middleware(TracingMiddleware)
+
+# Groq (or the local fake provider), shared by all requests through one gateway
+llm_client = build_llm_client()
+llm_gateway = LLMGateway(llm_client)
+# Per-route layer ordering, pre-scoring and time limits (app/pipeline.py)
+pipeline = PipelineExecutor(llm_gateway)
+
+admission = AdmissionController()
 
 class PromptRequest(BaseModel):
     prompt: str
 
+def _unavailable(e):
+    """Maps a layer that cannot give a verdict (or a failing provider) to a 503, never a silent pass."""
+    if isinstance(e, LLMUnavailable):
+        return HTTPException(status_code=503, detail=FALLBACK_RESPONSE,
+                             headers={"Retry-After": str(max(1, round(e.retry_after)))})
+    retry_after = "30" if isinstance(e, ModelUnavailable) else "1"
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": retry_after})
+
+async def _screen(user_prompt, route):
+    """Layers 1-2 under the route's pipeline policy."""
+    try:
+        verdict = await pipeline.screen(user_prompt, route)
+    except (ModelUnavailable, LayerTimeout) as e:
+        raise _unavailable(e)
+    return verdict["safe"], verdict["layer"], verdict["details"]
+
+# --- METRICS ---
+_LLM_LATENCY = LAYER_LATENCY.labels("llm")
+
+def _record_request(endpoint, outcome, started):
+    REQUESTS.labels(endpoint, outcome).inc()
+    REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - started)
+
+REGISTRY.sampled("promptshield_in_flight_requests", "Requests holding an admission slot.",
+                 lambda: admission.in_flight)
+REGISTRY.sampled("promptshield_waiting_requests", "Requests queued for an admission slot.",
+                 lambda: admission.waiting)
+REGISTRY.sampled("promptshield_rejected_requests_total", "Requests rejected with 429.",
+                 lambda: admission.rejected, type="counter")
+REGISTRY.sampled("promptshield_llm_gateway_events_total", "LLM gateway requests and what became of them.",
+                 lambda: {(key,): value for key, value in llm_gateway.stats().items()
+                          if key in ("requests", "upstream_calls", "coalesced", "cache_hits", "retries",
+                                     "failures", "short_circuited", "abandoned")},
+                 labels=["event"], type="counter")
+REGISTRY.sampled("promptshield_llm_circuit_open", "1 while the LLM circuit breaker is open or probing.",
+                 lambda: int(llm_gateway.circuit != "closed"))
+REGISTRY.sampled("promptshield_model_ready", "1 once the classifier is loaded and warm.",
+                 lambda: int(model_manager.ready))
+REGISTRY.sampled("promptshield_attack_log_queue_depth", "Attack events waiting for the DB writer.",
+                 lambda: attack_log.stats()["queue_depth"])
+REGISTRY.sampled("promptshield_attack_log_events_total", "Attack events by outcome.",
+                 lambda: {(key,): value for key, value in attack_log.stats().items()
+                          if key in ("written", "dropped", "failed")},
+                 labels=["outcome"], type="counter")
+if verdict_cache is not None:
+    REGISTRY.sampled("promptshield_verdict_cache_lookups_total", "Verdict cache lookups by result.",
+                     lambda: {(key,): verdict_cache.stats()[key] for key in ("hits", "misses")},
+                     labels=["result"], type="counter")
+    REGISTRY.sampled("promptshield_verdict_cache_entries", "Verdicts held in memory.",
+                     lambda: verdict_cache.stats()["entries"])
+if fingerprint_index is not None:
+    REGISTRY.sampled("promptshield_fingerprint_entries", "Known-attack fingerprints held in memory.",
+                     lambda: len(fingerprint_index))
+
+@app.get("/metrics")
+async def metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+# --- HEALTH ---
+@app.get("/healthz")
+async def liveness():
+    return {"status": "alive", "model_state": model_manager.state}
+
+@app.get("/readyz")
+async def readiness():
+    status = model_manager.status()
+    if not model_manager.ready:
+        return JSONResponse(status_code=503, content={"status": "not_ready", **status})
+    return {"status": "ready", **status}
+
 @app.post("/generate")
 async def generate_response(request: PromptRequest):
-    user_prompt = request.prompt
-    print(f"Received: {user_prompt}")
-
-    # 1. Static Layer
-    is_safe, msg = static_layer(user_prompt)
-    if not is_safe:
-        return {
-            "status": "blocked", 
-            "layer": "Static Rule Checker", 
-            "message": "⚠️ Potential security threat detected",
-            "details": msg,
-            "prompt": user_prompt
-        }
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        async with admission:
+            result = await _run_pipeline(request.prompt)
+        outcome = result["status"]
+        return result
+    except HTTPException as e:
+        outcome = f"http_{e.status_code}"
+        raise
+    finally:
+        _record_request("/generate", outcome, started)
 
-    # 2. ML Layer
-    is_safe, msg = ml_layer(user_prompt)
-    if not is_safe:
+async def _run_pipeline(user_prompt):
+    # 1-3. Static Layer + ML Layer, then the LLM Gateway (coalesced, cached, retried and
+    # circuit-broken calls to Groq), ordered per route: see app/pipeline.py
+    try:
+        verdict, llm_response = await pipeline.run(user_prompt, "/generate")
+    except (ModelUnavailable, LayerTimeout, LLMUnavailable) as e:
+        raise _unavailable(e)
+    if not verdict["safe"]:
         return {
             "status": "blocked", 
-            "layer": "ML Classifier", 
-            "message": "⚠️ AI security system flagged this prompt as potentially malicious",
-            "details": msg,
+            "layer": verdict["layer"], 
+            "message": BLOCK_MESSAGES[verdict["layer"]],
+            "details": verdict["details"],
             "prompt": user_prompt
         }
 
-    # 3. LLM Gateway - Generate real response using Groq
-    try:
-        completion = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful, friendly, and knowledgeable AI assistant. Provide clear, concise, and accurate responses to user queries."
-                },
-                {
-                    "role": "user",
-                    "content": user_prompt
-                }
-            ],
-            temperature=0.7,
-            max_tokens=1024
-        )
-        
-        llm_response = completion.choices[0].message.content
-        
-    except Exception as e:
-        print(f"LLM Error: {e}")
-        llm_response = "I'm having trouble processing your request right now. Please try again later."
-
     # 4. Output Validation
     is_safe, msg = output_layer(llm_response, user_prompt)
     if not is_safe:
         return {
             "status": "blocked", 
             "layer": "Output Validator", 
-            "message": "⚠️ Response blocked due to potential data leakage",
+            "message": BLOCK_MESSAGES["Output Validator"],
             "details": msg,
             "prompt": user_prompt
         }
 
-    return {"status": "success", "response": llm_response}
\ No newline at end of file
+    return {"status": "success", "response": llm_response}
+
+
+# --- STREAMING ---
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/generate/stream")
+async def generate_stream(request: PromptRequest):
+    """Same pipeline as /generate, but forwards LLM tokens as Server-Sent Events."""
+    started = time.perf_counter()
+    try:
+        await admission.acquire()
+    except HTTPException as e:
+        _record_request("/generate/stream", f"http_{e.status_code}", started)
+        raise
+    try:
+        is_safe, layer, msg = await _screen(request.prompt, "/generate/stream")
+    except BaseException as e:
+        admission.release()
+        _record_request("/generate/stream", f"http_{getattr(e, 'status_code', 500)}", started)
+        raise
+    return AdmittedStreamingResponse(
+        _stream_events(request.prompt, is_safe, layer, msg, started),
+        admission,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def _stream_events(user_prompt, is_safe, layer, msg, started):
+    # Events: "token" {text}, then exactly one of "done", "blocked" or "error".
+    outcome = "error"
+    try:
+        if not is_safe:
+            outcome = "blocked"
+            yield _sse("blocked", {"layer": layer, "message": BLOCK_MESSAGES[layer], "details": msg})
+            return
+
+        validator = StreamingOutputValidator(user_prompt)
+        llm_started = time.perf_counter()
+        try:
+            async with aclosing(llm_gateway.stream(user_prompt)) as pieces:
+                async for piece in pieces:
+                    is_safe, text = validator.feed(piece)
+                    if not is_safe:
+                        # Cut the stream: the held-back text never reaches the client.
+                        outcome = "blocked"
+                        yield _sse("blocked", {
+                            "layer": "Output Validator",
+                            "message": BLOCK_MESSAGES["Output Validator"],
+                            "details": "Blocked: Data Leakage Detected",
+                        })
+                        return
+                    if text:
+                        yield _sse("token", {"text": text})
+        except Exception as e:
+            print(f"LLM Error: {e}")
+            yield _sse("error", {"message": FALLBACK_RESPONSE})
+            return
+        finally:
+            llm_finished = time.perf_counter()
+            _LLM_LATENCY.observe(llm_finished - llm_started)
+            trace = current_trace()
+            if trace is not None:
+                trace.add_span("llm", llm_started, llm_finished, parent=None, stream=True,
+                               validation_ms=round(1000 * validator.seconds, 3))
+
+        tail = validator.finish()
+        if tail:
+            yield _sse("token", {"text": tail})
+        outcome = "success"
+        yield _sse("done", {"status": "success"})
+    finally:
+        _record_request("/generate/stream", outcome, started)
+
+
+# --- BULK SCREENING ---
+async def _scan(records):
+    try:
+        return await run_blocking(scan_records, records, scan_prompts)
+    except ModelUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+@app.post("/scan/batch")
+async def scan_batch(request: Request):
+    """Screens many prompts through Layers 1-2 only (no LLM call, nothing logged).
+
+    JSON body: {"prompts": [...]} or a bare list -> {"results": [...]}.
+    NDJSON body (Content-Type: application/x-ndjson): one prompt per line,
+    parsed as it uploads and answered as an NDJSON stream, one chunk at a time.
+    """
+    if "ndjson" in request.headers.get("content-type", ""):
+        # Admitted before the upload is read, so concurrent uploads are bounded as well.
+        await admission.acquire()
+        try:
+            entries = await _read_ndjson(request)
+        except BaseException:
+            admission.release()
+            raise
+        return AdmittedStreamingResponse(_scan_ndjson(entries), admission, media_type="application/x-ndjson")
+
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be JSON or NDJSON")
+    prompts = body.get("prompts") if isinstance(body, dict) else body
+    if not isinstance(prompts, list) or not all(isinstance(prompt, str) for prompt in prompts):
+        raise HTTPException(status_code=422, detail="Expected a list of prompt strings")
+    if len(prompts) > SCAN_MAX_PROMPTS:
+        raise HTTPException(status_code=413, detail=f"At most {SCAN_MAX_PROMPTS} prompts per request; use NDJSON for more")
+
+    async with admission:
+        results = []
+        for start in range(0, len(prompts), SCAN_CHUNK_SIZE):
+            chunk = list(enumerate(prompts[start:start + SCAN_CHUNK_SIZE], start))
+            results.extend(await _scan(chunk))
+    return {"results": results}
+
+async def _read_ndjson(request, max_prompts=SCAN_NDJSON_MAX_PROMPTS, max_bytes=SCAN_NDJSON_MAX_BYTES):
+    """Returns the upload's (id, prompt) records and error dicts, in input order."""
+    # Lines are parsed as the body arrives: the raw upload is never held whole,
+    # but the parsed records are (scanning starts once the body has ended),
+    # so both the body size and the line count are capped.
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    entries = []
+    index = 0
+    size = 0
+    buffer = ""
+    async for data in request.stream():
+        size += len(data)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"NDJSON body larger than {max_bytes} bytes")
+        buffer += decoder.decode(data, final=not data)
+        *lines, buffer = buffer.split("\n")
+        if not data:
+            lines.append(buffer)
+        for line in lines:
+            try:
+                entry = parse_record(line, index)
+            except ValueError as e:
+                entry = {"id": index, "status": "error", "details": str(e)}
+            index += 1
+            if entry is not None:
+                entries.append(entry)
+        if len(entries) > max_prompts:
+            raise HTTPException(status_code=413, detail=f"At most {max_prompts} NDJSON lines per request")
+    return entries
+
+async def _scan_ndjson(entries):
+    # Status is already 200 once streaming starts, so problems are reported in-band,
+    # each malformed line at its own position among the verdicts.
+    try:
+        for start in range(0, len(entries), SCAN_CHUNK_SIZE):
+            chunk = entries[start:start + SCAN_CHUNK_SIZE]
+            records = [entry for entry in chunk if isinstance(entry, tuple)]
+            results = iter(await _scan(records) if records else ())
+            for entry in chunk:
+                yield json.dumps(next(results) if isinstance(entry, tuple) else entry) + "\n"
+    except HTTPException as e:
+        yield json.dumps({"status": "error", "details": e.detail}) + "\n"
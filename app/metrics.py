@@ -0,0 +1,248 @@
+# app/metrics.py
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Counters and histograms keep one small lock per label set and pre-allocated
+bucket arrays, so recording on the request path is a bisect plus a couple of
+additions. Hot paths bind their label set once (`LAYER_LATENCY.labels("ml")`)
+and reuse the child. Sampled metrics read an existing stats object only when
+/metrics is scraped.
+
+Adding a layer needs no registration: time it with
+`LAYER_LATENCY.labels("<layer>").observe(seconds)` and count its decisions
+with `VERDICTS.labels("<layer>", "blocked" | "passed").inc()`.
+"""
+import threading
+from bisect import bisect_left
+
+# Seconds; covers sub-millisecond regex checks up to slow LLM calls.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Returns the child for one label set (created once, then reused)."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        # Unlabelled metrics act as their own single child.
+        return self.labels()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.label_names, values))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, label_names, values):
+        return [f"{name}{_format_labels(label_names, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. verdicts per layer."""
+
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class Gauge(Counter):
+    """Value that goes up and down, e.g. requests in flight."""
+
+    type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+
+class _HistogramChild:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self, name, label_names, values):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(label_names, values, [("le", _format_value(float(bound)))])
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(label_names, values)
+        lines.append(f"{name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Bucketed distribution, e.g. per-layer latency in seconds."""
+
+    type = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+
+class Sampled(_Metric):
+    """Gauge or counter whose value is read from `fn()` at scrape time.
+
+    `fn` returns a number, or a dict mapping label-value tuples to numbers.
+    """
+
+    def __init__(self, name, help_text, fn, labels=(), type="gauge"):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+        self.type = type
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"Metric {self.name} failed: {e}")
+            return lines
+        samples = value.items() if isinstance(value, dict) else [((), value)]
+        for values, sample in samples:
+            lines.append(f"{self.name}{_format_labels(self.label_names, values)} {_format_value(sample)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # Re-registering a name (e.g. a module reloaded in tests) replaces it.
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def sampled(self, name, help_text, fn, labels=(), type="gauge"):
+        return self.register(Sampled(name, help_text, fn, labels, type))
+
+    def render(self):
+        """All metrics in the Prometheus text format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- SHARED METRICS ---
+LAYER_LATENCY = REGISTRY.histogram(
+    "promptshield_layer_latency_seconds", "Time spent in each defense layer.", ["layer"])
+VERDICTS = REGISTRY.counter(
+    "promptshield_verdicts_total", "Decisions made by each layer (cache = answered from the verdict cache).",
+    ["layer", "verdict"])
+REQUEST_LATENCY = REGISTRY.histogram(
+    "promptshield_request_latency_seconds", "End-to-end request latency by endpoint.", ["endpoint"])
+REQUESTS = REGISTRY.counter(
+    "promptshield_requests_total", "Requests by endpoint and outcome.", ["endpoint", "outcome"])
+ML_BATCH_SIZE = REGISTRY.histogram(
+    "promptshield_ml_batch_size", "Prompts per ML forward pass.", buckets=BATCH_SIZE_BUCKETS)
+DB_WRITE_LATENCY = REGISTRY.histogram(
+    "promptshield_db_write_latency_seconds", "Attack log bulk INSERT latency.")
+PIPELINE_ROUTING = REGISTRY.counter(
+    "promptshield_pipeline_requests_total",
+    "How requests went through Layers 1-2 (decided_early = cache, static rules or fingerprints).",
+    ["route", "mode", "path"])
+PIPELINE_LATENCY_SAVED = REGISTRY.histogram(
+    "promptshield_pipeline_latency_saved_seconds",
+    "Estimated end-to-end time saved versus running every layer in sequence.", ["route", "strategy"])
+PIPELINE_DISCARDED_LLM_CALLS = REGISTRY.counter(
+    "promptshield_pipeline_discarded_llm_calls_total",
+    "Speculative LLM calls cancelled or thrown away because ML blocked the prompt.", ["route"])
+LAYER_TIMEOUTS = REGISTRY.counter(
+    "promptshield_layer_timeouts_total", "Layers that ran past their time limit, by policy applied.",
+    ["layer", "policy"])
@@ -1,5 +1,5 @@
 # app/models.py
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, inspect, text
+from sqlalchemy import create_engine, event, Column, Index, Integer, String, Float, DateTime, Text, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -7,6 +7,19 @@ from datetime import datetime
 # Setup SQLite Database
 DB_URL = "sqlite:///./data/logs.db"
 engine = create_engine(DB_URL, connect_args={"check_same_thread": False})
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets the dashboard read while the log writer appends; NORMAL skips per-commit fsyncs."""
+    cursor = dbapi_connection.cursor()
+    # Only takes effect on a new database file; lets pruning give pages back.
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -19,24 +32,98 @@ class FlaggedPrompt(Base):
     confidence_score = Column(Float)
     timestamp = Column(DateTime, default=datetime.utcnow)
     blocked_content = Column(Text)  # Used by output validator to store the unsafe response
+    matched_event_id = Column(Integer)  # Fingerprint Index blocks: id of the known attack they matched
+
+    # Dashboard time-range scans, per-layer counts and keyset pagination (timestamp, id)
+    __table_args__ = (
+        Index("ix_flagged_prompts_timestamp", "timestamp"),
+        Index("ix_flagged_prompts_layer_timestamp", "blocked_layer", "timestamp"),
+    )
+
+# Hourly and daily aggregates that outlive the raw events (see app/retention.py)
+class FlaggedPromptRollup(Base):
+    __tablename__ = "flagged_prompt_rollups"
+    period = Column(String, primary_key=True)  # 'hour' or 'day'
+    bucket_start = Column(String, primary_key=True)  # 'YYYY-MM-DD HH:00:00'
+    blocked_layer = Column(String, primary_key=True)
+    events = Column(Integer, nullable=False)
+    score_sum = Column(Float, nullable=False)
+    score_min = Column(Float)
+    score_max = Column(Float)
+    score_histogram = Column(Text)  # JSON list: event counts for scores in [0, 0.1), ..., [0.9, 1.0]
+
+# Small key/value store for watermarks (retention, evolution engine)
+class RetentionState(Base):
+    __tablename__ = "retention_state"
+    name = Column(String, primary_key=True)
+    value = Column(String)
+
+# Every static rule set ever active; the highest version is live (see app/rulestore.py)
+class RulesetVersion(Base):
+    __tablename__ = "ruleset_versions"
+    __table_args__ = {"sqlite_autoincrement": True}  # versions only ever grow
+    version = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    action = Column(String)  # 'import', 'approve' or 'rollback'
+    note = Column(Text)
+    digest = Column(String)  # content hash of the patterns (app.rules.ruleset_version)
+    patterns = Column(Text, nullable=False)  # JSON list
+    plan = Column(Text)  # JSON list from evolution/optimizer.py, or NULL
+
+# Rule store bookkeeping (e.g. whether the legacy JSON files were imported)
+class RuleStoreState(Base):
+    __tablename__ = "rule_store_state"
+    name = Column(String, primary_key=True)
+    value = Column(String)
+
+# Generated rules and rule set proposals awaiting review
+class PendingRule(Base):
+    __tablename__ = "pending_rules"
+    __table_args__ = {"sqlite_autoincrement": True}  # ids of rejected proposals are never reused
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # 'rule' or 'ruleset'
+    pattern = Column(String)  # single rules only, for deduplication
+    created_at = Column(DateTime, default=datetime.utcnow)
+    payload = Column(Text, nullable=False)  # JSON entry as queued by the generator or optimizer
+
+# Static rule hit counts from live traffic, read by evolution/optimizer.py
+class RuleHit(Base):
+    __tablename__ = "rule_hits"
+    pattern = Column(String, primary_key=True)
+    hits = Column(Integer, nullable=False)
 
 # Create the database file if it doesn't exist
 Base.metadata.create_all(bind=engine)
 
 
-def ensure_blocked_content_column() -> None:
-    """Adds the blocked_content column for existing deployments without running migrations."""
+# Columns added after the first release, with their SQLite types
+ADDED_COLUMNS = {"blocked_content": "TEXT", "matched_event_id": "INTEGER"}
+
+
+def ensure_added_columns() -> None:
+    """Adds newer flagged_prompts columns for existing deployments without running migrations."""
     inspector = inspect(engine)
     tables = inspector.get_table_names()
     if "flagged_prompts" not in tables:
         return
 
     columns = {col["name"] for col in inspector.get_columns("flagged_prompts")}
-    if "blocked_content" in columns:
+    missing = [name for name in ADDED_COLUMNS if name not in columns]
+    if not missing:
         return
 
     with engine.begin() as conn:
-        conn.execute(text("ALTER TABLE flagged_prompts ADD COLUMN blocked_content TEXT"))
+        for name in missing:
+            conn.execute(text(f"ALTER TABLE flagged_prompts ADD COLUMN {name} {ADDED_COLUMNS[name]}"))
+
+
+ensure_added_columns()
+
+
+def ensure_indexes() -> None:
+    """Adds the dashboard indexes to databases created before they were declared."""
+    for index in FlaggedPrompt.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
 
 
-ensure_blocked_content_column()
\ No newline at end of file
+ensure_indexes()
\ No newline at end of file
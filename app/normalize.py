@@ -0,0 +1,181 @@
+# app/normalize.py
+"""One normalization pass per text, shared by every layer.
+
+Obfuscated prompts hide keywords from rules and classifiers with tricks that
+do not change how the text reads: full-width or "mathematical" letters,
+Cyrillic/Greek look-alikes, zero-width characters, combining accents and
+letters split by separators ("i.g.n.o.r.e", "p a s s w o r d"). Instead of
+every rule trying to cover them, `normalize()` undoes them once:
+
+1. NFKC compatibility folding, with Latin accents dropped ("é" -> "e"),
+   look-alike letters mapped to ASCII, invisible characters removed and case
+   folded. One `str.translate` over a precomputed table, extended lazily for
+   characters it has not seen yet.
+2. Four or more letters split by a repeated separator are joined back into
+   a word. List punctuation (",", ";", ":") does not count as a separator,
+   and shorter runs are left alone, so "U.S.A." or "a, b, c" stay as written.
+
+The result keeps the raw text, the normalized `text` and (computed on
+demand) the offset of every normalized character in the raw text, so a match
+in the normalized view can be reported against what the user actually sent.
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+# --- TRANSLATION TABLE ---
+# Look-alikes of ASCII letters that NFKC leaves alone (Cyrillic, Greek, ...).
+# Upper-case forms are listed too: once case-folded they no longer look Latin.
+CONFUSABLES = {
+    # Cyrillic
+    "а": "a", "А": "a", "в": "b", "В": "b", "с": "c", "С": "c", "ԁ": "d", "е": "e", "Е": "e",
+    "ё": "e", "Ё": "e", "һ": "h", "Н": "h", "і": "i", "І": "i", "ї": "i", "Ї": "i", "ј": "j",
+    "Ј": "j", "к": "k", "К": "k", "ӏ": "l", "Ӏ": "l", "м": "m", "М": "m", "о": "o", "О": "o",
+    "р": "p", "Р": "p", "ԛ": "q", "ѕ": "s", "Ѕ": "s", "т": "t", "Т": "t", "у": "y", "У": "y",
+    "ѡ": "w", "ԝ": "w", "х": "x", "Х": "x", "ү": "y", "Ү": "y",
+    # Greek
+    "α": "a", "Α": "a", "β": "b", "Β": "b", "ε": "e", "Ε": "e", "η": "n", "Η": "h", "ι": "i",
+    "Ι": "i", "κ": "k", "Κ": "k", "μ": "u", "Μ": "m", "ν": "v", "Ν": "n", "ο": "o", "Ο": "o",
+    "ρ": "p", "Ρ": "p", "τ": "t", "Τ": "t", "υ": "u", "Υ": "y", "χ": "x", "Χ": "x", "Ζ": "z",
+    # Armenian, Latin extensions and symbols
+    "օ": "o", "ս": "u", "ı": "i", "ȷ": "j", "ɑ": "a", "ɡ": "g", "ɩ": "i", "ʀ": "r", "ʏ": "y",
+    "ℓ": "l", "∕": "/", "⁄": "/",
+}
+# Invisible characters that are not format (Cf) characters.
+INVISIBLE = {"\u034f", "\u115f", "\u1160", "\u17b4", "\u17b5", "\u180e", "\u3164", "\uffa0"}
+# Combining marks stripped wherever they appear (accents, "Zalgo" stacking).
+# Marks of other scripts (e.g. Devanagari vowel signs) are part of the word and kept.
+_DIACRITICS = re.compile("[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]")
+# Characters whose mapping is cached; beyond that, new ones are still folded, just not remembered.
+MAX_TABLE_SIZE = 65536
+
+
+def _fold_char(char):
+    if char in CONFUSABLES:
+        return CONFUSABLES[char]
+    if char in INVISIBLE or unicodedata.category(char) == "Cf" or _DIACRITICS.match(char):
+        return ""
+    folded = unicodedata.normalize("NFKC", char)
+    if not folded.isascii():
+        stripped = _DIACRITICS.sub("", unicodedata.normalize("NFKD", folded))
+        if stripped.isascii():
+            folded = stripped
+    return "".join(CONFUSABLES.get(c, c) for c in folded).casefold()
+
+
+class _FoldTable(dict):
+    """str.translate table: ASCII and known confusables up front, the rest on first use."""
+
+    def __missing__(self, code):
+        folded = _fold_char(chr(code))
+        if len(self) < MAX_TABLE_SIZE:
+            self[code] = folded
+        return folded
+
+
+_TABLE = _FoldTable({code: chr(code).lower() for code in range(128)})
+_TABLE.update({ord(char): _fold_char(char) for char in CONFUSABLES})
+
+# Four or more single letters split by the same short separator: "i.g.n.o.r.e", "p a s s".
+_STUFFED = re.compile(
+    r"(?<![^\W_])[^\W\d_](?P<sep>[^\w\n,;:]{1,3}|_{1,3})[^\W\d_](?:(?P=sep)[^\W\d_]){2,}(?![^\W_])"
+)
+
+
+@lru_cache(maxsize=MAX_TABLE_SIZE)
+def _obfuscating(char):
+    """True for characters only used to disguise text: look-alikes, invisibles, stray marks, width/style variants."""
+    return (char in CONFUSABLES or char in INVISIBLE or unicodedata.category(char) == "Cf"
+            or bool(_DIACRITICS.match(char)) or unicodedata.normalize("NFKC", char) != char)
+
+
+# --- NORMALIZED TEXT ---
+class NormalizedText:
+    """A raw text and its normalized view.
+
+    `text` is what rules and fingerprints look at; `raw` is what the user
+    sent. `changed` is False when `text` differs from `raw` only by case, in
+    which case matching `text` is the same as matching `raw` ignoring case.
+    `obfuscated` is True when normalization undid an actual disguise (split
+    letters, look-alikes, invisible or styled characters) rather than only
+    folding case and ordinary accents.
+    """
+
+    __slots__ = ("raw", "text", "changed", "obfuscated", "_identity", "_removed", "_offsets")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._identity = raw.isascii()  # ASCII folds one character to one
+        folded = raw.lower() if self._identity else raw.translate(_TABLE)
+        self._removed = []  # separator spans dropped from `folded`
+        parts = []
+        last = 0
+        for found in _STUFFED.finditer(folded):
+            sep = found.group("sep")
+            for start in range(found.start() + 1, found.end(), len(sep) + 1):
+                parts.append(folded[last:start])
+                self._removed.append((start, start + len(sep)))
+                last = start + len(sep)
+        if parts:
+            parts.append(folded[last:])
+            folded = "".join(parts)
+        self.text = folded
+        self.changed = bool(self._removed) or (not self._identity and folded != raw.casefold())
+        self.obfuscated = bool(self._removed) or (
+            self.changed and any(_obfuscating(char) for char in set(raw) if not char.isascii())
+        )
+        self._offsets = None
+
+    def __repr__(self):
+        return f"NormalizedText({self.raw!r} -> {self.text!r})"
+
+    @property
+    def views(self):
+        """Texts a rule is checked against: the normalized view, then the raw text if it differs."""
+        return (self.text, self.raw) if self.changed else (self.text,)
+
+    def search(self, compiled):
+        """compiled.search() over the views; returns the first match or None."""
+        for view in self.views:
+            found = compiled.search(view)
+            if found:
+                return found
+        return None
+
+    @property
+    def offsets(self):
+        """offsets[i] is the raw index of text[i]; offsets[len(text)] is len(raw)."""
+        if self._offsets is None:
+            if self._identity:
+                folded_offsets = list(range(len(self.raw)))
+            else:
+                folded_offsets = []
+                for index, char in enumerate(self.raw):
+                    folded_offsets.extend([index] * len(_TABLE[ord(char)]))
+            if self._removed:
+                kept = []
+                last = 0
+                for start, end in self._removed:
+                    kept.extend(folded_offsets[last:start])
+                    last = end
+                kept.extend(folded_offsets[last:])
+                folded_offsets = kept
+            folded_offsets.append(len(self.raw))
+            self._offsets = folded_offsets
+        return self._offsets
+
+    def span(self, start, end):
+        """Raw (start, end) covering text[start:end]."""
+        offsets = self.offsets
+        if end <= start:
+            return offsets[start], offsets[start]
+        return offsets[start], offsets[end - 1] + 1
+
+    def raw_slice(self, start, end):
+        raw_start, raw_end = self.span(start, end)
+        return self.raw[raw_start:raw_end]
+
+
+def normalize(text):
+    """Normalizes text once; pass the result to every layer instead of the raw string."""
+    return text if isinstance(text, NormalizedText) else NormalizedText(text)
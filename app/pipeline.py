@@ -0,0 +1,242 @@
+# app/pipeline.py
+"""Runs Layers 1-3 for one request according to its route's policy.
+
+- Mode "sequential": verdict cache, static rules and fingerprints, then the
+  ML classifier, then the LLM call.
+- Mode "speculative": the LLM call starts as soon as static rules and
+  fingerprints pass and runs alongside the ML classifier. If ML blocks, the
+  call is cancelled (the gateway keeps it running only for identical
+  requests still waiting on it) and its response never reaches Layer 4 or
+  the user; the prompt may have reached the provider, though. Streams always
+  run sequentially: tokens cannot be taken back once forwarded.
+- Pre-score: a cheap check (short, no override/imperative vocabulary, no
+  chat-template markup, no obfuscation undone by normalization) marks
+  trivially benign prompts, for which ML is skipped or run under a short
+  time limit that fails open.
+- Time limits: static rules and fingerprints always fail closed
+  (LayerTimeout, a 503); ML fails closed or open per policy. A layer that
+  runs past its limit keeps running on its thread and still logs and caches.
+
+Per-route policies come from the PIPELINE_* settings in app/config.py.
+"""
+import asyncio
+import json
+import re
+import time
+
+from app.concurrency import run_blocking
+from app.config import (
+    ML_TIMEOUT,
+    ML_TIMEOUT_POLICY,
+    PIPELINE_DOWNGRADE_TIMEOUT,
+    PIPELINE_MODE,
+    PIPELINE_PRESCORE,
+    PIPELINE_ROUTES,
+    PRESCORE_MAX_CHARS,
+    SCREEN_TIMEOUT,
+)
+from app.gateway import LLMUnavailable
+from app.layers import finish_screen, prescreen
+from app.llm import FALLBACK_RESPONSE
+from app.metrics import (
+    LAYER_LATENCY,
+    LAYER_TIMEOUTS,
+    PIPELINE_DISCARDED_LLM_CALLS,
+    PIPELINE_LATENCY_SAVED,
+    PIPELINE_ROUTING,
+)
+from app.tracing import span
+
+MODES = ("sequential", "speculative")
+PRESCORE_ACTIONS = ("off", "skip", "downgrade")
+TIMEOUT_POLICIES = ("closed", "open")
+
+# Vocabulary of prompts that talk to the model about its instructions rather than ask something.
+RISK_WORDS = frozenset((
+    "ignore", "disregard", "forget", "override", "bypass", "circumvent", "pretend", "act", "roleplay",
+    "simulate", "persona", "jailbreak", "jailbroken", "dan", "developer", "sudo", "admin", "root", "system",
+    "prompt", "instruction", "instructions", "rule", "rules", "guidelines", "policy", "previous", "prior",
+    "above", "earlier", "reveal", "repeat", "print", "leak", "secret", "password", "confidential",
+    "hidden", "unrestricted", "uncensored", "unfiltered", "filter", "restrictions", "execute", "command",
+    "obey", "comply", "must", "now", "new", "mode", "enable", "disable",
+))
+# Chat-template and markup fragments used to smuggle in fake turns.
+_MARKUP = re.compile(r"<\||\|>|\[/?inst\]|<<sys>>|###|```|\{\{|^\s*(?:system|assistant|user)\s*:", re.MULTILINE)
+_WORD = re.compile(r"[^\W_]+")
+# Weight of the newest ML timing in the running estimate of what skipping ML saves.
+_EWMA_WEIGHT = 0.1
+
+_LLM_LATENCY = LAYER_LATENCY.labels("llm")
+
+
+def is_low_risk(normalized, max_chars=PRESCORE_MAX_CHARS):
+    """Cheap pre-score: True for prompts too plain to be worth an ML pass."""
+    text = normalized.text
+    if normalized.obfuscated or len(text) > max_chars or _MARKUP.search(text):
+        return False
+    return RISK_WORDS.isdisjoint(_WORD.findall(text))
+
+
+class LayerTimeout(Exception):
+    """A layer ran past its time limit under a fail-closed policy."""
+
+    def __init__(self, layer):
+        super().__init__(f"{layer} timed out")
+        self.layer = layer
+
+
+# --- POLICIES ---
+class PipelinePolicy:
+    """How one route runs the layers; time limits are in seconds, 0 = none."""
+
+    def __init__(self, mode=PIPELINE_MODE, prescore=PIPELINE_PRESCORE, screen_timeout=SCREEN_TIMEOUT,
+                 ml_timeout=ML_TIMEOUT, ml_timeout_policy=ML_TIMEOUT_POLICY,
+                 downgrade_timeout=PIPELINE_DOWNGRADE_TIMEOUT):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+        if prescore not in PRESCORE_ACTIONS:
+            raise ValueError(f"prescore must be one of {PRESCORE_ACTIONS}, got {prescore!r}")
+        if ml_timeout_policy not in TIMEOUT_POLICIES:
+            raise ValueError(f"ml_timeout_policy must be one of {TIMEOUT_POLICIES}, got {ml_timeout_policy!r}")
+        self.mode = mode
+        self.prescore = prescore
+        self.screen_timeout = max(0.0, float(screen_timeout))
+        self.ml_timeout = max(0.0, float(ml_timeout))
+        self.ml_timeout_policy = ml_timeout_policy
+        self.downgrade_timeout = max(0.0, float(downgrade_timeout))
+
+
+def load_policies(routes=PIPELINE_ROUTES):
+    """Per-route policies from a JSON object of overrides; routes not listed use the defaults."""
+    if not routes:
+        return {}
+    try:
+        overrides = json.loads(routes)
+    except ValueError as e:
+        raise ValueError(f"PROMPTSHIELD_PIPELINE_ROUTES is not valid JSON: {e}") from e
+    return {route: PipelinePolicy(**settings) for route, settings in overrides.items()}
+
+
+async def _limit(awaitable, timeout):
+    return await asyncio.wait_for(awaitable, timeout) if timeout else await awaitable
+
+
+def _discard(task):
+    """Cancels an unwanted LLM call; whatever it ends with is retrieved, never raised."""
+    task.cancel()
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+
+# --- EXECUTOR ---
+class PipelineExecutor:
+    """Layers 1-3 under per-route policies; Layer 4 stays with the caller."""
+
+    def __init__(self, gateway, policies=None):
+        self.gateway = gateway
+        self.policies = load_policies() if policies is None else policies
+        self.default_policy = PipelinePolicy()
+        self._ml_seconds = None  # running estimate of one uncached ML pass
+
+    def policy_for(self, route):
+        return self.policies.get(route, self.default_policy)
+
+    async def _prescreen(self, prompt, policy):
+        try:
+            with span("screen"):
+                return await _limit(run_blocking(prescreen, prompt), policy.screen_timeout)
+        except asyncio.TimeoutError:
+            LAYER_TIMEOUTS.labels("static", "closed").inc()
+            raise LayerTimeout("Static Rule Checker") from None
+
+    async def _classify(self, screening, policy, route):
+        """Finishes Layers 1-2; returns (verdict, path) where path names what was run."""
+        if screening.verdict is not None:
+            return screening.verdict, "decided_early"
+        low_risk = policy.prescore != "off" and is_low_risk(screening.normalized)
+        if low_risk and policy.prescore == "skip":
+            if self._ml_seconds is not None:
+                PIPELINE_LATENCY_SAVED.labels(route, "ml_skipped").observe(self._ml_seconds)
+            return {"safe": True, "layer": None, "score": 0.0, "details": "Safe (low risk, ML skipped)"}, "ml_skipped"
+        timeout, on_timeout = policy.ml_timeout, policy.ml_timeout_policy
+        if low_risk:
+            timeout, on_timeout = policy.downgrade_timeout, "open"
+        started = time.perf_counter()
+        try:
+            with span("ml_screen", low_risk=low_risk):
+                verdict = await _limit(run_blocking(finish_screen, screening), timeout)
+        except asyncio.TimeoutError:
+            LAYER_TIMEOUTS.labels("ml", on_timeout).inc()
+            if on_timeout == "closed":
+                raise LayerTimeout("ML Classifier") from None
+            if low_risk and self._ml_seconds is not None:
+                saved = max(0.0, self._ml_seconds - (time.perf_counter() - started))
+                PIPELINE_LATENCY_SAVED.labels(route, "ml_downgraded").observe(saved)
+            return {"safe": True, "layer": None, "score": 0.0, "details": "Safe (ML timed out, failed open)"}, \
+                "ml_downgraded" if low_risk else "ml_timeout_open"
+        elapsed = time.perf_counter() - started
+        if self._ml_seconds is None:
+            self._ml_seconds = elapsed
+        else:
+            self._ml_seconds += _EWMA_WEIGHT * (elapsed - self._ml_seconds)
+        return verdict, "ml_downgraded" if low_risk else "ml"
+
+    async def _complete(self, prompt):
+        """Layer 3 through the gateway; returns (response, seconds taken)."""
+        started = time.perf_counter()
+        try:
+            with span("llm"):
+                response = await self.gateway.complete(prompt)
+        except LLMUnavailable as e:
+            print(f"LLM Unavailable: {e}")
+            raise
+        except Exception as e:
+            print(f"LLM Error: {e}")
+            response = FALLBACK_RESPONSE
+        finally:
+            elapsed = time.perf_counter() - started
+            _LLM_LATENCY.observe(elapsed)
+        return response, elapsed
+
+    async def screen(self, prompt, route):
+        """Layers 1-2 only (streaming routes); returns the verdict dict.
+
+        Raises LayerTimeout, or ModelUnavailable while the classifier is not loaded.
+        """
+        policy = self.policy_for(route)
+        screening = await self._prescreen(prompt, policy)
+        verdict, path = await self._classify(screening, policy, route)
+        PIPELINE_ROUTING.labels(route, "sequential", path).inc()
+        return verdict
+
+    async def run(self, prompt, route):
+        """Layers 1-3; returns (verdict, response), response None when blocked.
+
+        Raises LayerTimeout, ModelUnavailable, or LLMUnavailable while the provider is failing.
+        """
+        policy = self.policy_for(route)
+        screening = await self._prescreen(prompt, policy)
+        if policy.mode == "sequential" or screening.verdict is not None:
+            verdict, path = await self._classify(screening, policy, route)
+            PIPELINE_ROUTING.labels(route, policy.mode, path).inc()
+            if not verdict["safe"]:
+                return verdict, None
+            response, _ = await self._complete(prompt)
+            return verdict, response
+
+        llm = asyncio.ensure_future(self._complete(prompt))
+        started = time.perf_counter()
+        try:
+            verdict, path = await self._classify(screening, policy, route)
+        except BaseException:
+            _discard(llm)
+            raise
+        ml_seconds = time.perf_counter() - started
+        PIPELINE_ROUTING.labels(route, policy.mode, path).inc()
+        if not verdict["safe"]:
+            _discard(llm)
+            PIPELINE_DISCARDED_LLM_CALLS.labels(route).inc()
+            return verdict, None
+        response, llm_seconds = await llm
+        # Sequentially the two would have added up; overlapped, the shorter one is hidden.
+        PIPELINE_LATENCY_SAVED.labels(route, "speculative").observe(min(ml_seconds, llm_seconds))
+        return verdict, response
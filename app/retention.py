@@ -0,0 +1,295 @@
+# app/retention.py
+"""Retention for the flagged_prompts log: rollups, archives and pruning.
+
+Usage:
+    python -m app.retention              # one pass
+    python -m app.retention --every 3600 # keep running
+
+Each pass:
+1. Rolls every complete hour since the last pass into `flagged_prompt_rollups`
+   (events, score sum/min/max and a 10-bin score histogram per layer), then
+   rolls complete days up from those hours.
+2. Moves raw events older than RETENTION_DAYS, and already rolled up, into
+   append-only gzip JSONL files (one per day) under ARCHIVE_DIR, deleting
+   them from the hot table in small batches so writers are never blocked
+   for long.
+
+`iter_history()` streams archived and live events back in time order for
+offline mining.
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.config import (
+    ARCHIVE_DIR,
+    RETENTION_BATCH_PAUSE,
+    RETENTION_BATCH_SIZE,
+    RETENTION_DAYS,
+    ROLLUP_LAG_MINUTES,
+)
+from app.models import engine
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+HOUR_FORMAT = "%Y-%m-%d %H:00:00"
+HISTOGRAM_BINS = 10
+ARCHIVE_PATTERN = "flagged_prompts-{day}.jsonl.gz"
+EVENT_COLUMNS = ("id", "prompt", "blocked_layer", "confidence_score", "timestamp", "blocked_content",
+                 "matched_event_id")
+
+
+# --- STATE ---
+def get_state(conn, name):
+    row = conn.execute(text("SELECT value FROM retention_state WHERE name = :name"), {"name": name}).first()
+    return row[0] if row else None
+
+
+def set_state(conn, name, value):
+    conn.execute(text("INSERT OR REPLACE INTO retention_state (name, value) VALUES (:name, :value)"),
+                 {"name": name, "value": value})
+
+
+def rollup_watermark():
+    """Start of the first hour not yet rolled up ('YYYY-MM-DD HH:00:00'), or None."""
+    with engine.connect() as conn:
+        return get_state(conn, "rollup_watermark")
+
+
+# --- ROLLUPS ---
+def _floor_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _upsert_rollups(conn, period, groups):
+    rows = [
+        {
+            "period": period,
+            "bucket_start": bucket,
+            "blocked_layer": layer,
+            "events": g["events"],
+            "score_sum": g["score_sum"],
+            "score_min": g["score_min"],
+            "score_max": g["score_max"],
+            "score_histogram": json.dumps(g["histogram"]),
+        }
+        for (bucket, layer), g in groups.items()
+    ]
+    if rows:
+        conn.execute(text(
+            "INSERT OR REPLACE INTO flagged_prompt_rollups "
+            "(period, bucket_start, blocked_layer, events, score_sum, score_min, score_max, score_histogram) "
+            "VALUES (:period, :bucket_start, :blocked_layer, :events, :score_sum, :score_min, :score_max, :score_histogram)"
+        ), rows)
+
+
+def _new_group():
+    return {"events": 0, "score_sum": 0.0, "score_min": None, "score_max": None, "histogram": [0] * HISTOGRAM_BINS}
+
+
+def _merge(group, events, score_sum, score_min, score_max, histogram):
+    group["events"] += events
+    group["score_sum"] += score_sum
+    group["score_min"] = score_min if group["score_min"] is None else min(group["score_min"], score_min)
+    group["score_max"] = score_max if group["score_max"] is None else max(group["score_max"], score_max)
+    for i, count in enumerate(histogram):
+        group["histogram"][i] += count
+
+
+def _rollup_hours(conn, start, end):
+    """Aggregates raw events in [start, end) into hourly rollups (idempotent)."""
+    result = conn.execute(text(
+        "SELECT strftime('%Y-%m-%d %H:00:00', timestamp) AS bucket, blocked_layer, "
+        f"MIN(CAST(COALESCE(confidence_score, 0) * {HISTOGRAM_BINS} AS INTEGER), {HISTOGRAM_BINS - 1}) AS bin, "
+        "COUNT(*), SUM(COALESCE(confidence_score, 0)), MIN(confidence_score), MAX(confidence_score) "
+        "FROM flagged_prompts WHERE timestamp >= :start AND timestamp < :end "
+        "GROUP BY bucket, blocked_layer, bin"
+    ), {"start": start, "end": end})
+    groups = defaultdict(_new_group)
+    for bucket, layer, score_bin, events, score_sum, score_min, score_max in result:
+        histogram = [0] * HISTOGRAM_BINS
+        histogram[max(0, score_bin)] = events
+        _merge(groups[(bucket, layer)], events, score_sum, score_min, score_max, histogram)
+    _upsert_rollups(conn, "hour", groups)
+    return len(groups)
+
+
+def _rollup_days(conn, first_day, end_day):
+    """Rebuilds daily rollups for [first_day, end_day) from the hourly ones."""
+    result = conn.execute(text(
+        "SELECT substr(bucket_start, 1, 10), blocked_layer, events, score_sum, score_min, score_max, score_histogram "
+        "FROM flagged_prompt_rollups WHERE period = 'hour' AND bucket_start >= :start AND bucket_start < :end"
+    ), {"start": first_day, "end": end_day})
+    groups = defaultdict(_new_group)
+    for day, layer, events, score_sum, score_min, score_max, histogram in result:
+        _merge(groups[(f"{day} 00:00:00", layer)], events, score_sum, score_min, score_max, json.loads(histogram))
+    _upsert_rollups(conn, "day", groups)
+
+
+def run_rollups(now=None, lag_minutes=ROLLUP_LAG_MINUTES, hours_per_transaction=24):
+    """Rolls up every complete hour since the watermark; returns hours processed."""
+    now = now or datetime.utcnow()
+    end = _floor_hour(now - timedelta(minutes=lag_minutes))
+    with engine.connect() as conn:
+        watermark = get_state(conn, "rollup_watermark")
+        if watermark is None:
+            oldest = conn.execute(text("SELECT MIN(timestamp) FROM flagged_prompts")).scalar()
+            if oldest is None:
+                return 0
+            watermark = _floor_hour(datetime.strptime(oldest[:19], "%Y-%m-%d %H:%M:%S")).strftime(HOUR_FORMAT)
+    start = datetime.strptime(watermark, HOUR_FORMAT)
+    hours = 0
+    while start < end:
+        # Short transactions: one day of hours at a time.
+        stop = min(end, start + timedelta(hours=hours_per_transaction))
+        with engine.begin() as conn:
+            _rollup_hours(conn, start.strftime(HOUR_FORMAT), stop.strftime(HOUR_FORMAT))
+            # Days that are now complete (or partially refreshed) are rebuilt from hours.
+            first_day = start.strftime("%Y-%m-%d")
+            end_day = (stop + timedelta(days=1)).strftime("%Y-%m-%d") if stop.hour else stop.strftime("%Y-%m-%d")
+            _rollup_days(conn, first_day, end_day)
+            set_state(conn, "rollup_watermark", stop.strftime(HOUR_FORMAT))
+        hours += int((stop - start).total_seconds() // 3600)
+        start = stop
+    return hours
+
+
+# --- ARCHIVE & PRUNE ---
+def archive_path(day, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, ARCHIVE_PATTERN.format(day=day))
+
+
+def _append_archive(rows, archive_dir):
+    by_day = defaultdict(list)
+    for row in rows:
+        by_day[row["timestamp"][:10]].append(row)
+    os.makedirs(archive_dir, exist_ok=True)
+    for day, events in by_day.items():
+        # Each append is a new gzip member; gzip readers treat the file as one stream.
+        with open(archive_path(day, archive_dir), "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                f.write("".join(json.dumps(event) + "\n" for event in events).encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+def archive_and_prune(now=None, retention_days=RETENTION_DAYS, batch_size=RETENTION_BATCH_SIZE,
+                      pause=RETENTION_BATCH_PAUSE, archive_dir=ARCHIVE_DIR):
+    """Moves expired, rolled-up events to the archive; returns how many were moved."""
+    now = now or datetime.utcnow()
+    cutoff = (now - timedelta(days=retention_days)).strftime(TIMESTAMP_FORMAT)
+    watermark = rollup_watermark()
+    if watermark is None:
+        return 0
+    # Never drop raw events whose hour is not in the rollups yet.
+    cutoff = min(cutoff, watermark)
+
+    moved = 0
+    while True:
+        with engine.connect() as conn:
+            rows = [dict(row._mapping) for row in conn.execute(text(
+                f"SELECT {', '.join(EVENT_COLUMNS)} FROM flagged_prompts "
+                "WHERE timestamp < :cutoff ORDER BY timestamp, id LIMIT :limit"
+            ), {"cutoff": cutoff, "limit": batch_size})]
+        if not rows:
+            break
+        # Archive first, then delete: a crash in between only duplicates
+        # events in the archive (readers skip repeated ids), never loses them.
+        _append_archive(rows, archive_dir)
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM flagged_prompts WHERE id = :id"), [{"id": row["id"]} for row in rows])
+        moved += len(rows)
+        if pause:
+            time.sleep(pause)
+
+    if moved:
+        with engine.connect() as conn:
+            # Returns freed pages to the OS on databases created with auto_vacuum=INCREMENTAL.
+            conn.exec_driver_sql("PRAGMA incremental_vacuum(1000)")
+    return moved
+
+
+def run_retention(now=None):
+    """One full pass: rollups first, so pruned events are always counted."""
+    started = time.perf_counter()
+    hours = run_rollups(now)
+    moved = archive_and_prune(now)
+    print(f"[{time.strftime('%H:%M:%S')}] Retention: rolled up {hours} hours, "
+          f"archived {moved} events in {time.perf_counter() - started:.1f}s")
+    return {"hours_rolled_up": hours, "events_archived": moved}
+
+
+# --- READING HISTORY ---
+def _matches(event, since, until, layers):
+    if since is not None and event["timestamp"] < since:
+        return False
+    if until is not None and event["timestamp"] >= until:
+        return False
+    return not layers or event["blocked_layer"] in layers
+
+
+def iter_archived(since=None, until=None, layers=None, archive_dir=ARCHIVE_DIR):
+    """Streams archived events (dicts) in day order, one line at a time."""
+    since = since.strftime(TIMESTAMP_FORMAT) if hasattr(since, "strftime") else since
+    until = until.strftime(TIMESTAMP_FORMAT) if hasattr(until, "strftime") else until
+    for path in sorted(glob.glob(os.path.join(archive_dir, ARCHIVE_PATTERN.format(day="*")))):
+        day = os.path.basename(path)[len("flagged_prompts-"):-len(".jsonl.gz")]
+        if (since is not None and day < since[:10]) or (until is not None and day > until[:10]):
+            continue
+        seen = set()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                event = json.loads(line)
+                if event["id"] in seen:
+                    continue
+                seen.add(event["id"])
+                if _matches(event, since, until, layers):
+                    yield event
+
+
+def iter_live(since=None, until=None, layers=None, batch_size=1000):
+    """Streams events still in logs.db, oldest first, in keyset-paginated batches."""
+    since = since.strftime(TIMESTAMP_FORMAT) if hasattr(since, "strftime") else since
+    until = until.strftime(TIMESTAMP_FORMAT) if hasattr(until, "strftime") else until
+    cursor = (since or "", -1)
+    while True:
+        with engine.connect() as conn:
+            rows = [dict(row._mapping) for row in conn.execute(text(
+                f"SELECT {', '.join(EVENT_COLUMNS)} FROM flagged_prompts "
+                "WHERE (timestamp, id) > (:ts, :id) ORDER BY timestamp, id LIMIT :limit"
+            ), {"ts": cursor[0], "id": cursor[1], "limit": batch_size})]
+        for row in rows:
+            if until is not None and row["timestamp"] >= until:
+                return
+            if _matches(row, since, until, layers):
+                yield row
+        if len(rows) < batch_size:
+            return
+        cursor = (rows[-1]["timestamp"], rows[-1]["id"])
+
+
+def iter_history(since=None, until=None, layers=None, archive_dir=ARCHIVE_DIR):
+    """Archived then live events, so history mining sees everything ever logged."""
+    yield from iter_archived(since, until, layers, archive_dir)
+    yield from iter_live(since, until, layers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--every", type=float, help="Repeat every N seconds instead of running once")
+    args = parser.parse_args()
+    while True:
+        run_retention()
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
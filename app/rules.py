@@ -0,0 +1,462 @@
+# app/rules.py
+import hashlib
+import json
+import re
+import threading
+import time
+
+try:
+    from re import _constants as _sre, _parser as _sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover - older interpreters
+    import sre_constants as _sre
+    import sre_parse as _sre_parse
+
+from collections import Counter
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.config import (
+    RULE_HITS_FLUSH_INTERVAL,
+    RULES_COMBINE_CHUNK,
+    RULES_RELOAD_INTERVAL,
+)
+from app.models import RuleHit, engine
+
+# Anchors shorter than this match too often to be a useful prefilter.
+MIN_ANCHOR_LENGTH = 3
+# Cap on the number of literal alternatives expanded for one anchor.
+MAX_ANCHOR_ALTERNATIVES = 32
+
+# A leading global flag group such as "(?i)", which cannot appear mid-pattern.
+_LEADING_FLAGS = re.compile(r"^\(\?([aiLmsux]+)\)")
+# Constructs that break when a pattern is embedded in a larger alternation:
+# backreferences and any "(?...)" group other than plain/lookaround groups.
+_UNCOMBINABLE = re.compile(r"\\[1-9]|\\g<|\(\?(?![:=!]|<[=!])")
+
+
+class AhoCorasick:
+    """Multi-literal automaton: finds every literal in a single pass over the text."""
+
+    def __init__(self, words):
+        # words: iterable of (rule_index, casefolded literal)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for index, word in words:
+            node = 0
+            for char in word:
+                nxt = self._goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                node = nxt
+            if index not in self._out[node]:
+                self._out[node] += (index,)
+        self._build_failure_links()
+
+    def __len__(self):
+        return len(self._goto) - 1
+
+    def _build_failure_links(self):
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                # Fold the suffix-link outputs in so matching never walks the chain.
+                inherited = self._out[self._fail[child]]
+                if inherited:
+                    self._out[child] = tuple(sorted(set(self._out[child] + inherited)))
+
+    def find(self, text):
+        """Returns the set of rule indices whose literals occur in text."""
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        found = set()
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+def _cross(left, right):
+    combined = {a + b for a in left for b in right}
+    return combined if len(combined) <= MAX_ANCHOR_ALTERNATIVES else None
+
+
+def _exact_strings(items):
+    """Returns every string a parsed sub-pattern can match, or None if unbounded."""
+    strings = {""}
+    for op, av in items:
+        if op is _sre.LITERAL:
+            options = {chr(av)}
+        elif op is _sre.SUBPATTERN:
+            options = _exact_strings(av[-1])
+        elif op is _sre.BRANCH:
+            options = set()
+            for alternative in av[1]:
+                alt = _exact_strings(alternative)
+                if alt is None:
+                    return None
+                options |= alt
+        else:
+            return None
+        if options is None:
+            return None
+        strings = _cross(strings, options)
+        if strings is None:
+            return None
+    return strings
+
+
+def _better(candidate, current):
+    if not candidate or min(len(s) for s in candidate) < MIN_ANCHOR_LENGTH:
+        return current
+    if current is None:
+        return candidate
+    score = lambda anchor: (min(len(s) for s in anchor), -len(anchor))
+    return candidate if score(candidate) > score(current) else current
+
+
+def _required_literals(items, prefix=frozenset({""})):
+    """Finds a set of literals at least one of which occurs in every match."""
+    best = None
+    run = set(prefix)
+    for op, av in items:
+        exact = _exact_strings([(op, av)])
+        if exact is not None:
+            extended = _cross(run, exact)
+            if extended is None:
+                best = _better(run, best)
+                extended = exact
+            run = extended
+            continue
+
+        best = _better(run, best)
+        if op is _sre.SUBPATTERN:
+            best = _better(_required_literals(av[-1], run), best)
+        elif op is _sre.ATOMIC_GROUP:
+            best = _better(_required_literals(av, run), best)
+        elif op in (_sre.MAX_REPEAT, _sre.MIN_REPEAT, _sre.POSSESSIVE_REPEAT) and av[0] >= 1:
+            best = _better(_required_literals(av[2], run), best)
+        elif op is _sre.BRANCH:
+            union = set()
+            for alternative in av[1]:
+                anchor = _required_literals(alternative, run)
+                if anchor is None:
+                    union = None
+                    break
+                union |= anchor
+            best = _better(union, best)
+        run = {""}
+    return _better(run, best)
+
+
+def extract_anchors(pattern):
+    """Returns casefolded literals that any match of pattern must contain, or None."""
+    try:
+        parsed = _sre_parse.parse(pattern)
+    except re.error:
+        return None
+    anchors = _required_literals(list(parsed))
+    if anchors is None:
+        return None
+    return sorted({anchor.casefold() for anchor in anchors})
+
+
+def _combinable_body(pattern):
+    """Strips a leading "(?i)" so the pattern can sit inside an alternation, or returns None."""
+    body = pattern
+    flags = _LEADING_FLAGS.match(body)
+    if flags:
+        if set(flags.group(1)) - {"i"}:
+            return None
+        body = body[flags.end():]
+    if _UNCOMBINABLE.search(body):
+        return None
+    return body
+
+
+class CompiledRuleSet:
+    """Immutable, precompiled view of the static rules.
+
+    Every rule contributes the literals it cannot match without to a single
+    Aho-Corasick automaton, so one linear pass over the prompt yields the few
+    candidate rules worth running. Rules with no usable literal are folded into
+    combined alternations. The reported rule is always the first matching
+    pattern in file order, exactly as a pattern-by-pattern scan would report it.
+
+    `plan` (from evolution/optimizer.py) lists patterns in the order candidate
+    rules are confirmed: cheap, frequently hit rules first. Patterns missing
+    from the plan follow in file order. The plan only changes how quickly the
+    reported rule is found, never which rule is reported.
+    """
+
+    def __init__(self, patterns, version=None, chunk_size=RULES_COMBINE_CHUNK, plan=None):
+        self.patterns = list(patterns)
+        self.version = version or ruleset_version(self.patterns)
+        self.plan = list(plan or [])
+        planned = {}
+        for rank, pattern in enumerate(self.plan):
+            planned.setdefault(pattern, rank)
+        # Lower rank is tried first; None keeps plain file order.
+        self._rank = {
+            index: planned.get(pattern, len(planned) + index) for index, pattern in enumerate(self.patterns)
+        } if planned else None
+        self.invalid = []
+        self._compiled = {}
+
+        anchored = []
+        unanchored = []
+        for index, pattern in enumerate(self.patterns):
+            try:
+                self._compiled[index] = re.compile(pattern, re.IGNORECASE)
+            except re.error as e:
+                print(f"Skipping invalid static rule {pattern!r}: {e}")
+                self.invalid.append(pattern)
+                continue
+            anchors = extract_anchors(pattern)
+            if anchors:
+                anchored.extend((index, anchor) for anchor in anchors)
+            else:
+                unanchored.append(index)
+
+        self._automaton = AhoCorasick(anchored) if anchored else None
+        self._unanchored = unanchored
+        self._scanners = []
+        self._standalone = []
+        combinable = []
+        for index in unanchored:
+            body = _combinable_body(self.patterns[index])
+            if body is None:
+                self._standalone.append(index)
+            else:
+                combinable.append((index, body))
+        for start in range(0, len(combinable), max(1, chunk_size)):
+            self._add_scanner(combinable[start:start + chunk_size])
+        self._standalone.sort()
+
+    def _add_scanner(self, chunk):
+        source = "|".join(f"(?P<r{index}>{body})" for index, body in chunk)
+        try:
+            scanner = re.compile(source, re.IGNORECASE)
+        except re.error:
+            # Rare interaction between bodies; fall back to scanning them one by one.
+            self._standalone.extend(index for index, _ in chunk)
+            return
+        names = {f"r{index}": index for index, _ in chunk}
+        self._scanners.append((scanner, names))
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def match(self, text):
+        """Returns the first rule (in file order) matching text, or None."""
+        # Best confirmed hit among the rules without anchors.
+        best = None
+        for scanner, names in self._scanners:
+            found = scanner.search(text)
+            if found:
+                index = names[found.lastgroup]
+                if best is None or index < best:
+                    best = index
+        for index in self._standalone:
+            if best is not None and index >= best:
+                break
+            if self._compiled[index].search(text):
+                best = index
+
+        candidates = self._automaton.find(text.casefold()) if self._automaton else set()
+        if best is not None:
+            # Combined scans report the leftmost hit, not the lowest-index rule,
+            # so earlier unanchored rules must be confirmed individually too.
+            candidates.update(index for index in self._unanchored if index < best)
+            candidates = {index for index in candidates if index < best}
+
+        if self._rank is None:
+            for index in sorted(candidates):
+                if self._compiled[index].search(text):
+                    return self.patterns[index]
+            return self.patterns[best] if best is not None else None
+
+        order = sorted(candidates, key=self._rank.__getitem__)
+        for n, index in enumerate(order):
+            if self._compiled[index].search(text):
+                # Unchecked candidates earlier in file order still take precedence.
+                for earlier in sorted(i for i in order[n + 1:] if i < index):
+                    if self._compiled[earlier].search(text):
+                        return self.patterns[earlier]
+                return self.patterns[index]
+        return self.patterns[best] if best is not None else None
+
+    def match_normalized(self, normalized):
+        """match() over a NormalizedText: its normalized view first, then the raw text if it differs."""
+        for view in normalized.views:
+            pattern = self.match(view)
+            if pattern is not None:
+                return pattern
+        return None
+
+
+def ruleset_version(patterns):
+    """Content hash of a rule list; changes whenever any pattern changes."""
+    digest = hashlib.sha256("\n".join(patterns).encode("utf-8")).hexdigest()
+    return digest[:16]
+
+
+def read_rules_document(path):
+    """Reads a rules JSON file as a dict with at least a "patterns" list."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return {**data, "patterns": data.get("patterns", [])}
+    return {"patterns": []}
+
+
+def read_rules_file(path):
+    """Reads the pattern list from a rules JSON file."""
+    return read_rules_document(path)["patterns"]
+
+
+class RuleEngine:
+    """Holds the active CompiledRuleSet and swaps it in when the rule store's version changes.
+
+    Readers never take a lock: `current()` returns whatever rule set is
+    installed. At most every `reload_interval` seconds one caller reads the
+    store's version number, and a rebuild only happens when it has changed.
+    """
+
+    def __init__(self, store, reload_interval=RULES_RELOAD_INTERVAL):
+        self.store = store
+        self.reload_interval = reload_interval
+        self._ruleset = CompiledRuleSet([])
+        self._stamp = None  # store version of the installed rule set
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock()
+
+    def current(self):
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._maybe_reload(now)
+        return self._ruleset
+
+    @property
+    def version(self):
+        return self.current().version
+
+    @property
+    def store_version(self):
+        """Rule store version of the installed rule set (None before the first load)."""
+        return self._stamp
+
+    def _maybe_reload(self, now):
+        # Only one thread rebuilds; everyone else keeps using the old rule set.
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = now + self.reload_interval
+            try:
+                stamp = self.store.head()
+                if stamp == self._stamp:
+                    return
+                document = self.store.get(stamp) if stamp else None
+            except Exception as e:
+                # Keep serving the last good rule set (e.g. database locked or unreachable).
+                print(f"Error reading the rule store: {e}. Keeping previous rules.")
+                return
+            if document is None:
+                self._ruleset = CompiledRuleSet([])
+            else:
+                self._ruleset = CompiledRuleSet(document["patterns"], version=document["digest"],
+                                                plan=document["plan"])
+            self._stamp = stamp
+        finally:
+            self._reload_lock.release()
+
+    def reload(self):
+        """Forces a version check on the next call to current()."""
+        self._next_check = 0.0
+
+
+_rule_hits = RuleHit.__table__
+
+
+class RuleHitCounter:
+    """Counts which static rule blocked each prompt, for the rule optimizer.
+
+    `hit()` only counts in memory, so the request path never touches the
+    database. `flush_due()` adds the counts to the `rule_hits` table in
+    logs.db at most every `flush_interval` seconds; it is registered as an
+    attack log writer listener, so flushes run on the writer thread right
+    after the blocks they count are stored. Each row is incremented in place
+    (an upsert), so API workers flushing at the same time never overwrite
+    each other's counts.
+    """
+
+    def __init__(self, db=engine, flush_interval=RULE_HITS_FLUSH_INTERVAL):
+        self.engine = db
+        self.flush_interval = flush_interval
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._next_flush = time.monotonic() + flush_interval
+
+    def hit(self, pattern):
+        with self._lock:
+            self._pending[pattern] += 1
+
+    def flush_due(self, events=None):
+        """Flushes if `flush_interval` has passed; usable as an attack log writer listener."""
+        if time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def flush(self):
+        """Adds pending counts to the table; returns how many hits were written."""
+        if not self._flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            self._next_flush = time.monotonic() + self.flush_interval
+            with self._lock:
+                pending, self._pending = self._pending, Counter()
+            if not pending:
+                return 0
+            upsert = sqlite_insert(_rule_hits)
+            upsert = upsert.on_conflict_do_update(
+                index_elements=[_rule_hits.c.pattern],
+                set_={"hits": _rule_hits.c.hits + upsert.excluded.hits},
+            )
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(upsert, [{"pattern": p, "hits": n} for p, n in pending.items()])
+            except SQLAlchemyError as e:
+                print(f"Rule hit counts not saved: {e}")
+                with self._lock:
+                    self._pending.update(pending)
+                return 0
+            return sum(pending.values())
+        finally:
+            self._flush_lock.release()
+
+
+def read_rule_hits(db=engine):
+    """{pattern: hits} recorded from live traffic ({} if none yet)."""
+    try:
+        with db.connect() as conn:
+            return dict(conn.execute(select(_rule_hits.c.pattern, _rule_hits.c.hits)).all())
+    except SQLAlchemyError:
+        return {}
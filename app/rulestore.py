@@ -0,0 +1,276 @@
+# app/rulestore.py
+"""Versioned store for the static rules, in logs.db, shared by the API, generator and dashboard.
+
+- `ruleset_versions` keeps every rule set that has ever been active. Versions
+  only grow and the highest one is live. Approving a proposal or rolling back
+  appends a version, so history is never rewritten and a rollback is a
+  single INSERT.
+- `pending_rules` holds generated rules and optimizer proposals until review.
+- Approve and reject are single transactions that first claim (delete) the
+  pending row. Two reviewers, or a reviewer racing the generator, can never
+  apply the same proposal twice or lose a concurrent update.
+- `head()` is one indexed MAX(version) read. Request workers call it every
+  RULES_RELOAD_INTERVAL and recompile only when the version has changed.
+- On first use, data/rules.json and data/pending_rules.json are imported once.
+  After that they are no longer read.
+
+Usage:
+    python -m app.rulestore history
+    python -m app.rulestore rollback 3
+    python -m app.rulestore export data/rules.json
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import exists, func, insert, literal, select
+
+from app.config import RULES_PATH, RULES_PENDING_PATH
+from app.models import PendingRule, RuleStoreState, RulesetVersion, engine
+from app.rules import read_rules_document, ruleset_version
+
+IMPORTED_MARK = "rules_imported"
+
+_versions = RulesetVersion.__table__
+_pending = PendingRule.__table__
+_state = RuleStoreState.__table__
+
+
+class StaleProposal(Exception):
+    """A rule set proposal was built against rules that have changed since."""
+
+
+def _document(row):
+    return {
+        "version": row.version,
+        "created_at": row.created_at,
+        "action": row.action,
+        "note": row.note,
+        "digest": row.digest,
+        "patterns": json.loads(row.patterns),
+        "plan": json.loads(row.plan) if row.plan else None,
+    }
+
+
+def _empty_document():
+    return {"version": 0, "created_at": None, "action": None, "note": None,
+            "digest": ruleset_version([]), "patterns": [], "plan": None}
+
+
+class RuleStore:
+    """Active rules, their history and the review queue, backed by logs.db."""
+
+    def __init__(self, db=engine, rules_path=RULES_PATH, pending_path=RULES_PENDING_PATH):
+        self.engine = db
+        self.rules_path = rules_path
+        self.pending_path = pending_path
+        self._imported = False
+
+    # --- FIRST RUN ---
+    def ensure_imported(self):
+        """Imports the legacy JSON files, exactly once across all processes."""
+        if self._imported:
+            return
+        with self.engine.begin() as conn:
+            # Claiming the mark is the transaction's first write, so concurrent workers import only once.
+            claimed = conn.execute(
+                _state.insert().prefix_with("OR IGNORE"),
+                {"name": IMPORTED_MARK, "value": datetime.utcnow().isoformat()},
+            ).rowcount
+            if claimed:
+                self._import(conn)
+        self._imported = True
+
+    def _import(self, conn):
+        if conn.execute(select(_versions.c.version).limit(1)).first() is not None:
+            return  # already populated (e.g. by a release that kept the mark elsewhere)
+        version = None
+        if os.path.exists(self.rules_path):
+            document = read_rules_document(self.rules_path)
+            version = self._append(conn, document["patterns"], document.get("plan"), "import",
+                                   f"Imported from {self.rules_path}")
+        queued = 0
+        if os.path.exists(self.pending_path):
+            with open(self.pending_path, "r") as f:
+                entries = json.load(f)
+            for entry in entries if isinstance(entries, list) else []:
+                queued += self._queue(conn, entry) is not None
+        print(f"Rule store initialized: version {version or 0}, {queued} pending rule(s) imported")
+
+    # --- VERSIONS ---
+    def _append(self, conn, patterns, plan, action, note):
+        result = conn.execute(insert(_versions).values(
+            created_at=datetime.utcnow(),
+            action=action,
+            note=note,
+            digest=ruleset_version(patterns),
+            patterns=json.dumps(list(patterns)),
+            plan=json.dumps(list(plan)) if plan else None,
+        ))
+        return result.inserted_primary_key[0]
+
+    def _get(self, conn, version=None):
+        query = select(_versions)
+        if version is None:
+            query = query.order_by(_versions.c.version.desc()).limit(1)
+        else:
+            query = query.where(_versions.c.version == version)
+        row = conn.execute(query).first()
+        return _document(row) if row is not None else None
+
+    def head(self):
+        """Active version number (0 before any rules exist); cheap enough for every reload check."""
+        self.ensure_imported()
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.max(_versions.c.version))).scalar() or 0
+
+    def get(self, version):
+        """The rules document of one version, or None if it does not exist."""
+        self.ensure_imported()
+        with self.engine.connect() as conn:
+            return self._get(conn, version)
+
+    def active(self):
+        """The live rules document: version, digest, patterns, plan and how it came to be."""
+        self.ensure_imported()
+        with self.engine.connect() as conn:
+            return self._get(conn) or _empty_document()
+
+    def history(self, limit=50):
+        """Newest versions first, without their patterns."""
+        self.ensure_imported()
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(_versions).order_by(_versions.c.version.desc()).limit(limit)
+            ).all()
+        return [{**{k: v for k, v in _document(row).items() if k not in ("patterns", "plan")},
+                 "rules": len(json.loads(row.patterns))} for row in rows]
+
+    def rollback(self, version, note=None):
+        """Makes an earlier version live again by appending a copy of it; returns the new version."""
+        self.ensure_imported()
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                insert(_versions).from_select(
+                    ["created_at", "action", "note", "digest", "patterns", "plan"],
+                    select(literal(datetime.utcnow(), _versions.c.created_at.type), literal("rollback"),
+                           literal(note or f"Rolled back to version {version}"),
+                           _versions.c.digest, _versions.c.patterns, _versions.c.plan)
+                    .where(_versions.c.version == version),
+                )
+            )
+            if not result.rowcount:
+                raise ValueError(f"Unknown rule set version {version}")
+            return conn.execute(select(func.max(_versions.c.version))).scalar()
+
+    # --- REVIEW QUEUE ---
+    def _queue(self, conn, entry):
+        payload = json.dumps(entry)
+        if entry.get("type") == "ruleset":
+            # One optimizer proposal at a time: a newer one replaces the old.
+            conn.execute(_pending.delete().where(_pending.c.kind == "ruleset"))
+            row = {"kind": "ruleset", "pattern": None, "created_at": datetime.utcnow(), "payload": payload}
+            return conn.execute(insert(_pending).values(**row)).inserted_primary_key[0]
+        pattern = entry.get("pattern")
+        # Deduplicated in the same statement, so two generator runs cannot both queue a pattern.
+        result = conn.execute(insert(_pending).from_select(
+            ["kind", "pattern", "created_at", "payload"],
+            select(literal("rule"), literal(pattern), literal(datetime.utcnow(), _pending.c.created_at.type),
+                   literal(payload))
+            .where(~exists().where(_pending.c.pattern == pattern)),
+        ))
+        return result.lastrowid if result.rowcount else None
+
+    def queue(self, entry):
+        """Adds a generated rule or rule set proposal for review; returns its id, or None if already queued."""
+        self.ensure_imported()
+        with self.engine.begin() as conn:
+            return self._queue(conn, entry)
+
+    def pending(self):
+        """Queued entries, oldest first, each with its "id"."""
+        self.ensure_imported()
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(_pending.c.id, _pending.c.payload).order_by(_pending.c.id)).all()
+        return [{**json.loads(payload), "id": pending_id} for pending_id, payload in rows]
+
+    def approve(self, pending_id):
+        """Applies a queued entry as a new version; returns the live version, or None if already handled.
+
+        Raises StaleProposal (leaving the entry queued) when a rule set proposal
+        no longer matches the live rules.
+        """
+        self.ensure_imported()
+        with self.engine.begin() as conn:
+            claimed = conn.execute(
+                _pending.delete().where(_pending.c.id == pending_id).returning(_pending.c.payload)
+            ).first()
+            if claimed is None:
+                return None
+            entry = json.loads(claimed.payload)
+            current = self._get(conn) or _empty_document()
+            if entry.get("type") == "ruleset":
+                if entry["base_version"] != current["digest"]:
+                    raise StaleProposal("The active rules changed since this proposal was made")
+                return self._append(conn, entry["patterns"], entry.get("plan"), "approve",
+                                    f"Rule set optimization: {entry.get('reason', '')}")
+            if entry["pattern"] in current["patterns"]:
+                return current["version"]
+            # Patterns missing from an optimizer plan are checked after it, in order.
+            return self._append(conn, current["patterns"] + [entry["pattern"]], current["plan"], "approve",
+                                f"Added rule: {entry['pattern']}")
+
+    def reject(self, pending_id):
+        """Drops a queued entry; returns False if it was already handled."""
+        self.ensure_imported()
+        with self.engine.begin() as conn:
+            return bool(conn.execute(_pending.delete().where(_pending.c.id == pending_id)).rowcount)
+
+    # --- EXPORT ---
+    def export(self, path):
+        """Writes the live rules in the rules.json format (backups, benchmarks, other tools)."""
+        document = self.active()
+        data = {"patterns": document["patterns"], "version": str(document["version"])}
+        if document["plan"]:
+            data["plan"] = document["plan"]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp, path)
+
+
+rule_store = RuleStore()
+
+
+def active_document(path=None):
+    """Rules document from a rules JSON file when path is given, else the live rules from the store."""
+    return read_rules_document(path) if path else rule_store.active()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    history = commands.add_parser("history", help="List rule set versions, newest first")
+    history.add_argument("--limit", type=int, default=20)
+    rollback = commands.add_parser("rollback", help="Make an earlier version live again")
+    rollback.add_argument("version", type=int)
+    export = commands.add_parser("export", help="Write the live rules as a rules.json file")
+    export.add_argument("path")
+    args = parser.parse_args()
+    if args.command == "history":
+        head = rule_store.head()
+        for item in rule_store.history(args.limit):
+            marker = "*" if item["version"] == head else " "
+            print(f"{marker} v{item['version']:<5} {item['created_at']:%Y-%m-%d %H:%M:%S}  {item['action']:<8} "
+                  f"{item['rules']:>4} rules  {item['note'] or ''}")
+    elif args.command == "rollback":
+        print(f"Version {rule_store.rollback(args.version)} is live (copy of version {args.version}).")
+    else:
+        rule_store.export(args.path)
+        print(f"Wrote version {rule_store.head()} to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
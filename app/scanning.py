@@ -0,0 +1,28 @@
+# app/scanning.py
+import json
+
+
+def parse_record(line, index):
+    """Reads one NDJSON/JSONL line into (id, prompt).
+
+    Accepts a bare JSON string, an object with a "prompt" field (and an
+    optional "id"), or plain text. Returns None for blank lines.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        value = json.loads(line)
+    except ValueError:
+        return index, line
+    if isinstance(value, str):
+        return index, value
+    if isinstance(value, dict) and isinstance(value.get("prompt"), str):
+        return value.get("id", index), value["prompt"]
+    raise ValueError(f"line {index + 1}: expected a string or an object with a 'prompt' field")
+
+
+def scan_records(records, scan):
+    """Runs `scan` (e.g. layers.scan_prompts) over (id, prompt) records."""
+    verdicts = scan([prompt for _, prompt in records])
+    return [{"id": record_id, **verdict} for (record_id, _), verdict in zip(records, verdicts)]
@@ -0,0 +1,257 @@
+# app/tracing.py
+"""Per-request traces, slow-request trace files and sampled stack profiles.
+
+`TracingMiddleware` gives every HTTP request a request ID (taken from an
+incoming X-Request-ID header or generated) and returns it in the response.
+While the request runs, `span("name")` records timed spans into the current
+trace through a context variable, so layers running on executor threads add
+to the right request as long as they were started with a copied context
+(see `run_blocking`). Outside a request, `span()` does nothing.
+
+When the response finishes, traces slower than TRACE_SLOW_MS, plus a random
+TRACE_SAMPLE_RATE of the others, are appended to a rotating JSONL file. With
+PROFILE_EVERY=N, one in N requests is also stack-sampled across all threads,
+and a folded-stacks profile (flamegraph.pl / speedscope input) is written to
+PROFILE_DIR.
+"""
+import contextvars
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+from app.config import (
+    PROFILE_DIR,
+    PROFILE_EVERY,
+    PROFILE_INTERVAL_MS,
+    TRACE_BACKUPS,
+    TRACE_ENABLED,
+    TRACE_MAX_BYTES,
+    TRACE_PATH,
+    TRACE_SAMPLE_RATE,
+    TRACE_SLOW_MS,
+)
+
+REQUEST_ID_HEADER = "x-request-id"
+
+_current_trace = contextvars.ContextVar("promptshield_trace", default=None)
+_current_span = contextvars.ContextVar("promptshield_span", default=None)
+
+
+class Trace:
+    """Spans recorded for one request; safe to append to from several threads."""
+
+    def __init__(self, request_id, name):
+        self.request_id = request_id
+        self.name = name
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+        self.spans = []
+        self.attrs = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, end, parent=None, **attrs):
+        """Records a span from perf_counter() start/end times."""
+        span = {
+            "name": name,
+            "parent": parent,
+            "start_ms": round(1000 * (start - self.started), 3),
+            "duration_ms": round(1000 * (end - start), 3),
+        }
+        if attrs:
+            span.update(attrs)
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self, duration_ms):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "timestamp": self.timestamp,
+            "duration_ms": round(duration_ms, 3),
+            **self.attrs,
+            "spans": spans,
+        }
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name, **attrs):
+    """Times the enclosed block as a child of the enclosing span, if tracing."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter(), parent=parent, **attrs)
+        _current_span.reset(token)
+
+
+# --- PROFILING ---
+class StackSampler:
+    """Samples every thread's Python stack at a fixed interval.
+
+    Unlike cProfile, this sees the executor and ML batcher threads a request
+    fans out to, and costs nothing between samples. Stacks of concurrent
+    requests are included too; the profile shows where the process was busy
+    while the sampled request ran.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL_MS / 1000.0):
+        self.interval = max(0.001, interval)
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+
+# --- RECORDING ---
+class TraceRecorder:
+    """Decides which finished traces are kept and writes them to disk."""
+
+    def __init__(self, path=TRACE_PATH, slow_ms=TRACE_SLOW_MS, sample_rate=TRACE_SAMPLE_RATE,
+                 max_bytes=TRACE_MAX_BYTES, backups=TRACE_BACKUPS, profile_every=PROFILE_EVERY,
+                 profile_dir=PROFILE_DIR, enabled=TRACE_ENABLED):
+        self.path = path
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.profile_every = max(0, profile_every)
+        self.profile_dir = profile_dir
+        self.enabled = enabled
+        self.written = 0
+        self._logger = None
+        self._requests = itertools.count(1)
+        self._profiling = threading.Lock()  # one profile at a time
+
+    def _trace_logger(self):
+        # Opened on first write so importing the app never creates files.
+        if self._logger is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups,
+                                          encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger(f"promptshield.traces.{id(self)}")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    def start_profile(self):
+        """Returns a running StackSampler for 1 in `profile_every` requests, else None."""
+        if not self.profile_every or next(self._requests) % self.profile_every:
+            return None
+        if not self._profiling.acquire(blocking=False):
+            return None
+        return StackSampler().start()
+
+    def finish(self, trace, profiler=None):
+        duration_ms = 1000 * (time.perf_counter() - trace.started)
+        if profiler is not None:
+            samples = profiler.stop()
+            self._profiling.release()
+            trace.attrs["profile"] = self._write_profile(trace.request_id, samples)
+        slow = duration_ms >= self.slow_ms
+        if slow or profiler is not None or random.random() < self.sample_rate:
+            trace.attrs["slow"] = slow
+            try:
+                self._trace_logger().info(json.dumps(trace.to_dict(duration_ms)))
+                self.written += 1
+            except (OSError, TypeError, ValueError) as e:
+                print(f"Trace write failed: {e}")
+        return duration_ms
+
+    def _write_profile(self, request_id, samples):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{request_id}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+trace_recorder = TraceRecorder()
+
+
+def _request_id(scope):
+    for name, value in scope.get("headers", ()):
+        if name == REQUEST_ID_HEADER.encode():
+            # Keep caller IDs usable in file names and logs.
+            value = value.decode("latin-1")[:64]
+            if value and all(c.isalnum() or c in "-_." for c in value):
+                return value
+    return uuid.uuid4().hex
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware, so streamed responses are traced to their last byte."""
+
+    def __init__(self, app, recorder=trace_recorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.recorder.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        request_id = _request_id(scope)
+        trace = Trace(request_id, f"{scope['method']} {scope['path']}")
+        header = (REQUEST_ID_HEADER.encode(), request_id.encode())
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                trace.attrs["status"] = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        token = _current_trace.set(trace)
+        profiler = self.recorder.start_profile()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _current_trace.reset(token)
+            self.recorder.finish(trace, profiler)
@@ -0,0 +1,156 @@
+# bench/layers.py
+"""Per-layer micro-benchmarks, fully offline.
+
+Usage:
+    python -m bench.layers --classifier stub --output layers.json
+    python -m bench.layers --classifier model --baseline layers-baseline.json
+
+Measures Layer 1 against rule count and prompt length, Layer 2 against
+prompt length and batch size, and Layer 4 against response length. Runs in a
+scratch directory so nothing is written to the real attack log.
+"""
+import argparse
+import os
+import sys
+
+from bench.results import (
+    compare,
+    environment,
+    load_results,
+    peak_rss_mb,
+    report_comparison,
+    save_results,
+    time_calls,
+)
+from bench.stubs import CLASSIFIERS, isolated_workdir, use_offline_stubs
+
+BENIGN_WORDS = "please summarize the quarterly planning notes and the weather forecast for tomorrow".split()
+
+
+def benign_text(chars):
+    words = []
+    while sum(len(word) + 1 for word in words) < chars:
+        words.append(BENIGN_WORDS[len(words) % len(BENIGN_WORDS)])
+    return " ".join(words)
+
+
+def synthetic_rules(count):
+    """Half literal phrases, half case-insensitive regexes, none matching benign text."""
+    rules = []
+    for i in range(count):
+        if i % 2:
+            rules.append(rf"(?i)attack{i}\s+(vector|payload)s?")
+        else:
+            rules.append(f"blocked phrase number {i}")
+    return rules
+
+
+def bench_static(rule_counts, prompt_chars, repeats):
+    from app.layers import rule_engine
+    from app.rules import CompiledRuleSet
+
+    rows = []
+    prompt = benign_text(1000)
+    for count in rule_counts:
+        ruleset = CompiledRuleSet(synthetic_rules(count))
+        rows.append({"name": f"rules={count}", "rules": count, **time_calls(lambda: ruleset.match(prompt), repeats)})
+    ruleset = rule_engine.current()
+    for chars in prompt_chars:
+        prompt = benign_text(chars)
+        rows.append({"name": f"chars={chars}", "chars": chars, **time_calls(lambda: ruleset.match(prompt), repeats)})
+    return rows
+
+
+def bench_ml(token_lengths, batch_sizes, repeats):
+    from app.layers import ml_layer, model_manager
+
+    batcher = model_manager.batcher()
+    tokenizer = batcher.backend.tokenizer
+    rows = []
+    for tokens in token_lengths:
+        # Grow the prompt until it tokenizes to roughly `tokens` tokens.
+        prompt = benign_text(tokens * 4)
+        while len(tokenizer(prompt, add_special_tokens=False)["input_ids"]) < tokens:
+            prompt += " " + prompt
+        ids = tokenizer(prompt, add_special_tokens=False)["input_ids"][:tokens]
+        prompt = tokenizer.decode(ids) if hasattr(tokenizer, "decode") else " ".join(prompt.split()[:tokens])
+        rows.append({"name": f"tokens={tokens}", "tokens": tokens,
+                     **time_calls(lambda: batcher.score_batch([prompt]), repeats)})
+    prompt = benign_text(200)
+    for size in batch_sizes:
+        prompts = [prompt] * size
+        summary = time_calls(lambda: batcher.score_batch(prompts), repeats)
+        summary["prompts_per_s"] = 1000 * size / summary["mean_ms"] if summary["mean_ms"] else 0.0
+        rows.append({"name": f"batch={size}", "batch": size, **summary})
+    # The request path: one ml_layer() call, including the micro-batch window.
+    rows.append({"name": "ml_layer", **time_calls(lambda: ml_layer(prompt), repeats)})
+    return rows
+
+
+def bench_output(response_chars, repeats, chunk_chars=16):
+    from app.layers import StreamingOutputValidator, output_layer
+
+    rows = []
+    for chars in response_chars:
+        response = benign_text(chars)
+        rows.append({"name": f"output_layer chars={chars}", "chars": chars,
+                     **time_calls(lambda: output_layer(response, "benchmark"), repeats)})
+
+        def stream():
+            validator = StreamingOutputValidator("benchmark")
+            for start in range(0, len(response), chunk_chars):
+                validator.feed(response[start:start + chunk_chars])
+            validator.finish()
+        rows.append({"name": f"streaming chars={chars}", "chars": chars, **time_calls(stream, repeats)})
+    return rows
+
+
+def run(classifier="stub", rule_counts=(10, 100, 1000, 5000), prompt_chars=(100, 1000, 10000, 100000),
+        token_lengths=(16, 64, 256, 512, 2048), batch_sizes=(1, 4, 16), response_chars=(100, 1000, 10000),
+        repeats=50):
+    use_offline_stubs(classifier)
+    isolated_workdir()
+    results = {
+        "static": bench_static(rule_counts, prompt_chars, repeats),
+        "ml": bench_ml(token_lengths, batch_sizes, max(5, repeats // 5)),
+        "output": bench_output(response_chars, repeats),
+    }
+    results["peak_rss_mb"] = peak_rss_mb()
+    return {"benchmark": "layers", "classifier": classifier, "environment": environment(), "results": results}
+
+
+def print_rows(title, rows):
+    print(f"\n{title}")
+    print(f"{'case':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for row in rows:
+        print(f"{row['name']:<28}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['p99_ms']:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--classifier", choices=CLASSIFIERS, default="stub",
+                        help="stub: tiny numpy stand-in; model: the real model from the local HF cache")
+    parser.add_argument("--rule-counts", nargs="+", type=int, default=[10, 100, 1000, 5000])
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Compare against a stored results file")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+    # Resolve paths first: the benchmark runs inside a scratch directory.
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = load_results(args.baseline) if args.baseline else None
+
+    report = run(args.classifier, rule_counts=args.rule_counts, repeats=args.repeats)
+    print_rows("Layer 1: static rules", report["results"]["static"])
+    print_rows("Layer 2: ML classifier", report["results"]["ml"])
+    print_rows("Layer 4: output validator", report["results"]["output"])
+    print(f"\nPeak RSS: {report['results']['peak_rss_mb']:.0f} MB")
+
+    if output:
+        save_results(output, report)
+    if baseline and report_comparison(compare(report, baseline, args.tolerance)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# bench/results.py
+"""Summaries, JSON result files and baseline comparison shared by the benchmarks.
+
+Usage:
+    python -m bench.results current.json baseline.json --tolerance 0.15
+
+Exits with status 1 when any metric regressed by more than the tolerance.
+Metrics are compared by name: keys ending in `_ms` or `_mb` are better when
+lower, keys ending in `_per_s` are better when higher; others are ignored.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+
+def percentile(values, pct):
+    # Nearest-rank, as in tools/parity.py (not imported: that would load app.config
+    # before bench.stubs has pointed it at the offline stand-ins).
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_summary(samples_ms):
+    """p50/p95/p99/mean/max over a list of millisecond timings."""
+    return {
+        "count": len(samples_ms),
+        "p50_ms": percentile(samples_ms, 50),
+        "p95_ms": percentile(samples_ms, 95),
+        "p99_ms": percentile(samples_ms, 99),
+        "mean_ms": statistics.fmean(samples_ms) if samples_ms else 0.0,
+        "max_ms": max(samples_ms, default=0.0),
+    }
+
+
+def time_calls(func, repeats, warmup=1):
+    """Calls `func()` repeatedly and returns the latency summary."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        samples.append(1000 * (time.perf_counter() - started))
+    return latency_summary(samples)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (ru_maxrss is KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def environment():
+    """Where the numbers came from, so baselines from other machines stand out."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def save_results(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _metrics(results, prefix=""):
+    """Flattens nested dicts/lists into {"a.b.p95_ms": value} for comparable keys."""
+    if isinstance(results, dict):
+        items = results.items()
+    elif isinstance(results, list):
+        # Rows are matched by their "name" when present, else by position.
+        items = ((row.get("name", i) if isinstance(row, dict) else i, row) for i, row in enumerate(results))
+    else:
+        return {}
+    flat = {}
+    for key, value in items:
+        path = f"{prefix}{key}"
+        if isinstance(value, (dict, list)):
+            flat.update(_metrics(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and str(key).endswith(("_ms", "_mb", "_per_s")):
+            flat[path] = value
+    return flat
+
+
+def compare(current, baseline, tolerance=0.15):
+    """Returns one row per metric present in both runs, flagging regressions."""
+    current, baseline = _metrics(current.get("results", current)), _metrics(baseline.get("results", baseline))
+    rows = []
+    for name in sorted(current.keys() & baseline.keys()):
+        new, old = current[name], baseline[name]
+        change = (new - old) / old if old else 0.0
+        higher_is_better = name.endswith("_per_s")
+        regressed = -change > tolerance if higher_is_better else change > tolerance
+        rows.append({"metric": name, "baseline": old, "current": new, "change": change, "regressed": regressed})
+    return rows
+
+
+def report_comparison(rows):
+    """Prints regressions (and the count of metrics checked); returns True if any regressed."""
+    regressions = [row for row in rows if row["regressed"]]
+    for row in regressions:
+        print(f"REGRESSION {row['metric']}: {row['baseline']:.2f} -> {row['current']:.2f} ({row['change']:+.0%})")
+    print(f"Compared {len(rows)} metrics against baseline: {len(regressions)} regressed.")
+    return bool(regressions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("current")
+    parser.add_argument("baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative change (0.15 = 15%%)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Print every compared metric")
+    args = parser.parse_args()
+
+    rows = compare(load_results(args.current), load_results(args.baseline), args.tolerance)
+    if args.verbose:
+        for row in rows:
+            print(f"{row['metric']:<60}{row['baseline']:>12.2f}{row['current']:>12.2f}{row['change']:>+9.0%}")
+    sys.exit(1 if report_comparison(rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
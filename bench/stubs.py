@@ -0,0 +1,121 @@
+# bench/stubs.py
+"""Offline stand-ins so benchmarks never touch the network.
+
+The LLM is always the local fake provider (`PROMPTSHIELD_LLM_PROVIDER=fake`).
+The classifier is either the real model from the local HuggingFace cache or
+`StubBackend`: a tiny numpy embedding + linear head behind a hashing
+tokenizer, whose cost still grows with batch size and padded length.
+"""
+import os
+import shutil
+import tempfile
+import zlib
+
+import numpy as np
+
+CLASSIFIERS = ("stub", "model")
+
+# Tokens the stub scores as hostile, so attack prompts still cross the threshold.
+HOSTILE_WORDS = {"ignore", "previous", "instructions", "directions", "override", "system", "prompt",
+                 "reveal", "password", "developer", "mode", "jailbreak", "dan"}
+
+
+class StubTokenizer:
+    """Whitespace tokenizer with hashed ids and [CLS]/[SEP]-style specials."""
+
+    pad_token_id, cls_token_id, sep_token_id = 0, 1, 2
+
+    def __init__(self, vocab_size=4096):
+        self.vocab_size = vocab_size
+
+    def _ids(self, text):
+        return [3 + zlib.crc32(word.lower().encode()) % (self.vocab_size - 3) for word in text.split()]
+
+    def __call__(self, texts, add_special_tokens=True, **kwargs):
+        single = isinstance(texts, str)
+        batch = []
+        for text in [texts] if single else texts:
+            ids = self._ids(text)
+            batch.append([self.cls_token_id] + ids + [self.sep_token_id] if add_special_tokens else ids)
+        input_ids = batch[0] if single else batch
+        return {"input_ids": input_ids}
+
+    def pad(self, features, return_tensors="np"):
+        width = max(len(f["input_ids"]) for f in features)
+        input_ids = np.zeros((len(features), width), dtype=np.int64)
+        mask = np.zeros((len(features), width), dtype=np.int64)
+        for row, f in enumerate(features):
+            input_ids[row, :len(f["input_ids"])] = f["input_ids"]
+            mask[row, :len(f["input_ids"])] = 1
+        return {"input_ids": input_ids, "attention_mask": mask}
+
+
+class StubBackend:
+    """Deterministic stand-in classifier with the ClassifierBackend surface."""
+
+    name = "stub"
+
+    def __init__(self, model_name, dim=256, threads=0):
+        self.model_name = model_name
+        self.dim = dim
+        self.threads = threads  # accepted for interface parity; numpy picks its own
+        self.tokenizer = None
+
+    @property
+    def cache_tag(self):
+        return f"{self.model_name}:{self.name}"
+
+    def load(self):
+        self.tokenizer = StubTokenizer()
+        rng = np.random.default_rng(0)
+        self.embeddings = rng.standard_normal((self.tokenizer.vocab_size, self.dim)).astype(np.float32)
+        self.hidden = rng.standard_normal((self.dim, self.dim)).astype(np.float32) / np.sqrt(self.dim)
+        self.hostile = np.zeros(self.tokenizer.vocab_size, dtype=np.float32)
+        for token in self.tokenizer._ids(" ".join(HOSTILE_WORDS)):
+            self.hostile[token] = 1.0
+        return self
+
+    def predict(self, features):
+        batch = self.tokenizer.pad(features)
+        ids, mask = batch["input_ids"], batch["attention_mask"].astype(np.float32)
+        # One dense layer over every padded position: cost ~ batch x length x dim^2.
+        states = np.tanh(self.embeddings[ids] @ self.hidden)
+        pooled = (states * mask[..., None]).sum(axis=1) / mask.sum(axis=1, keepdims=True)
+        hostile = (self.hostile[ids] * mask).sum(axis=1) / mask.sum(axis=1)
+        logits = 8.0 * hostile - 2.0 + 0.01 * pooled.mean(axis=1)
+        return (1.0 / (1.0 + np.exp(-logits))).tolist()
+
+
+def use_offline_stubs(classifier="stub", llm_first_token_delay=None, llm_token_delay=None):
+    """Points the app at local stand-ins; call before importing anything from `app`."""
+    if classifier not in CLASSIFIERS:
+        raise ValueError(f"classifier must be one of {CLASSIFIERS}, got {classifier!r}")
+    os.environ["PROMPTSHIELD_LLM_PROVIDER"] = "fake"
+    os.environ.setdefault("GROQ_API_KEY", "offline-benchmark")
+    os.environ["PROMPTSHIELD_MODEL_LOAD"] = "lazy"
+    if llm_first_token_delay is not None:
+        os.environ["PROMPTSHIELD_FAKE_LLM_FIRST_TOKEN_DELAY"] = str(llm_first_token_delay)
+    if llm_token_delay is not None:
+        os.environ["PROMPTSHIELD_FAKE_LLM_TOKEN_DELAY"] = str(llm_token_delay)
+    if classifier == "stub":
+        os.environ["PROMPTSHIELD_ML_BACKEND"] = "stub"
+    else:
+        # The real model, only if it is already in the local HuggingFace cache.
+        os.environ["HF_HUB_OFFLINE"] = "1"
+
+    from app.backends import BACKENDS
+    BACKENDS[StubBackend.name] = StubBackend
+
+
+RULES_SOURCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "rules.json")
+
+
+def isolated_workdir(source=RULES_SOURCE):
+    """Moves into a scratch directory holding a copy of the rules, so benchmark
+    runs never write to the real attack log database. Returns the path."""
+    workdir = tempfile.mkdtemp(prefix="promptshield-bench-")
+    os.makedirs(os.path.join(workdir, "data"))
+    if os.path.exists(source):
+        shutil.copy(source, os.path.join(workdir, "data", "rules.json"))
+    os.chdir(workdir)
+    return workdir
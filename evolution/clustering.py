@@ -0,0 +1,251 @@
+# evolution/clustering.py
+"""Groups flagged prompts into near-duplicate attack families.
+
+Each prompt becomes a set of word shingles, summarized by a MinHash signature
+whose agreement with another signature estimates their Jaccard similarity.
+Signatures are split into LSH bands, so a new prompt is only compared with
+the few families sharing a band bucket, never with every stored prompt. The
+cost of clustering is therefore linear in the number of prompts.
+
+Families persist in data/attack_clusters.json and are updated incrementally
+as the generator sees new prompts. Each family has a few diverse exemplars
+and its size per day, so rule generation can focus on distinct and growing
+families rather than on many copies of one jailbreak.
+
+Usage:
+    python -m evolution.clustering --rebuild   # re-cluster everything ever logged (archives included)
+    python -m evolution.clustering             # show the largest families
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import zlib
+from datetime import date, timedelta
+
+import numpy as np
+
+# Run as a script, only evolution/ is on sys.path; make the repo root importable.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.normalize import normalize
+
+CLUSTERS_PATH = "data/attack_clusters.json"
+NUM_PERM = 64
+BANDS = 16  # 4 rows per band: pairs above ~0.5 similarity collide with high probability
+SIMILARITY = float(os.getenv("PROMPTSHIELD_CLUSTER_SIMILARITY", "0.5"))
+SHINGLE_WORDS = 2
+MAX_EXEMPLARS = 3
+# Exemplars more similar than this to one already kept add nothing new.
+EXEMPLAR_MAX_SIMILARITY = 0.8
+HISTORY_DAYS = 30
+# Layers whose logged prompts are attacks (also what evolution/generator.py reads).
+ATTACK_LAYERS = ("ML Classifier", "Static Rule Checker", "Fingerprint Index", "Output Validator")
+
+_PRIME = (1 << 61) - 1
+_MASK32 = (1 << 32) - 1
+
+
+# --- MINHASH ---
+def shingles(text, size=SHINGLE_WORDS):
+    """Word n-grams of normalized text; short prompts fall back to character 4-grams."""
+    tokens = re.findall(r"[a-z0-9]+", normalize(text).text)
+    if len(tokens) >= size:
+        return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+    joined = " ".join(tokens)
+    return {joined[i:i + 4] for i in range(max(1, len(joined) - 3))}
+
+
+class MinHasher:
+    """Fixed random permutations, so signatures from different runs are comparable."""
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.RandomState(seed)
+        # a*h + b with 32-bit a, b and h stays below 2**64.
+        self.a = rng.randint(1, _MASK32, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, _MASK32, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+
+    def signature(self, text):
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(text)), dtype=np.uint64)
+        if not len(hashes):
+            hashes = np.zeros(1, dtype=np.uint64)
+        values = (np.outer(hashes, self.a) + self.b) % np.uint64(_PRIME)
+        return (values.min(axis=0) & np.uint64(_MASK32)).astype(np.uint32)
+
+
+def similarity(left, right):
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.count_nonzero(left == right)) / len(left)
+
+
+def _band_keys(signature, bands=BANDS):
+    rows = len(signature) // bands
+    return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+
+
+# --- FAMILIES ---
+class ClusterIndex:
+    """Incremental near-duplicate clustering with an LSH index over family signatures."""
+
+    def __init__(self, path=CLUSTERS_PATH, threshold=SIMILARITY, load=True):
+        self.path = path
+        self.threshold = threshold
+        self.hasher = MinHasher()
+        self.clusters = {}
+        self._signatures = {}
+        self._exemplar_signatures = {}  # in memory only; rebuilt on demand
+        self._buckets = {}
+        self._next_id = 1
+        if load:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._next_id = data.get("next_id", 1)
+        for cluster in data.get("clusters", []):
+            signature = np.array(cluster.pop("signature"), dtype=np.uint32)
+            self._index(cluster, signature)
+
+    def save(self):
+        clusters = [
+            {**cluster, "signature": self._signatures[cluster["id"]].tolist()}
+            for cluster in self.clusters.values()
+        ]
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"next_id": self._next_id, "clusters": clusters}, f)
+        os.replace(tmp, self.path)
+
+    def _index(self, cluster, signature):
+        self.clusters[cluster["id"]] = cluster
+        self._signatures[cluster["id"]] = signature
+        for key in _band_keys(signature):
+            self._buckets.setdefault(key, []).append(cluster["id"])
+
+    def _nearest(self, signature):
+        best, best_similarity = None, self.threshold
+        seen = set()
+        for key in _band_keys(signature):
+            for cluster_id in self._buckets.get(key, ()):
+                if cluster_id in seen:
+                    continue
+                seen.add(cluster_id)
+                score = similarity(signature, self._signatures[cluster_id])
+                if score >= best_similarity:
+                    best, best_similarity = cluster_id, score
+        return best
+
+    def assign(self, text, today=None):
+        """Adds one prompt to its family (creating one if needed); returns the family id."""
+        today = today or date.today().isoformat()
+        signature = self.hasher.signature(text)
+        cluster_id = self._nearest(signature)
+        if cluster_id is None:
+            cluster_id = self._next_id
+            self._next_id += 1
+            self._index({"id": cluster_id, "size": 0, "first_seen": today, "exemplars": [], "daily": {}}, signature)
+        cluster = self.clusters[cluster_id]
+        cluster["size"] += 1
+        cluster["last_seen"] = today
+        cluster["daily"][today] = cluster["daily"].get(today, 0) + 1
+        if len(cluster["exemplars"]) < MAX_EXEMPLARS:
+            exemplars = self._exemplar_signatures.get(cluster_id)
+            if exemplars is None:
+                exemplars = [self.hasher.signature(e) for e in cluster["exemplars"]]
+                self._exemplar_signatures[cluster_id] = exemplars
+            if all(similarity(signature, e) < EXEMPLAR_MAX_SIMILARITY for e in exemplars):
+                cluster["exemplars"].append(text)
+                exemplars.append(signature)
+        return cluster_id
+
+    def add(self, texts, today=None):
+        """Assigns prompts and returns the touched families, most new prompts first.
+
+        Each family dict gets a "new" count for this batch.
+        """
+        today = today or date.today().isoformat()
+        counts = {}
+        for text in texts:
+            cluster_id = self.assign(text, today)
+            counts[cluster_id] = counts.get(cluster_id, 0) + 1
+        self._trim_history(today)
+        return [
+            {**self.clusters[cluster_id], "new": new}
+            for cluster_id, new in sorted(counts.items(), key=lambda item: -item[1])
+        ]
+
+    def _trim_history(self, today):
+        cutoff = (date.fromisoformat(today) - timedelta(days=HISTORY_DAYS)).isoformat()
+        for cluster in self.clusters.values():
+            if any(day < cutoff for day in cluster["daily"]):
+                cluster["daily"] = {day: n for day, n in cluster["daily"].items() if day >= cutoff}
+
+    def largest(self, limit=10):
+        return sorted(self.clusters.values(), key=lambda c: -c["size"])[:limit]
+
+
+def growth(cluster, days=7, today=None):
+    """Prompts added to a family in the last `days` days."""
+    today = date.fromisoformat(today) if today else date.today()
+    cutoff = (today - timedelta(days=days - 1)).isoformat()
+    return sum(n for day, n in cluster["daily"].items() if day >= cutoff)
+
+
+def diverse_exemplars(families, limit=8):
+    """Round-robin over families: every family's first exemplar before any family's second."""
+    picked = []
+    for rank in range(MAX_EXEMPLARS):
+        for family in families:
+            if rank < len(family["exemplars"]):
+                picked.append(family["exemplars"][rank])
+                if len(picked) == limit:
+                    return picked
+    return picked
+
+
+def is_attack_prompt(event):
+    """False for legacy Output Validator rows, which stored the blocked response in `prompt`."""
+    if event["blocked_layer"] == "Output Validator" and not event.get("blocked_content"):
+        return False
+    return bool(event["prompt"])
+
+
+def rebuild(path=CLUSTERS_PATH):
+    """Clusters every attack prompt ever logged from scratch: archived events, then live ones, oldest first."""
+    from app.retention import iter_history
+
+    started = time.perf_counter()
+    index = ClusterIndex(path=path, load=False)
+    count = 0
+    # Same events the generator feeds to assign(), so a rebuild matches incremental clustering.
+    for event in iter_history(layers=ATTACK_LAYERS):
+        if is_attack_prompt(event):
+            day = str(event["timestamp"])[:10]
+            index.assign(event["prompt"], day)
+            count += 1
+    index._trim_history(date.today().isoformat())
+    index.save()
+    print(f"Clustered {count} prompts into {len(index.clusters)} families in {time.perf_counter() - started:.1f}s")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="Re-cluster all prompts in logs.db and the archives")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    index = rebuild() if args.rebuild else ClusterIndex()
+    for cluster in index.largest(args.top):
+        exemplar = cluster["exemplars"][0][:80].replace("\n", " ") if cluster["exemplars"] else ""
+        print(f"#{cluster['id']:<6} size={cluster['size']:<6} 7d={growth(cluster):<5} {exemplar}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,21 @@
 import streamlit as st
-import json
 import pandas as pd
 import os
-import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+# Streamlit only puts this file's folder on sys.path; make the repo root importable.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.rulestore import StaleProposal, rule_store
+from evolution import queries, rulecost
+
+TIME_RANGES = {
+    "Last hour": timedelta(hours=1),
+    "Last 24 hours": timedelta(days=1),
+    "Last 7 days": timedelta(days=7),
+    "Last 30 days": timedelta(days=30),
+    "All time": None,
+}
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(layout="wide", page_title="PromptShield Admin Console")
@@ -39,6 +52,7 @@ st.markdown("---")
 
 # Manual refresh control for admins
 if st.button("Refresh dashboard"):
+    queries.clear_cache()
     st.rerun()
 
 # --- SIDEBAR: LOGOUT ---
@@ -51,34 +65,63 @@ with st.sidebar:
 # --- SECTION 1: SYSTEM TELEMETRY ---
 st.subheader("System Telemetry")
 
-if os.path.exists("data/logs.db"):
+if os.path.exists(queries.DB_PATH):
     try:
-        conn = sqlite3.connect("data/logs.db")
-        df = pd.read_sql("SELECT * FROM flagged_prompts", conn)
-        conn.close()
-        
-        # Metrics
+        queries.ensure_indexes()
+
+        # Metrics (GROUP BY in SQLite, not DataFrame filters)
+        counts = queries.layer_counts()
         col1, col2, col3, col4 = st.columns(4)
-        col1.metric("Total Requests Blocked", len(df))
-        col2.metric("Static Rule Hits", len(df[df['blocked_layer'] == 'Static Rule Checker']))
-        col3.metric("ML Model Hits", len(df[df['blocked_layer'] == 'ML Classifier']))
-        col4.metric("Output Violations", len(df[df['blocked_layer'] == 'Output Validator']))
-        
-        # Recent Logs Table
-        st.write("Complete Security Event Log")
-
-        df_sorted = df.sort_values(by="timestamp", ascending=False).copy()
-        if "blocked_content" not in df_sorted.columns:
-            df_sorted["blocked_content"] = ""
-
-        legacy_mask = (df_sorted["blocked_layer"] == "Output Validator") & (
-            df_sorted["blocked_content"].isna() | (df_sorted["blocked_content"] == "")
+        col1.metric("Total Requests Blocked", sum(counts.values()))
+        col2.metric("Static Rule Hits", counts.get("Static Rule Checker", 0))
+        col3.metric("ML Model Hits", counts.get("ML Classifier", 0))
+        col4.metric("Output Violations", counts.get("Output Validator", 0))
+
+        # Filters shared by the chart and the event log
+        f1, f2, f3, f4 = st.columns([2, 1, 2, 1])
+        layers = f1.multiselect("Layers", queries.LAYERS, default=queries.LAYERS)
+        window = f2.selectbox("Time range", list(TIME_RANGES), index=2)
+        search = f3.text_input("Search prompts and blocked output")
+        page_size = f4.selectbox("Rows per page", [25, 50, 100, 250], index=1)
+        # Rounded to the minute so reruns hit the query cache.
+        now = datetime.utcnow().replace(second=0, microsecond=0)
+        since = now - TIME_RANGES[window] if TIME_RANGES[window] else None
+
+        # Blocks over time, bucketed in SQL
+        bucket = "minute" if window == "Last hour" else "hour" if window in ("Last 24 hours", "Last 7 days") else "day"
+        buckets = queries.time_buckets(bucket=bucket, since=since, layers=tuple(layers))
+        if buckets:
+            chart = pd.DataFrame(buckets, columns=["bucket", "layer", "events"]).pivot(
+                index="bucket", columns="layer", values="events"
+            ).fillna(0)
+            st.bar_chart(chart)
+
+        # Event log, one keyset page at a time
+        st.write("Security Event Log")
+
+        filters = (tuple(layers), window, search, page_size)
+        if st.session_state.get("log_filters") != filters:
+            st.session_state.log_filters = filters
+            st.session_state.log_cursors = [None]  # cursor of each visited page
+        cursors = st.session_state.log_cursors
+
+        rows, next_cursor = queries.events_page(
+            cursor=cursors[-1], page_size=page_size, layers=tuple(layers), since=since, search=search or None
+        )
+        df_page = pd.DataFrame(
+            rows,
+            columns=["id", "timestamp", "blocked_layer", "confidence_score", "prompt", "blocked_content",
+                     "matched_event_id"],
+        )
+
+        legacy_mask = (df_page["blocked_layer"] == "Output Validator") & (
+            df_page["blocked_content"].isna() | (df_page["blocked_content"] == "")
         )
         if legacy_mask.any():
-            df_sorted.loc[legacy_mask, "blocked_content"] = df_sorted.loc[legacy_mask, "prompt"]
-            df_sorted.loc[legacy_mask, "prompt"] = "(not captured – legacy event)"
+            df_page.loc[legacy_mask, "blocked_content"] = df_page.loc[legacy_mask, "prompt"]
+            df_page.loc[legacy_mask, "prompt"] = "(not captured – legacy event)"
 
-        df_display = df_sorted.rename(
+        df_display = df_page.rename(
             columns={
                 "prompt": "user_prompt",
                 "blocked_content": "blocked_output",
@@ -98,8 +141,20 @@ if os.path.exists("data/logs.db"):
                     width="large",
                     help="Only populated for Output Validator events"
                 ),
+                "matched_event_id": st.column_config.NumberColumn(
+                    "Matched Event ID", help="Known attack a Fingerprint Index block was a variant of"
+                ),
             }
         )
+
+        p1, p2, p3 = st.columns([1, 1, 4])
+        if p1.button("Newer", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+        if p2.button("Older", disabled=next_cursor is None):
+            cursors.append(next_cursor)
+            st.rerun()
+        p3.caption(f"Page {len(cursors)}")
     except Exception as e:
         st.error(f"Error reading telemetry: {e}")
 else:
@@ -112,74 +167,133 @@ st.subheader("Autonomous Rule Governance")
 
 c1, c2 = st.columns([2, 1])
 
-# --- HELPER FUNCTIONS FOR FILE I/O ---
-def load_json(filepath):
-    if os.path.exists(filepath):
-        with open(filepath, "r") as f:
-            try: return json.load(f)
-            except: return []
-    return []
-
-def save_json(filepath, data):
-    with open(filepath, "w") as f:
-        json.dump(data, f, indent=4)
-
 # --- PENDING RULES (Left Column) ---
+# Every action is one transaction in the rule store (app/rulestore.py), keyed by
+# the entry's id, so concurrent reviewers and the generator never overwrite each other.
 with c1:
     st.write("##### Pending Rules (Requires Approval)")
     
-    pending_rules = load_json("data/pending_rules.json")
-    
-    # Deduplicate pending rules for display (Optional visual cleanup)
-    # We display them exactly as stored to ensure index matching
+    pending_rules = rule_store.pending()
+    active = rule_store.active()
     
     if not pending_rules:
         st.success("No pending rules. All systems nominal.")
     else:
-        # Iterate backwards to allow popping without breaking index
-        # Or simply handle one action per rerun
-        for i, rule in enumerate(pending_rules):
+        for rule in pending_rules:
+            rule_id = rule["id"]
+            if rule.get("type") == "ruleset":
+                # Optimized rule set from evolution/optimizer.py
+                report = rule["report"]
+                active_patterns = active["patterns"]
+                stale = active["digest"] != rule["base_version"]
+                with st.container(border=True):
+                    col_info, col_act = st.columns([3, 1])
+                    with col_info:
+                        st.write("**Rule Set Optimization**")
+                        st.caption(f"Reasoning: {rule['reason']}")
+                        st.caption(f"Source: {rule.get('source', 'Unknown')}")
+                        m1, m2, m3 = st.columns(3)
+                        m1.metric("Rules", len(rule["patterns"]), len(rule["patterns"]) - len(active_patterns))
+                        m2.metric("Scan Cost (us/prompt)", report["scan_us_after"],
+                                  round(report["scan_us_after"] - report["scan_us_before"], 2), delta_color="inverse")
+                        m3.metric("Verdict Changes", report["verdict_changes"])
+                        if report["removed"]:
+                            st.write("Remove (subsumed on corpus):")
+                        for item in report["removed"]:
+                            st.code(item["pattern"], language="regex")
+                            st.caption(f"Covered by: {item['subsumed_by']} | corpus matches {item['corpus_matches']}, "
+                                       f"live hits {item['live_hits']}")
+                        with st.expander(f"Execution plan ({report['hit_rate_source']} hit rates)"):
+                            st.dataframe(pd.DataFrame(report["rules"]), width="stretch", hide_index=True)
+                            for rank, pattern in enumerate(rule["plan"], 1):
+                                st.text(f"{rank}. {pattern}")
+                        if report["merges"]:
+                            with st.expander("Suggested merges (not applied)"):
+                                for merge in report["merges"]:
+                                    st.code(merge["merged"], language="regex")
+                                    st.caption(f"Match overlap {merge['overlap']:.0%}")
+                        if stale:
+                            st.warning("The active rules changed since this proposal was made. Reject it and re-run the optimizer.")
+                    with col_act:
+                        if st.button("Approve", key=f"approve_{rule_id}", disabled=stale):
+                            try:
+                                rule_store.approve(rule_id)
+                            except StaleProposal as e:
+                                st.warning(str(e))
+                            else:
+                                st.rerun()
+                        if st.button("Reject", key=f"reject_{rule_id}"):
+                            rule_store.reject(rule_id)
+                            st.rerun()
+                continue
+
             with st.container(border=True):
                 col_info, col_act = st.columns([3, 1])
                 with col_info:
                     st.code(rule['pattern'], language="regex")
                     st.caption(f"Reasoning: {rule['reason']}")
                     st.caption(f"Source: {rule.get('source', 'Unknown')}")
+                    evaluation = rule.get("evaluation")
+                    if evaluation and "error" not in evaluation:
+                        m1, m2, m3, m4 = st.columns(4)
+                        m1.metric("Corpus Coverage", f"{evaluation['coverage']:.1%}")
+                        m2.metric("False Positive Rate", f"{evaluation['false_positive_rate']:.2%}")
+                        m3.metric("Overlap w/ Active", f"{evaluation['overlap']:.0%}")
+                        m4.metric("New Coverage", f"{evaluation['new_coverage']:.1%}")
+                        st.caption(f"Corpus: {evaluation['attacks']} attacks / {evaluation['benign']} benign "
+                                   f"({evaluation['seconds']}s)")
+                        if evaluation.get("false_positive_examples"):
+                            with st.expander("False positive examples"):
+                                for example in evaluation["false_positive_examples"]:
+                                    st.text(example)
+                    elif evaluation:
+                        st.caption(f"Corpus evaluation failed: {evaluation['error']}")
+                    cost = rule.get("cost")
+                    if cost:
+                        label = f"Match cost: {cost['max_ms']} ms worst case at {rulecost.MAX_LENGTH} chars, " \
+                                f"growth exponent {cost['exponent'] if cost['exponent'] is not None else 'n/a'}"
+                        if cost["status"] == "ok":
+                            st.caption(label)
+                        else:
+                            st.warning(f"{cost['status'].title()} pattern. {label}")
                 
                 with col_act:
-                    # APPROVE
-                    if st.button("Approve", key=f"approve_{i}"):
-                        # 1. Load Active Rules
-                        active_data = load_json("data/rules.json")
-                        if not isinstance(active_data, dict): # Handle init structure
-                            active_data = {"patterns": [], "version": "1.0"}
-                            
-                        # 2. Add if not exists
-                        if rule['pattern'] not in active_data.get('patterns', []):
-                            active_data['patterns'].append(rule['pattern'])
-                            save_json("data/rules.json", active_data)
-                            
-                        # 3. Remove from Pending
-                        pending_rules.pop(i)
-                        save_json("data/pending_rules.json", pending_rules)
-                        
-                        # 4. Rerun immediately
+                    # APPROVE: appends a new rule set version (no-op if the pattern is already active)
+                    if st.button("Approve", key=f"approve_{rule_id}"):
+                        rule_store.approve(rule_id)
                         st.rerun()
                     
                     # REJECT
-                    if st.button("Reject", key=f"reject_{i}"):
-                        pending_rules.pop(i)
-                        save_json("data/pending_rules.json", pending_rules)
+                    if st.button("Reject", key=f"reject_{rule_id}"):
+                        rule_store.reject(rule_id)
                         st.rerun()
 
 # --- ACTIVE RULES (Right Column) ---
 with c2:
-    st.write("##### Active Configuration")
-    active_data = load_json("data/rules.json")
-    if isinstance(active_data, dict):
-        patterns = active_data.get('patterns', [])
-        st.dataframe(
-            pd.DataFrame(patterns, columns=["Active Patterns"]),
-            width="stretch",
-            hide_index=True
-        )
+    st.write(f"##### Active Configuration (version {active['version']})")
+    patterns = active["patterns"]
+    # Profiles only rules not already in data/rule_costs.json.
+    costs = rulecost.active_rule_costs()
+    st.dataframe(
+        pd.DataFrame(
+            [
+                (p, costs.get(p, {}).get("status"), costs.get(p, {}).get("max_ms"), costs.get(p, {}).get("exponent"))
+                for p in patterns
+            ],
+            columns=["Active Patterns", "Cost", f"Worst ms @ {rulecost.MAX_LENGTH} chars", "Growth"],
+        ),
+        width="stretch",
+        hide_index=True
+    )
+
+    # Every version stays in the store; rolling back makes a copy of an old one live.
+    with st.expander("Version history"):
+        history = rule_store.history()
+        st.dataframe(pd.DataFrame(history, columns=["version", "created_at", "action", "rules", "note"]),
+                     width="stretch", hide_index=True)
+        older = [item["version"] for item in history if item["version"] != active["version"]]
+        if older:
+            target = st.selectbox("Roll back to version", older)
+            if st.button("Roll back"):
+                rule_store.rollback(target)
+                st.rerun()
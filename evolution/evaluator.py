@@ -0,0 +1,255 @@
+# evolution/evaluator.py
+"""Scores candidate regex rules against a large labeled prompt corpus.
+
+The corpus is JSONL, one `{"prompt": "...", "label": "attack" | "benign"}`
+object per line (`text` is accepted for `prompt`, and 1/0 or true/false for
+`label`). It is split into byte ranges that worker processes read straight
+from disk, so it is never loaded whole and every core does part of the scan.
+Each worker compiles the candidates once and, for prompts a candidate
+matches, checks whether the live rules already catch them.
+
+Usage:
+    python -m evolution.evaluator "(?i)ignore\\s+previous" --corpus data/corpus.jsonl
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from multiprocessing import Pool, TimeoutError
+
+from sqlalchemy.exc import SQLAlchemyError
+
+# Run as a script, only evolution/ is on sys.path; make the repo root importable.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.normalize import normalize
+from app.rules import CompiledRuleSet
+from app.rulestore import active_document
+
+CORPUS_PATH = os.getenv("PROMPTSHIELD_EVAL_CORPUS", "data/corpus.jsonl")
+EVAL_WORKERS = int(os.getenv("PROMPTSHIELD_EVAL_WORKERS", "0")) or os.cpu_count() or 1
+# A candidate slower than this over the whole corpus is reported as an error (e.g. catastrophic backtracking).
+EVAL_TIMEOUT = float(os.getenv("PROMPTSHIELD_EVAL_TIMEOUT", "60"))
+# Candidates flagging more than this share of benign prompts are not queued for review.
+EVAL_MAX_FPR = float(os.getenv("PROMPTSHIELD_EVAL_MAX_FPR", "0.01"))
+
+ATTACK_LABELS = {"attack", "malicious", "injection", "jailbreak", "1", "true"}
+BENIGN_LABELS = {"benign", "safe", "clean", "0", "false"}
+SHARDS_PER_WORKER = 4
+MAX_EXAMPLES = 3
+EXAMPLE_CHARS = 200
+
+
+# --- CORPUS ---
+def parse_line(line):
+    """Returns (prompt, is_attack), or None for blank, malformed or unlabeled lines."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict):
+        return None
+    prompt = record.get("prompt", record.get("text"))
+    label = str(record.get("label", "")).strip().lower()
+    if not isinstance(prompt, str):
+        return None
+    if label in ATTACK_LABELS:
+        return prompt, True
+    if label in BENIGN_LABELS:
+        return prompt, False
+    return None
+
+
+def shard_ranges(path, shards):
+    """Splits a file into up to `shards` contiguous byte ranges."""
+    size = os.path.getsize(path)
+    shards = max(1, min(shards, size // 4096 or 1))
+    step = -(-size // shards)
+    return [(start, min(size, start + step)) for start in range(0, size, step)] or [(0, 0)]
+
+
+def iter_shard(path, start, end):
+    """Yields parsed records for lines starting in [start, end).
+
+    A line belongs to the shard its first byte falls in, so byte ranges split
+    mid-line never drop or repeat a record.
+    """
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start - 1)
+            if f.read(1) != b"\n":
+                f.readline()  # partial line; the previous shard owns it
+        while f.tell() < end:
+            raw = f.readline()
+            if not raw:
+                break
+            record = parse_line(raw.decode("utf-8", errors="replace"))
+            if record is not None:
+                yield record
+
+
+# --- WORKERS ---
+_candidates = None
+_existing = None
+
+
+def _init_worker(patterns, existing_patterns):
+    global _candidates, _existing
+    _candidates = [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+    _existing = CompiledRuleSet(existing_patterns)
+
+
+def _new_counts():
+    return {
+        "matches": 0,
+        "true_positives": 0,
+        "false_positives": 0,
+        "overlap": 0,
+        "new_attacks": 0,
+        "overlapping_rules": Counter(),
+        "false_positive_examples": [],
+    }
+
+
+def _evaluate_shard(args):
+    path, start, end = args
+    attacks = benign = 0
+    counts = [_new_counts() for _ in _candidates]
+    for prompt, is_attack in iter_shard(path, start, end):
+        if is_attack:
+            attacks += 1
+        else:
+            benign += 1
+        # Rules see what they would see live: the normalized view, then the raw text.
+        normalized = normalize(prompt)
+        for compiled, c in zip(_candidates, counts):
+            if not normalized.search(compiled):
+                continue
+            c["matches"] += 1
+            # Existing rules only run on candidate hits, not on the whole corpus.
+            covered_by = _existing.match_normalized(normalized)
+            if covered_by is not None:
+                c["overlap"] += 1
+                c["overlapping_rules"][covered_by] += 1
+            if is_attack:
+                c["true_positives"] += 1
+                if covered_by is None:
+                    c["new_attacks"] += 1
+            else:
+                c["false_positives"] += 1
+                if len(c["false_positive_examples"]) < MAX_EXAMPLES:
+                    c["false_positive_examples"].append(prompt[:EXAMPLE_CHARS])
+    return attacks, benign, counts
+
+
+def _merge(total, part):
+    for key in ("matches", "true_positives", "false_positives", "overlap", "new_attacks"):
+        total[key] += part[key]
+    total["overlapping_rules"].update(part["overlapping_rules"])
+    room = MAX_EXAMPLES - len(total["false_positive_examples"])
+    total["false_positive_examples"].extend(part["false_positive_examples"][:room])
+
+
+def _report(c, attacks, benign, seconds):
+    return {
+        "attacks": attacks,
+        "benign": benign,
+        "coverage": round(c["true_positives"] / attacks, 4) if attacks else 0.0,
+        "false_positive_rate": round(c["false_positives"] / benign, 4) if benign else 0.0,
+        # Share of the candidate's matches that active rules already block.
+        "overlap": round(c["overlap"] / c["matches"], 4) if c["matches"] else 0.0,
+        # Share of corpus attacks only this candidate blocks.
+        "new_coverage": round(c["new_attacks"] / attacks, 4) if attacks else 0.0,
+        "true_positives": c["true_positives"],
+        "false_positives": c["false_positives"],
+        "overlapping_rules": [[pattern, n] for pattern, n in c["overlapping_rules"].most_common(3)],
+        "false_positive_examples": c["false_positive_examples"],
+        "seconds": round(seconds, 2),
+    }
+
+
+# --- API ---
+def evaluate(patterns, corpus_path=CORPUS_PATH, rules_path=None, workers=EVAL_WORKERS,
+             timeout=EVAL_TIMEOUT):
+    """Scores each candidate pattern in one parallel pass over the corpus.
+
+    Returns {pattern: report}. Reports for invalid or too-slow patterns have
+    an "error" key; a missing corpus returns {} so callers can fall back.
+    """
+    if not os.path.exists(corpus_path):
+        print(f"Evaluation corpus {corpus_path} not found; skipping corpus evaluation.")
+        return {}
+    results, valid = {}, []
+    for pattern in dict.fromkeys(patterns):
+        try:
+            re.compile(pattern, re.IGNORECASE)
+            valid.append(pattern)
+        except (re.error, TypeError) as e:
+            results[pattern] = {"error": f"invalid regex: {e}"}
+    if not valid:
+        return results
+    try:
+        existing = active_document(rules_path)["patterns"]
+    except (OSError, ValueError, SQLAlchemyError):
+        existing = []
+
+    started = time.perf_counter()
+    ranges = shard_ranges(corpus_path, workers * SHARDS_PER_WORKER)
+    pool = Pool(min(workers, len(ranges)), initializer=_init_worker, initargs=(valid, existing))
+    try:
+        parts = pool.map_async(_evaluate_shard, [(corpus_path, start, end) for start, end in ranges]).get(timeout)
+        pool.close()
+    except TimeoutError:
+        if len(valid) > 1:
+            # Find the offender(s) instead of failing every candidate in the batch.
+            pool.terminate()
+            for pattern in valid:
+                results.update(evaluate([pattern], corpus_path, rules_path, workers, timeout))
+            return results
+        return {**results, valid[0]: {"error": f"evaluation exceeded {timeout:.0f}s"}}
+    finally:
+        pool.terminate()
+        pool.join()
+    seconds = time.perf_counter() - started
+
+    attacks = sum(part[0] for part in parts)
+    benign = sum(part[1] for part in parts)
+    for i, pattern in enumerate(valid):
+        total = _new_counts()
+        for part in parts:
+            _merge(total, part[2][i])
+        results[pattern] = {"corpus": corpus_path, **_report(total, attacks, benign, seconds)}
+    return results
+
+
+def evaluate_rule(pattern, **kwargs):
+    """Report for one candidate, or None when no corpus is available."""
+    return evaluate([pattern], **kwargs).get(pattern)
+
+
+def passes(report, max_fpr=EVAL_MAX_FPR):
+    """Whether a candidate's corpus report is good enough to queue for review."""
+    if report is None:
+        return True
+    return "error" not in report and report["false_positive_rate"] <= max_fpr and report["true_positives"] > 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("patterns", nargs="+", help="Candidate regexes")
+    parser.add_argument("--corpus", default=CORPUS_PATH, help="Labeled JSONL corpus")
+    parser.add_argument("--rules", help="Rules JSON file for overlap (default: the live rules)")
+    parser.add_argument("--workers", type=int, default=EVAL_WORKERS)
+    parser.add_argument("--timeout", type=float, default=EVAL_TIMEOUT)
+    args = parser.parse_args()
+    results = evaluate(args.patterns, args.corpus, args.rules, args.workers, args.timeout)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# evolution/optimizer.py
+"""Proposes a leaner, faster-ordered version of the active rule set.
+
+One parallel pass over the evaluation corpus (see evolution/evaluator.py)
+records which prompts every active rule matches and what each match costs.
+From that:
+- rules whose matches are all matched by another rule are removed
+  (subsumed), so blocking verdicts on the corpus do not change;
+- heavily overlapping pairs are suggested as merges, for a reviewer to apply;
+- an execution plan orders rules by hit rate per unit cost. Hit rates come
+  from live traffic (the rule_hits table) when there is enough of it. The
+  static layer confirms candidates in plan order but still reports the
+  first matching rule in file order.
+
+The result is queued in the rule store (app/rulestore.py) as a "ruleset"
+entry with a diff report, and approved or rejected on the dashboard like any
+other rule.
+
+Usage:
+    python -m evolution.optimizer            # print the report
+    python -m evolution.optimizer --submit   # and queue it for review
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from itertools import islice
+from multiprocessing import Pool
+
+# Run as a script, only evolution/ is on sys.path; make the repo root importable.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.models import engine
+from app.normalize import normalize
+from app.rules import CompiledRuleSet, _combinable_body, read_rule_hits, ruleset_version
+from app.rulestore import active_document, rule_store
+from evolution.evaluator import CORPUS_PATH, EVAL_WORKERS, SHARDS_PER_WORKER, iter_shard, shard_ranges
+
+# Live hit counts are trusted for ordering once there are at least this many.
+MIN_LIVE_HITS = 100
+# Jaccard similarity of match sets above which two rules are suggested as a merge.
+MERGE_OVERLAP = 0.5
+# Corpus prompts used to measure scan cost before and after.
+COST_SAMPLE = 20000
+
+
+# --- CORPUS PASS ---
+_compiled = None
+
+
+def _init_worker(patterns):
+    global _compiled
+    _compiled = [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+
+
+def _scan_shard(args):
+    path, start, end = args
+    records = attacks = 0
+    matches = [[] for _ in _compiled]
+    attack_matches = [0] * len(_compiled)
+    seconds = [0.0] * len(_compiled)
+    for prompt, is_attack in iter_shard(path, start, end):
+        normalized = normalize(prompt)
+        for i, compiled in enumerate(_compiled):
+            started = time.perf_counter()
+            found = normalized.search(compiled)
+            seconds[i] += time.perf_counter() - started
+            if found:
+                matches[i].append(records)
+                attack_matches[i] += is_attack
+        records += 1
+        attacks += is_attack
+    return records, attacks, matches, attack_matches, seconds
+
+
+def corpus_profile(patterns, corpus_path=CORPUS_PATH, workers=EVAL_WORKERS):
+    """Per-rule match sets (corpus line ordinals), attack matches and mean match cost."""
+    ranges = shard_ranges(corpus_path, workers * SHARDS_PER_WORKER)
+    with Pool(min(workers, len(ranges)), initializer=_init_worker, initargs=(patterns,)) as pool:
+        parts = pool.map(_scan_shard, [(corpus_path, start, end) for start, end in ranges])
+    offset = attacks = 0
+    match_sets = [set() for _ in patterns]
+    attack_matches = [0] * len(patterns)
+    seconds = [0.0] * len(patterns)
+    for records, shard_attacks, matches, shard_attack_matches, shard_seconds in parts:
+        for i in range(len(patterns)):
+            match_sets[i].update(offset + n for n in matches[i])
+            attack_matches[i] += shard_attack_matches[i]
+            seconds[i] += shard_seconds[i]
+        offset += records
+        attacks += shard_attacks
+    return {
+        "records": offset,
+        "attacks": attacks,
+        "match_sets": match_sets,
+        "attack_matches": attack_matches,
+        "mean_us": [1e6 * s / offset if offset else 0.0 for s in seconds],
+    }
+
+
+# --- ANALYSIS ---
+def find_subsumed(patterns, match_sets):
+    """{index: index of the rule that subsumes it}.
+
+    A rule is subsumed when it matched something on the corpus and everything
+    it matched is matched by a rule that is kept. Of identical match sets the
+    earliest rule is kept; exact duplicate patterns are always removed.
+    """
+    removed = {}
+    first_seen = {}
+    for i, pattern in enumerate(patterns):
+        if pattern in first_seen:
+            removed[i] = first_seen[pattern]
+        else:
+            first_seen[pattern] = i
+    # Narrowest rules first; among equals, later rules go first so earlier ones survive.
+    for i in sorted(range(len(patterns)), key=lambda i: (len(match_sets[i]), -i)):
+        if i in removed or not match_sets[i]:
+            continue
+        for j in range(len(patterns)):
+            if j != i and j not in removed and match_sets[i] <= match_sets[j]:
+                removed[i] = j
+                break
+    # Point at the surviving rule when the subsuming rule was itself removed.
+    for i, j in removed.items():
+        while j in removed:
+            j = removed[j]
+        removed[i] = j
+    return removed
+
+
+def suggest_merges(patterns, match_sets, keep, min_overlap=MERGE_OVERLAP):
+    """Pairs of kept rules that mostly match the same prompts, with a merged pattern."""
+    merges = []
+    for a_pos, a in enumerate(keep):
+        for b in keep[a_pos + 1:]:
+            union = len(match_sets[a] | match_sets[b])
+            overlap = len(match_sets[a] & match_sets[b]) / union if union else 0.0
+            if overlap < min_overlap:
+                continue
+            bodies = [_combinable_body(patterns[a]), _combinable_body(patterns[b])]
+            if None in bodies:
+                continue
+            merges.append({
+                "patterns": [patterns[a], patterns[b]],
+                "merged": "(?i)" + "|".join(f"(?:{body})" for body in bodies),
+                "overlap": round(overlap, 3),
+            })
+    return sorted(merges, key=lambda m: m["overlap"], reverse=True)
+
+
+def execution_plan(patterns, keep, hit_rates, mean_us):
+    """Kept patterns ordered by hit rate per microsecond, then by cost."""
+    return [patterns[i] for i in sorted(keep, key=lambda i: (-hit_rates[i] / max(mean_us[i], 0.01), mean_us[i], i))]
+
+
+def _scan_cost(ruleset, sample, repeats=3):
+    """Best-of-`repeats` microseconds per prompt, and the rule reported for each prompt."""
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        reports = [ruleset.match_normalized(prompt) for prompt in sample]
+        best = min(best, time.perf_counter() - started)
+    return 1e6 * best / max(1, len(sample)), reports
+
+
+def analyze(rules_path=None, corpus_path=CORPUS_PATH, hits_db=engine, workers=EVAL_WORKERS):
+    """Builds the optimized rule set and its diff report, or returns None without a corpus."""
+    if not os.path.exists(corpus_path):
+        print(f"Evaluation corpus {corpus_path} not found; cannot optimize rules.")
+        return None
+    document = active_document(rules_path)
+    patterns = document["patterns"]
+    valid = []
+    for pattern in patterns:
+        try:
+            re.compile(pattern, re.IGNORECASE)
+            valid.append(pattern)
+        except (re.error, TypeError):
+            print(f"Skipping invalid rule {pattern!r}")
+    patterns = valid
+
+    started = time.perf_counter()
+    profile = corpus_profile(patterns, corpus_path, workers)
+    match_sets = profile["match_sets"]
+    removed = find_subsumed(patterns, match_sets)
+    keep = [i for i in range(len(patterns)) if i not in removed]
+
+    live_hits = read_rule_hits(hits_db)
+    live_total = sum(live_hits.get(p, 0) for p in patterns)
+    if live_total >= MIN_LIVE_HITS:
+        source = "live"
+        hit_rates = [live_hits.get(p, 0) / live_total for p in patterns]
+    else:
+        source = "corpus"
+        hit_rates = [len(s) / max(1, profile["records"]) for s in match_sets]
+    plan = execution_plan(patterns, keep, hit_rates, profile["mean_us"])
+    optimized = [patterns[i] for i in keep]
+
+    # Measured, not estimated: time both rule sets on a corpus sample.
+    sample = [normalize(prompt) for prompt, _ in islice(iter_shard(corpus_path, 0, os.path.getsize(corpus_path)), COST_SAMPLE)]
+    before_us, before_reports = _scan_cost(CompiledRuleSet(patterns, plan=document.get("plan")), sample)
+    after_us, after_reports = _scan_cost(CompiledRuleSet(optimized, plan=plan), sample)
+    verdict_changes = sum((b is None) != (a is None) for b, a in zip(before_reports, after_reports))
+
+    report = {
+        "base_version": ruleset_version(document["patterns"]),
+        "corpus": corpus_path,
+        "corpus_records": profile["records"],
+        "hit_rate_source": source,
+        "rules": [
+            {
+                "pattern": p,
+                "corpus_matches": len(match_sets[i]),
+                "attack_matches": profile["attack_matches"][i],
+                "mean_us": round(profile["mean_us"][i], 3),
+                "live_hits": live_hits.get(p, 0),
+            }
+            for i, p in enumerate(patterns)
+        ],
+        "removed": [
+            {"pattern": patterns[i], "subsumed_by": patterns[j], "corpus_matches": len(match_sets[i]),
+             "live_hits": live_hits.get(patterns[i], 0)}
+            for i, j in sorted(removed.items())
+        ],
+        "merges": suggest_merges(patterns, match_sets, keep),
+        "plan": plan,
+        "scan_us_before": round(before_us, 2),
+        "scan_us_after": round(after_us, 2),
+        "sample_size": len(sample),
+        "verdict_changes": verdict_changes,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+    return {"patterns": optimized, "plan": plan, "report": report}
+
+
+def has_changes(result, rules_path=None):
+    document = active_document(rules_path)
+    return result["patterns"] != document["patterns"] or result["plan"] != document.get("plan")
+
+
+def submit(result):
+    """Queues the optimized rule set for review, replacing an older proposal."""
+    report = result["report"]
+    entry = {
+        "type": "ruleset",
+        "reason": (f"Remove {len(report['removed'])} subsumed rule(s) and reorder checks: "
+                   f"{report['scan_us_before']} -> {report['scan_us_after']} us per prompt"),
+        "source": "Rule Optimizer",
+        "timestamp": time.time(),
+        "base_version": report["base_version"],
+        "patterns": result["patterns"],
+        "plan": result["plan"],
+        "report": report,
+    }
+    entry["id"] = rule_store.queue(entry)
+    return entry
+
+
+def optimize_job():
+    """Scheduled from evolution/generator.py: queue a proposal when it would change anything."""
+    result = analyze()
+    if result is None:
+        return None
+    if not has_changes(result):
+        print(f"[{time.strftime('%H:%M:%S')}] Rule set already optimal.")
+        return None
+    entry = submit(result)
+    print(f"[{time.strftime('%H:%M:%S')}] Rule optimization queued: {entry['reason']}")
+    return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--rules", help="Rules JSON file to analyze instead of the live rules")
+    parser.add_argument("--workers", type=int, default=EVAL_WORKERS)
+    parser.add_argument("--submit", action="store_true", help="Queue the result for review")
+    args = parser.parse_args()
+    result = analyze(args.rules, args.corpus, workers=args.workers)
+    if result is None:
+        return
+    report = result["report"]
+    for item in report["removed"]:
+        print(f"REMOVE {item['pattern']!r}\n    subsumed by {item['subsumed_by']!r}")
+    for merge in report["merges"]:
+        print(f"MERGE? {merge['patterns']} (overlap {merge['overlap']:.0%})\n    -> {merge['merged']!r}")
+    print("PLAN (" + report["hit_rate_source"] + " hit rates):")
+    for rank, pattern in enumerate(report["plan"], 1):
+        print(f"  {rank}. {pattern}")
+    print(f"Scan cost: {report['scan_us_before']} -> {report['scan_us_after']} us/prompt on "
+          f"{report['sample_size']} prompts; blocking verdict changes: {report['verdict_changes']}")
+    if args.submit:
+        if has_changes(result, args.rules):
+            submit(result)
+            print("Queued for review.")
+        else:
+            print("Nothing to change.")
+
+
+if __name__ == "__main__":
+    main()
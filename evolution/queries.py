@@ -0,0 +1,225 @@
+# evolution/queries.py
+"""Read-side queries for the admin dashboard, computed inside SQLite.
+
+Counts are GROUP BY aggregates served from the (blocked_layer, timestamp)
+and timestamp indexes, and the event log is browsed with keyset pagination
+on (timestamp, id), so neither cost grows with the size of the table the way
+`SELECT *` into pandas does. Results are cached for QUERY_CACHE_TTL seconds
+so Streamlit reruns do not repeat identical queries.
+
+Once app/retention.py has rolled hours up and pruned old raw events, counts
+for complete hours before the rollup watermark come from
+flagged_prompt_rollups, so totals and charts still cover archived history.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import closing
+from datetime import datetime, timedelta
+from functools import wraps
+
+DB_PATH = "data/logs.db"
+QUERY_CACHE_TTL = float(os.getenv("PROMPTSHIELD_DASHBOARD_CACHE_TTL", "10"))
+
+LAYERS = ["Static Rule Checker", "Fingerprint Index", "ML Classifier", "Output Validator"]
+
+# strftime() formats truncating a stored timestamp to the start of its bucket.
+BUCKETS = {
+    "minute": "%Y-%m-%d %H:%M",
+    "hour": "%Y-%m-%d %H:00",
+    "day": "%Y-%m-%d",
+}
+
+# Same names as the Index objects in app/models.py.
+INDEXES = {
+    "ix_flagged_prompts_timestamp": "flagged_prompts (timestamp)",
+    "ix_flagged_prompts_layer_timestamp": "flagged_prompts (blocked_layer, timestamp)",
+}
+
+
+def connect(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path, timeout=5)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def ensure_indexes(db_path=DB_PATH):
+    """Creates the dashboard indexes on databases written before they existed."""
+    with closing(connect(db_path)) as conn, conn:
+        for name, target in INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def ttl_cache(ttl=QUERY_CACHE_TTL, max_entries=256):
+    """Memoizes a query function's result per argument set for `ttl` seconds."""
+    def decorator(func):
+        entries = {}
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (_freeze(args), _freeze(sorted(kwargs.items())))
+            now = time.monotonic()
+            with lock:
+                hit = entries.get(key)
+                if hit is not None and now - hit[0] < ttl:
+                    return hit[1]
+            value = func(*args, **kwargs)
+            with lock:
+                if len(entries) >= max_entries:
+                    entries.clear()
+                entries[key] = (now, value)
+            return value
+
+        wrapper.cache_clear = lambda: entries.clear()
+        return wrapper
+    return decorator
+
+
+def _as_text(value):
+    # Stored timestamps are "YYYY-MM-DD HH:MM:SS[.ffffff]" strings; compare like with like.
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f") if hasattr(value, "strftime") else value
+
+
+def _filters(layers=None, since=None, until=None, search=None):
+    clauses, params = [], []
+    if layers:
+        clauses.append(f"blocked_layer IN ({', '.join('?' for _ in layers)})")
+        params.extend(layers)
+    if since is not None:
+        clauses.append("timestamp >= ?")
+        params.append(_as_text(since))
+    if until is not None:
+        clauses.append("timestamp < ?")
+        params.append(_as_text(until))
+    if search:
+        clauses.append("(prompt LIKE ? ESCAPE '\\' OR blocked_content LIKE ? ESCAPE '\\')")
+        pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        params.extend([pattern, pattern])
+    return clauses, params
+
+
+def _where(clauses):
+    return f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+
+HOUR_FORMAT = "%Y-%m-%d %H:00:00"
+
+
+def _hour(value, up=False):
+    moment = value if hasattr(value, "strftime") else datetime.fromisoformat(value)
+    floor = moment.replace(minute=0, second=0, microsecond=0)
+    if up and floor != moment:
+        floor += timedelta(hours=1)
+    return floor.strftime(HOUR_FORMAT)
+
+
+def _rollup_range(conn, since=None, until=None):
+    """[start, end) of the complete hours in the range that are served from rollups, or None.
+
+    Raw events outside it (edge hours and anything after the watermark) are
+    counted directly, so nothing is counted twice. Ranges starting in
+    already-pruned history are therefore accurate to the hour.
+    """
+    try:
+        row = conn.execute("SELECT value FROM retention_state WHERE name = 'rollup_watermark'").fetchone()
+    except sqlite3.OperationalError:  # database predates app/retention.py
+        return None
+    if row is None:
+        return None
+    start = ""
+    if since is not None:
+        start = _hour(since, up=True)
+        oldest = conn.execute("SELECT MIN(timestamp) FROM flagged_prompts").fetchone()[0]
+        if oldest is None or oldest > _hour(since):
+            # The first hour's raw events may be archived already; count it whole from its rollup.
+            start = _hour(since)
+    end = min(row[0], _hour(until)) if until is not None else row[0]
+    return (start, end) if start < end else None
+
+
+def _counts(conn, group_sql, rollup_group_sql, layers=None, since=None, until=None):
+    """Counter of {(group..., blocked_layer): events} from raw rows plus rollups."""
+    counts = Counter()
+    clauses, params = _filters(layers=layers, since=since, until=until)
+    hours = _rollup_range(conn, since, until)
+    if hours is not None:
+        clauses.append("(timestamp < ? OR timestamp >= ?)")
+        params.extend(hours)
+    sql = f"SELECT {group_sql}, COUNT(*) FROM flagged_prompts {_where(clauses)} GROUP BY {group_sql}"
+    for *key, n in conn.execute(sql, params):
+        counts[tuple(key)] += n
+    if hours is not None:
+        clauses, params = _filters(layers=layers)
+        clauses.append("period = 'hour' AND bucket_start >= ? AND bucket_start < ?")
+        params.extend(hours)
+        sql = (f"SELECT {rollup_group_sql}, SUM(events) FROM flagged_prompt_rollups {_where(clauses)} "
+               f"GROUP BY {rollup_group_sql}")
+        for *key, n in conn.execute(sql, params):
+            counts[tuple(key)] += n
+    return counts
+
+
+@ttl_cache()
+def layer_counts(db_path=DB_PATH, since=None, until=None):
+    """{blocked_layer: events} over an optional time range."""
+    with closing(connect(db_path)) as conn:
+        counts = _counts(conn, "blocked_layer", "blocked_layer", since=since, until=until)
+    return {layer: n for (layer,), n in counts.items()}
+
+
+@ttl_cache()
+def time_buckets(db_path=DB_PATH, bucket="hour", since=None, until=None, layers=None):
+    """[(bucket start, blocked_layer, events)] ordered by bucket."""
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {sorted(BUCKETS)}, got {bucket!r}")
+    with closing(connect(db_path)) as conn:
+        if bucket == "minute":
+            # Finer than the hourly rollups: raw events only.
+            clauses, params = _filters(layers=layers, since=since, until=until)
+            sql = (
+                f"SELECT strftime('{BUCKETS[bucket]}', timestamp) AS bucket, blocked_layer, COUNT(*) AS n "
+                f"FROM flagged_prompts {_where(clauses)} GROUP BY bucket, blocked_layer ORDER BY bucket"
+            )
+            return [(row["bucket"], row["blocked_layer"], row["n"]) for row in conn.execute(sql, params)]
+        counts = _counts(conn, f"strftime('{BUCKETS[bucket]}', timestamp), blocked_layer",
+                         f"strftime('{BUCKETS[bucket]}', bucket_start), blocked_layer",
+                         layers=layers, since=since, until=until)
+    return sorted((bucket_start, layer, n) for (bucket_start, layer), n in counts.items())
+
+
+@ttl_cache()
+def events_page(db_path=DB_PATH, cursor=None, page_size=50, layers=None, since=None, until=None, search=None):
+    """One page of events, newest first, plus the cursor for the next page.
+
+    `cursor` is the (timestamp, id) of the last row of the previous page;
+    the next cursor is None on the last page.
+    """
+    clauses, params = _filters(layers, since, until, search)
+    if cursor is not None:
+        # Row-value comparison lets SQLite seek the timestamp index instead of using OFFSET.
+        clauses.append("(timestamp, id) < (?, ?)")
+        params.extend(cursor)
+    sql = (
+        "SELECT id, timestamp, blocked_layer, confidence_score, prompt, blocked_content, matched_event_id "
+        f"FROM flagged_prompts {_where(clauses)} ORDER BY timestamp DESC, id DESC LIMIT ?"
+    )
+    with closing(connect(db_path)) as conn:
+        rows = [dict(row) for row in conn.execute(sql, params + [page_size + 1])]
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = (rows[-1]["timestamp"], rows[-1]["id"]) if more else None
+    return rows, next_cursor
+
+
+def clear_cache():
+    for query in (layer_counts, time_buckets, events_page):
+        query.cache_clear()
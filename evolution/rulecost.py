@@ -0,0 +1,234 @@
+# evolution/rulecost.py
+"""Measures what a regex rule costs on the static layer's hot path.
+
+Each pattern is matched in a separate process against adversarial inputs
+built from its own literals: long repetitions, near-misses that almost match
+and then fail at the end, and words joined by nested separators. Each
+family runs at doubling lengths up to MAX_LENGTH. A single match taking
+longer than MATCH_TIMEOUT kills the process and marks the pattern
+"catastrophic". Otherwise the growth exponent between the two largest
+lengths is measured: about 1 is linear, and above MAX_EXPONENT the pattern
+is "superlinear".
+
+Usage:
+    python -m evolution.rulecost "(?i)ignore.*directions"   # profile candidates
+    python -m evolution.rulecost --active                   # every live rule
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+# Run as a script, only evolution/ is on sys.path; make the repo root importable.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.rulestore import active_document
+
+COSTS_PATH = "data/rule_costs.json"
+MATCH_TIMEOUT = float(os.getenv("PROMPTSHIELD_RULECOST_MATCH_TIMEOUT", "0.25"))
+MAX_LENGTH = int(os.getenv("PROMPTSHIELD_RULECOST_MAX_LENGTH", "8192"))
+MAX_EXPONENT = float(os.getenv("PROMPTSHIELD_RULECOST_MAX_EXPONENT", "1.5"))
+# With this off, superlinear (but not catastrophic) candidates are queued with a warning instead of dropped.
+REJECT_SUPERLINEAR = os.getenv("PROMPTSHIELD_RULECOST_REJECT_SUPERLINEAR", "1").lower() in ("1", "true", "yes", "on")
+# Memory cap for the profiling process, so a pathological pattern cannot take the host down with it.
+SANDBOX_MEMORY_MB = 512
+
+LENGTHS = tuple(2 ** k for k in range(8, int(math.log2(MAX_LENGTH)) + 1))
+# Below this, timings are noise and growth is not judged.
+NOISE_FLOOR_MS = 0.05
+SEPARATORS = (" ", ".", "-", "_", "\t", " . ", "-_-")
+FALLBACK_WORDS = ("a", "ignore", "system")
+
+
+# --- ADVERSARIAL INPUTS ---
+def pattern_words(pattern):
+    """Literal words in a pattern (escapes and classes removed), most specific first."""
+    stripped = re.sub(r"\\.|\[[^\]]*\]|\(\?[a-zA-Z]+\)|\(\?[:=!<P]", " ", pattern)
+    words = list(dict.fromkeys(w.lower() for w in re.findall(r"[A-Za-z]{2,}", stripped)))
+    return sorted(words, key=len, reverse=True)[:6] or list(FALLBACK_WORDS)
+
+
+def adversarial_families(pattern):
+    """{family: fn(length) -> text} of inputs likely to expose backtracking."""
+    words = pattern_words(pattern)
+    first, last = words[0], words[-1]
+
+    def fill(unit, length, tail=""):
+        return (unit * (length // max(1, len(unit)) + 1))[:max(0, length - len(tail))] + tail
+
+    return {
+        # One character repeated: classic food for (a+)+ and \s*\s* style nesting.
+        "repeat_char": lambda n: fill(first[0], n, "!"),
+        "repeat_space": lambda n: fill(" ", n, "!"),
+        # A word repeated with a separator, never completing the pattern.
+        "repeat_word": lambda n: fill(first + " ", n, "!"),
+        # Prefix of a match followed by a long gap, so .* gaps scan to the end and back.
+        "near_miss": lambda n: fill(" ".join(words[:-1] or words) + " ", n, last[:-1] + "!"),
+        # Words joined by mixed, nested separators.
+        "nested_separators": lambda n: fill("".join(w + SEPARATORS[i % len(SEPARATORS)]
+                                                    for i, w in enumerate(words * 2)), n, "!"),
+    }
+
+
+# --- SANDBOXED MEASUREMENT ---
+def _time_match(compiled, text, budget=0.005):
+    """Best-of-several seconds per search; slow searches run once, so one match is timed out, not several."""
+    best = float("inf")
+    spent = 0.0
+    runs = 0
+    while runs == 0 or (spent < budget and runs < 50):
+        started = time.perf_counter()
+        compiled.search(text)
+        elapsed = time.perf_counter() - started
+        best = min(best, elapsed)
+        spent += elapsed
+        runs += 1
+    return best
+
+
+def _sandbox(pattern, lengths, conn):
+    try:
+        import resource
+        limit = SANDBOX_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass
+    compiled = re.compile(pattern, re.IGNORECASE)
+    for family, make in adversarial_families(pattern).items():
+        for length in lengths:
+            conn.send(("start", family, length))
+            conn.send(("done", family, length, _time_match(compiled, make(length))))
+    conn.send(("end",))
+
+
+def _exponent(timings):
+    """Growth exponent between the two largest lengths, or None below the noise floor."""
+    (small_n, small_t), (big_n, big_t) = timings[-2], timings[-1]
+    if big_t * 1000 < NOISE_FLOOR_MS or small_t <= 0:
+        return None
+    return math.log(big_t / small_t) / math.log(big_n / small_n)
+
+
+def profile_rule(pattern, lengths=LENGTHS, match_timeout=MATCH_TIMEOUT, max_exponent=MAX_EXPONENT):
+    """Cost report for one pattern.
+
+    status is "ok", "superlinear", "catastrophic" (a match exceeded
+    match_timeout) or "invalid".
+    """
+    try:
+        re.compile(pattern, re.IGNORECASE)
+    except (re.error, TypeError) as e:
+        return {"pattern": pattern, "status": "invalid", "error": str(e)}
+
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_sandbox, args=(pattern, lengths, child), daemon=True)
+    started = time.perf_counter()
+    process.start()
+    child.close()
+    timings, timed_out = {}, None
+    try:
+        while True:
+            # Each match gets match_timeout; the rest of the protocol is fast.
+            if not parent.poll(match_timeout + 1.0):
+                timed_out = timed_out or ("unknown", None)
+                break
+            message = parent.recv()
+            if message[0] == "end":
+                break
+            if message[0] == "start":
+                timed_out = (message[1], message[2])
+                if not parent.poll(match_timeout):
+                    break
+                continue
+            _, family, length, seconds = message
+            timed_out = None
+            timings.setdefault(family, []).append((length, seconds))
+    except EOFError:
+        # The sandbox died (e.g. hit its memory cap) mid-match.
+        timed_out = timed_out or ("unknown", None)
+    finally:
+        if process.is_alive():
+            process.kill()
+        process.join()
+        parent.close()
+
+    report = {
+        "pattern": pattern,
+        "timings_ms": {family: [[n, round(t * 1000, 4)] for n, t in points] for family, points in timings.items()},
+        "profiled_seconds": round(time.perf_counter() - started, 2),
+    }
+    if timed_out is not None:
+        family, length = timed_out
+        return {**report, "status": "catastrophic", "worst_family": family,
+                "error": f"match on {length}-char '{family}' input exceeded {match_timeout * 1000:.0f} ms"}
+
+    worst_family, worst_exponent, max_ms = None, None, 0.0
+    for family, points in timings.items():
+        max_ms = max(max_ms, points[-1][1] * 1000)
+        exponent = _exponent(points) if len(points) >= 2 else None
+        if exponent is not None and (worst_exponent is None or exponent > worst_exponent):
+            worst_family, worst_exponent = family, exponent
+    return {
+        **report,
+        "status": "superlinear" if worst_exponent is not None and worst_exponent > max_exponent else "ok",
+        "worst_family": worst_family,
+        "exponent": round(worst_exponent, 2) if worst_exponent is not None else None,
+        # Slowest single match at the largest input length.
+        "max_ms": round(max_ms, 3),
+    }
+
+
+def passes(report, reject_superlinear=REJECT_SUPERLINEAR):
+    """Whether a candidate may be queued for review."""
+    if report["status"] == "superlinear":
+        return not reject_superlinear
+    return report["status"] == "ok"
+
+
+# --- ACTIVE RULE COSTS ---
+def load_costs(path=COSTS_PATH):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def active_rule_costs(rules_path=None, costs_path=COSTS_PATH):
+    """{pattern: report} for every active rule, profiling only rules not seen before."""
+    try:
+        patterns = active_document(rules_path)["patterns"]
+    except (OSError, ValueError, SQLAlchemyError):
+        patterns = []
+    costs = load_costs(costs_path)
+    missing = [p for p in patterns if p not in costs]
+    for pattern in missing:
+        costs[pattern] = profile_rule(pattern)
+    if missing:
+        os.makedirs(os.path.dirname(costs_path) or ".", exist_ok=True)
+        with open(costs_path, "w") as f:
+            json.dump({p: costs[p] for p in patterns}, f, indent=4)
+    return {p: costs[p] for p in patterns}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("patterns", nargs="*", help="Candidate regexes")
+    parser.add_argument("--active", action="store_true", help="Profile every live rule")
+    args = parser.parse_args()
+    if args.active:
+        reports = list(active_rule_costs().values())
+    else:
+        reports = [profile_rule(pattern) for pattern in args.patterns]
+    for report in reports:
+        detail = report.get("error") or f"exponent={report['exponent']}, max={report['max_ms']} ms"
+        print(f"{report['status']:<12} {report['pattern']}  ({detail})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+# gunicorn.conf.py
+"""Multi-worker deployment that loads the classifier once in the master.
+
+    gunicorn app.main:app -c gunicorn.conf.py
+
+With preload_app the model is loaded (and warmed) before forking, so every
+worker shares the weights copy-on-write instead of holding its own copy.
+"""
+import os
+
+os.environ.setdefault("PROMPTSHIELD_MODEL_LOAD", "preload")
+
+bind = os.getenv("PROMPTSHIELD_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("PROMPTSHIELD_WORKERS", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Split the CPU between workers so N torch thread pools don't oversubscribe the node.
+    import torch
+    from app.config import ML_THREADS
+
+    torch.set_num_threads(ML_THREADS or max(1, (os.cpu_count() or 1) // workers))
@@ -0,0 +1,43 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.models opens ./data/logs.db on import: run every test in a scratch directory
+# so the real attack log and rule store are never touched.
+_WORKDIR = tempfile.mkdtemp(prefix="promptshield-tests-")
+os.makedirs(os.path.join(_WORKDIR, "data"))
+os.chdir(_WORKDIR)
+os.environ.setdefault("PROMPTSHIELD_LLM_PROVIDER", "fake")
+os.environ.setdefault("PROMPTSHIELD_MODEL_LOAD", "lazy")
+
+from sqlalchemy import create_engine  # noqa: E402
+
+from app.models import Base  # noqa: E402
+from app.rulestore import RuleStore  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A fresh logs.db with every table created."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'logs.db'}")
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def store(db, tmp_path):
+    """An empty rule store (no legacy JSON files to import)."""
+    return RuleStore(db, rules_path=str(tmp_path / "rules.json"), pending_path=str(tmp_path / "pending.json"))
+
+
+def add_rule(store, pattern):
+    """Queues and approves one rule; returns the new version."""
+    pending_id = store.queue({"pattern": pattern})
+    return store.approve(pending_id)
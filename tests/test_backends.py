@@ -0,0 +1,79 @@
+# tests/test_backends.py
+import queue
+
+import pytest
+
+from app import backends
+from app.backends import OnnxBackend, QuantizedTorchBackend, TorchBackend, build_backend
+from bench.stubs import StubBackend
+from tools import parity
+
+
+class ShiftedBackend(StubBackend):
+    """The stub classifier with every score pushed up, so some verdicts flip."""
+
+    name = "stub-shifted"
+
+    def predict(self, features):
+        return [min(1.0, score + 0.3) for score in super().predict(features)]
+
+
+class InProcessContext:
+    """multiprocessing context stand-in: runs each backend in this process."""
+
+    Queue = queue.Queue
+
+    class Process:
+        def __init__(self, target, args):
+            self.target, self.args = target, args
+
+        def start(self):
+            self.target(*self.args)
+
+        def join(self):
+            pass
+
+
+def test_build_backend_picks_the_configured_class():
+    assert type(build_backend("some/model", "torch")) is TorchBackend
+    assert type(build_backend("some/model", "torch-int8")) is QuantizedTorchBackend
+    onnx = build_backend("some/model", "onnx", threads=2)
+    assert type(onnx) is OnnxBackend and onnx.threads == 2
+    assert onnx.path.endswith("some__model/model.onnx")
+    with pytest.raises(ValueError, match="Unknown ML backend"):
+        build_backend("some/model", "tensorrt")
+
+
+def test_cache_tags_differ_per_backend():
+    # Backends disagree slightly on scores, so cached verdicts must not be shared between them.
+    tags = {build_backend("some/model", name).cache_tag for name in ("torch", "torch-int8", "onnx")}
+    assert len(tags) == 3
+
+
+def test_read_corpus_accepts_jsonl_and_plain_text(tmp_path):
+    path = tmp_path / "corpus.jsonl"
+    path.write_text('{"prompt": "from json"}\n\nplain line\n{"not": "a prompt"}\nlast\n', encoding="utf-8")
+    assert list(parity.read_corpus(str(path))) == ["from json", "plain line", '{"not": "a prompt"}', "last"]
+    assert list(parity.read_corpus(str(path), limit=3)) == ["from json", "plain line"]
+
+
+def test_percentile():
+    assert parity.percentile([], 50) == 0.0
+    assert parity.percentile([5, 1, 3], 50) == 3
+    assert parity.percentile(list(range(101)), 95) == 95
+
+
+def test_parity_reports_deltas_and_flipped_verdicts(monkeypatch):
+    monkeypatch.setitem(backends.BACKENDS, StubBackend.name, StubBackend)
+    monkeypatch.setitem(backends.BACKENDS, ShiftedBackend.name, ShiftedBackend)
+    monkeypatch.setattr(parity.mp, "get_context", lambda method: InProcessContext)
+
+    reports = parity.run_parity(["stub", "stub-shifted"], parity.SAMPLE_PROMPTS, "stub", threshold=0.5)
+
+    reference, shifted = reports
+    assert reference["max_delta"] == 0.0 and reference["flipped"] == []
+    assert len(reference["scores"]) == len(parity.SAMPLE_PROMPTS)
+    assert 0.0 < shifted["mean_delta"] <= shifted["max_delta"] <= 0.3 + 1e-9
+    assert shifted["flipped"]
+    for flip in shifted["flipped"]:
+        assert flip["reference"] <= 0.5 < flip["score"]
@@ -0,0 +1,57 @@
+# tests/test_bench.py
+import sys
+
+import pytest
+
+from bench import results
+from bench.load import ATTACK_PROMPTS, make_prompts
+
+
+def _run(p95_ms, rps, rss_mb=100.0):
+    return {"environment": {"cpus": 1}, "results": [
+        {"name": "static", "p95_ms": p95_ms, "count": 10},
+        {"name": "load", "requests_per_s": rps, "peak_rss_mb": rss_mb, "ok": True},
+    ]}
+
+
+def test_latency_summary():
+    summary = results.latency_summary([float(ms) for ms in range(1, 101)])
+    assert (summary["count"], summary["p50_ms"], summary["p95_ms"], summary["max_ms"]) == (100, 51.0, 95.0, 100.0)
+    assert results.latency_summary([])["p99_ms"] == 0.0
+
+
+def test_compare_flags_regressions_in_the_right_direction():
+    rows = {row["metric"]: row for row in results.compare(_run(12.0, 80.0), _run(10.0, 100.0), tolerance=0.15)}
+    # Only *_ms, *_mb and *_per_s are compared; list rows are matched by name.
+    assert set(rows) == {"static.p95_ms", "load.requests_per_s", "load.peak_rss_mb"}
+    assert rows["static.p95_ms"]["regressed"]  # 20% slower
+    assert rows["load.requests_per_s"]["regressed"]  # 20% less throughput
+    assert not rows["load.peak_rss_mb"]["regressed"]
+
+    improved = results.compare(_run(5.0, 200.0), _run(10.0, 100.0))
+    assert not any(row["regressed"] for row in improved)
+    within = results.compare(_run(11.0, 90.0), _run(10.0, 100.0), tolerance=0.15)
+    assert not any(row["regressed"] for row in within)
+
+
+def test_cli_exits_non_zero_on_regression(tmp_path, monkeypatch, capsys):
+    current, baseline = tmp_path / "current.json", tmp_path / "baseline.json"
+    results.save_results(str(baseline), _run(10.0, 100.0))
+    results.save_results(str(current), _run(20.0, 100.0))
+    monkeypatch.setattr(sys, "argv", ["bench.results", str(current), str(baseline)])
+    with pytest.raises(SystemExit) as exited:
+        results.main()
+    assert exited.value.code == 1
+    assert "REGRESSION static.p95_ms" in capsys.readouterr().out
+
+
+def test_load_prompts_are_deterministic_and_unique():
+    prompts = make_prompts(200, attack_ratio=0.25, seed=3)
+    assert prompts == make_prompts(200, attack_ratio=0.25, seed=3)
+    assert len(set(prompts)) == len(prompts)  # no accidental verdict-cache hits
+    attack_starts = tuple(template.split("{")[0] for template in ATTACK_PROMPTS)
+    attacks = sum(prompt.startswith(attack_starts) for prompt in prompts)
+    assert 30 <= attacks <= 70
+
+    repeated = make_prompts(200, repeat_ratio=0.5, seed=3)
+    assert len(set(repeated)) < 150
@@ -0,0 +1,92 @@
+# tests/test_cache.py
+import pytest
+
+from app import cache
+from app.cache import VerdictCache, verdict_key
+
+SAFE = {"safe": True, "layer": None, "score": 0.1, "details": "Safe"}
+BLOCKED = {"safe": False, "layer": "ML Classifier", "score": 0.9, "details": "Blocked by ML (Confidence: 0.90)"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_ttl(clock):
+    verdicts = VerdictCache(ttl=10, disk_path=None)
+    verdicts.put("a", SAFE)
+    clock[0] += 9.9
+    assert verdicts.get("a") == SAFE
+    clock[0] += 0.2
+    assert verdicts.get("a") is None
+    assert len(verdicts) == 0
+    assert verdicts.stats()["expirations"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    verdicts = VerdictCache(max_entries=2, ttl=60, disk_path=None)
+    verdicts.put("a", SAFE)
+    verdicts.put("b", BLOCKED)
+    assert verdicts.get("a") == SAFE  # "b" is now the least recently used
+    verdicts.put("c", SAFE)
+    assert verdicts.get("b") is None
+    assert verdicts.get("a") == SAFE
+    assert verdicts.get("c") == SAFE
+    assert verdicts.stats()["evictions"] == 1
+
+
+def test_byte_bound_evicts_oldest(clock):
+    verdicts = VerdictCache(max_entries=100, max_bytes=2 * (cache._ENTRY_OVERHEAD + 100), ttl=60, disk_path=None)
+    for key in "abcd":
+        verdicts.put(key, SAFE)
+    assert len(verdicts) == 2
+    assert verdicts.get("a") is None and verdicts.get("d") == SAFE
+    assert verdicts.stats()["bytes"] <= verdicts.max_bytes
+
+
+def test_overwrite_does_not_leak_bytes(clock):
+    verdicts = VerdictCache(ttl=60, disk_path=None)
+    verdicts.put("a", SAFE)
+    size = verdicts.stats()["bytes"]
+    verdicts.put("a", SAFE)
+    assert verdicts.stats()["bytes"] == size
+
+
+def test_disk_tier_survives_restart_and_honours_ttl(clock, tmp_path):
+    path = str(tmp_path / "verdicts.db")
+    first = VerdictCache(ttl=10, disk_path=path)
+    first.put("a", BLOCKED)
+    first._disk.close()
+
+    second = VerdictCache(ttl=10, disk_path=path)
+    assert second.get("a") == BLOCKED
+    assert second.stats()["disk_hits"] == 1
+
+    third = VerdictCache(ttl=10, disk_path=path)
+    clock[0] += 11
+    assert third.get("a") is None
+
+
+def test_key_changes_with_rules_and_model():
+    key = verdict_key("hello", "v1", "model:torch")
+    assert key == verdict_key("hello", "v1", "model:torch")
+    assert key != verdict_key("hello", "v2", "model:torch")
+    assert key != verdict_key("hello", "v1", "model:onnx")
+    assert key != verdict_key("Hello", "v1", "model:torch")
+
+
+def test_promoted_disk_entry_keeps_its_original_expiry(clock, tmp_path):
+    path = str(tmp_path / "verdicts.db")
+    first = VerdictCache(ttl=10, disk_path=path)
+    first.put("a", SAFE)  # expires at 1010
+    first._disk.close()
+
+    clock[0] += 8
+    second = VerdictCache(ttl=10, disk_path=path)
+    assert second.get("a") == SAFE  # promoted from disk at 1008
+    clock[0] += 3
+    assert second.get("a") is None
+    assert second.stats()["expirations"] == 1
@@ -0,0 +1,124 @@
+# tests/test_concurrency.py
+import asyncio
+import contextvars
+import gc
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.concurrency import AdmissionController, AdmittedStreamingResponse, run_blocking
+
+SCOPE = {"type": "http", "asgi": {"spec_version": "2.4"}, "method": "POST", "path": "/"}
+
+
+async def _never_disconnects():
+    await asyncio.sleep(3600)
+
+
+def _respond(admission, body, send):
+    async def scenario():
+        await admission.acquire()
+        await AdmittedStreamingResponse(body, admission)(SCOPE, _never_disconnects, send)
+    return scenario()
+
+
+def test_slot_released_when_the_response_completes():
+    admission = AdmissionController(max_in_flight=1, max_queue=0)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def body():
+        yield "a"
+        yield "b"
+
+    asyncio.run(_respond(admission, body(), send))
+    assert b"".join(m.get("body", b"") for m in sent) == b"ab"
+    assert admission.in_flight == 0
+
+
+def test_slot_released_when_the_body_never_starts():
+    admission = AdmissionController(max_in_flight=1, max_queue=0)
+    started = []
+
+    async def send(message):
+        raise OSError("client went away")
+
+    async def body():
+        started.append(True)
+        yield "never sent"
+
+    with pytest.raises(Exception):
+        asyncio.run(_respond(admission, body(), send))
+    assert started == []
+    assert admission.in_flight == 0
+
+
+def test_full_controller_rejects_with_429():
+    admission = AdmissionController(max_in_flight=1, max_queue=0)
+
+    async def scenario():
+        await admission.acquire()
+        with pytest.raises(HTTPException) as rejected:
+            await admission.acquire()
+        admission.release()
+        await admission.acquire()  # the released slot is usable again
+        return rejected.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert admission.snapshot()["rejected"] == 1
+
+
+def test_blocking_work_runs_off_the_event_loop():
+    request_id = contextvars.ContextVar("request_id")
+    ticks = 0
+
+    def layer():
+        time.sleep(0.2)  # a CPU-bound layer, as far as the loop is concerned
+        return threading.current_thread().name, request_id.get(), ticks
+
+    async def scenario():
+        request_id.set("req-1")
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        clock = asyncio.ensure_future(ticker())
+        result = await run_blocking(layer)
+        clock.cancel()
+        return result
+
+    gc.collect()  # a full collection of the test session's heap would stall the loop for longer than the layer
+    thread, seen_id, ticks_while_blocked = asyncio.run(scenario())
+    assert thread.startswith("defense-layer")
+    assert seen_id == "req-1"  # context variables (the request trace) reach the worker thread
+    assert ticks_while_blocked > 0  # the loop kept serving while the layer ran
+
+
+def test_queued_request_gets_the_released_slot_or_times_out():
+    admission = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=0.05)
+
+    async def scenario():
+        await admission.acquire()
+        with pytest.raises(HTTPException) as timed_out:
+            await admission.acquire()  # waits queue_timeout, then 429
+        assert "timed out" in timed_out.value.detail
+
+        waiter = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0.01)
+        assert admission.waiting == 1
+        with pytest.raises(HTTPException):
+            await admission.acquire()  # the queue is full: rejected at once
+        admission.release()
+        await waiter
+        assert (admission.in_flight, admission.waiting) == (1, 0)
+
+    asyncio.run(scenario())
+    assert admission.rejected == 2
@@ -0,0 +1,186 @@
+# tests/test_gateway.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import gateway
+from app.gateway import LLMGateway, LLMUnavailable
+
+
+class ScriptedClient:
+    """chat.completions.create() that plays back a list of replies and exceptions."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, **params):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=outcome))])
+
+
+def _gateway(client, **kwargs):
+    settings = {"coalesce": False, "cache_ttl": 0, "max_retries": 2, "backoff_base": 0.0, "backoff_max": 0.0,
+                "breaker_threshold": 3, "breaker_cooldown": 30.0}
+    settings.update(kwargs)
+    return LLMGateway(client, **settings)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(gateway.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_transient_errors_are_retried():
+    client = ScriptedClient([ConnectionError("reset"), asyncio.TimeoutError(), "hello"])
+    llm = _gateway(client)
+    assert asyncio.run(llm.complete("hi")) == "hello"
+    assert client.calls == 3
+    assert llm.stats()["retries"] == 2
+    assert llm.circuit == "closed"
+
+
+def test_retries_are_bounded():
+    client = ScriptedClient([ConnectionError("reset")] * 10)
+    llm = _gateway(client, max_retries=2, breaker_threshold=10)
+    with pytest.raises(LLMUnavailable):
+        asyncio.run(llm.complete("hi"))
+    assert client.calls == 3
+    assert llm.stats()["retries"] == 2
+    assert llm.stats()["failures"] == 3
+
+
+def test_rejected_requests_are_not_retried():
+    client = ScriptedClient([ValueError("bad request")])
+    llm = _gateway(client)
+    with pytest.raises(ValueError):
+        asyncio.run(llm.complete("hi"))
+    assert client.calls == 1
+    assert llm.stats()["failures"] == 0
+
+
+def test_retry_after_header_sets_the_delay():
+    llm = _gateway(ScriptedClient([]), backoff_base=0.1, backoff_max=5.0)
+    error = ConnectionError("busy")
+    error.response = SimpleNamespace(headers={"retry-after": "2"})
+    assert llm._backoff(0, error) == 2.0
+    error.response = SimpleNamespace(headers={"retry-after": "60"})
+    assert llm._backoff(0, error) == 5.0
+
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    client = ScriptedClient([ConnectionError("down")] * 3 + [ConnectionError("still down"), "back"])
+    llm = _gateway(client, max_retries=0, breaker_threshold=3, breaker_cooldown=30.0)
+
+    async def scenario():
+        for _ in range(3):
+            with pytest.raises(LLMUnavailable):
+                await llm.complete("hi")
+        assert llm.circuit == "open"
+
+        with pytest.raises(LLMUnavailable) as refused:
+            await llm.complete("hi")
+        assert client.calls == 3  # failed fast, nothing sent upstream
+        assert refused.value.retry_after == 30.0
+
+        clock[0] += 30
+        assert llm.circuit == "half_open"
+        with pytest.raises(LLMUnavailable):
+            await llm.complete("hi")  # the trial call fails: open again
+        assert llm.circuit == "open"
+        assert llm.stats()["circuit_opens"] == 2
+
+        clock[0] += 30
+        assert await llm.complete("hi") == "back"
+        assert llm.circuit == "closed"
+
+    asyncio.run(scenario())
+    assert llm.stats()["short_circuited"] == 1
+
+
+def test_half_open_circuit_lets_one_trial_through(clock):
+    release = None
+
+    class SlowClient(ScriptedClient):
+        async def create(self, **params):
+            await release.wait()
+            return await super().create(**params)
+
+    client = SlowClient([])
+    llm = _gateway(client, max_retries=0, breaker_threshold=1, breaker_cooldown=10.0)
+    llm._opened_at = clock[0] - 10  # cooldown just elapsed
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        trial = asyncio.ensure_future(llm.complete("first"))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMUnavailable):
+            await llm.complete("second")
+        release.set()
+        assert await trial == "ok"
+
+    asyncio.run(scenario())
+    assert client.calls == 1
+    assert llm.circuit == "closed"
+
+
+def test_identical_concurrent_requests_share_one_call():
+    client = ScriptedClient(["shared"])
+    llm = _gateway(client, coalesce=True)
+
+    async def scenario():
+        return await asyncio.gather(*(llm.complete("same") for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["shared"] * 5
+    assert client.calls == 1
+    assert llm.stats()["coalesced"] == 4
+
+
+class BlockingClient(ScriptedClient):
+    """create() that waits for `release`, recording whether it was cancelled."""
+
+    def __init__(self, outcomes=()):
+        super().__init__(outcomes)
+        self.release = None
+        self.cancelled = 0
+
+    async def create(self, **params):
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return await super().create(**params)
+
+
+def test_upstream_call_is_cancelled_when_its_last_caller_leaves():
+    client = BlockingClient()
+    llm = _gateway(client, coalesce=True)
+
+    async def scenario():
+        client.release = asyncio.Event()
+        first = asyncio.ensure_future(llm.complete("same"))
+        second = asyncio.ensure_future(llm.complete("same"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert client.cancelled == 0  # the second caller still wants the response
+        second.cancel()
+        await asyncio.sleep(0.01)
+        assert client.cancelled == 1
+        assert llm.in_flight == 0 and not llm._inflight
+
+        client.release.set()  # a new identical request starts a fresh call
+        assert await llm.complete("same") == "ok"
+
+    asyncio.run(scenario())
+    assert llm.stats()["abandoned"] == 1
+
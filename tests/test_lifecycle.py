@@ -0,0 +1,64 @@
+# tests/test_lifecycle.py
+import threading
+import time
+
+import pytest
+
+from app import lifecycle
+from app.lifecycle import ModelManager, ModelUnavailable
+from bench.stubs import StubBackend
+
+
+class GatedBackend(StubBackend):
+    """Stub classifier whose load() waits until released, or fails when told to."""
+
+    def __init__(self, release, fail=False):
+        super().__init__("stub")
+        self.release = release
+        self.fail = fail
+
+    def load(self):
+        assert self.release.wait(10)
+        if self.fail:
+            raise OSError("no weights")
+        return super().load()
+
+
+def _manager(monkeypatch, **backend):
+    release = threading.Event()
+    builds = []
+
+    def build_backend(*args):
+        builds.append(args)
+        return GatedBackend(release, **backend)
+
+    monkeypatch.setattr(lifecycle, "build_backend", build_backend)
+    return ModelManager("stub", "stub", warmup=False, retry_interval=60), release, builds
+
+
+def test_requests_fail_fast_while_the_model_loads(monkeypatch):
+    manager, release, _ = _manager(monkeypatch)
+    loader = manager.load_in_background()
+    time.sleep(0.05)
+    assert manager.state == "loading"
+
+    started = time.perf_counter()
+    with pytest.raises(ModelUnavailable, match="still loading"):
+        manager.batcher()
+    assert time.perf_counter() - started < 0.5
+
+    release.set()
+    loader.join(5)
+    assert manager.ready
+    assert manager.batcher().score("hello") == manager.batcher().score_batch(["hello"])[0]
+
+
+def test_failed_load_is_not_retried_before_the_interval(monkeypatch):
+    manager, release, builds = _manager(monkeypatch, fail=True)
+    release.set()
+    with pytest.raises(ModelUnavailable, match="no weights"):
+        manager.load()
+    assert manager.state == "failed"
+    with pytest.raises(ModelUnavailable, match="no weights"):
+        manager.batcher()
+    assert len(builds) == 1
@@ -0,0 +1,100 @@
+# tests/test_logwriter.py
+import threading
+import time
+
+import pytest
+from sqlalchemy import text
+
+from app.logwriter import AttackLogWriter
+
+
+def _prompts(db):
+    with db.connect() as conn:
+        return [row[0] for row in conn.execute(text("SELECT prompt FROM flagged_prompts ORDER BY id"))]
+
+
+class GatedEngine:
+    """Wraps an engine so the writer's flushes wait until `release` is set."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.release = threading.Event()
+
+    def begin(self):
+        assert self.release.wait(10)
+        return self.engine.begin()
+
+
+def test_events_are_written_in_batches(db):
+    writer = AttackLogWriter(engine=db, batch_size=5, flush_interval=60)
+    for i in range(12):
+        writer.submit(f"attack {i}", "Static Rule Checker")
+    deadline = time.monotonic() + 5
+    while writer.stats()["written"] < 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    stats = writer.stats()
+    assert stats["written"] == 10 and stats["flushes"] == 2  # two full batches; 2 events still waiting
+    assert stats["queue_depth"] == 2
+    writer.close()
+    assert _prompts(db) == [f"attack {i}" for i in range(12)]
+
+
+def test_close_drains_the_queue(db):
+    writer = AttackLogWriter(engine=db, batch_size=100, flush_interval=60)
+    for i in range(7):
+        writer.submit(f"attack {i}", "ML Classifier", 0.9)
+    assert _prompts(db) == []
+    writer.close()
+    assert _prompts(db) == [f"attack {i}" for i in range(7)]
+    assert writer.stats()["queue_depth"] == 0
+
+
+def test_drop_oldest_keeps_the_newest_events(db):
+    gated = GatedEngine(db)
+    writer = AttackLogWriter(engine=gated, batch_size=1, flush_interval=60, max_queue=3)
+    writer.submit("in flight", "Static Rule Checker")
+    time.sleep(0.05)  # the worker takes it and waits on the gate
+    for i in range(5):
+        assert writer.submit(f"attack {i}", "Static Rule Checker")
+    gated.release.set()
+    writer.close()
+    assert writer.stats()["dropped"] == 2
+    assert _prompts(db) == ["in flight", "attack 2", "attack 3", "attack 4"]
+
+
+def test_block_policy_waits_then_drops_the_new_event(db):
+    gated = GatedEngine(db)
+    writer = AttackLogWriter(engine=gated, batch_size=1, flush_interval=60, max_queue=2,
+                             backpressure="block", block_timeout=0.05)
+    writer.submit("in flight", "Static Rule Checker")
+    time.sleep(0.05)
+    assert writer.submit("attack 0", "Static Rule Checker")
+    assert writer.submit("attack 1", "Static Rule Checker")
+    started = time.perf_counter()
+    assert not writer.submit("attack 2", "Static Rule Checker")
+    assert time.perf_counter() - started >= 0.04
+    gated.release.set()
+    writer.close()
+    assert writer.stats()["dropped"] == 1
+    assert _prompts(db) == ["in flight", "attack 0", "attack 1"]
+
+
+def test_listeners_receive_written_events_with_their_ids(db):
+    received = []
+    writer = AttackLogWriter(engine=db, batch_size=3, flush_interval=60)
+    writer.add_listener(received.extend)
+    writer.add_listener(lambda events: 1 / 0)  # a failing listener does not stop the others
+    for i in range(3):
+        writer.submit(f"attack {i}", "Static Rule Checker")
+    writer.close()
+
+    with db.connect() as conn:
+        rows = [tuple(row) for row in conn.execute(text("SELECT id, prompt FROM flagged_prompts ORDER BY id"))]
+    assert [(event["id"], event["prompt"]) for event in received] == rows
+    assert len(rows) == 3
+
+
+def test_unknown_backpressure_policy_is_rejected(db):
+    with pytest.raises(ValueError, match="backpressure"):
+        AttackLogWriter(engine=db, backpressure="drop_newest")
@@ -0,0 +1,62 @@
+# tests/test_metrics.py
+import pytest
+
+from app.metrics import CONTENT_TYPE, MetricsRegistry
+
+
+def test_counter_renders_one_line_per_label_set():
+    registry = MetricsRegistry()
+    verdicts = registry.counter("verdicts_total", "Decisions.", ["layer", "verdict"])
+    verdicts.labels("static", "blocked").inc()
+    verdicts.labels("static", "blocked").inc(2)
+    verdicts.labels("ml", 'say "hi"\n').inc()
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP verdicts_total Decisions.", "# TYPE verdicts_total counter"]
+    assert 'verdicts_total{layer="static",verdict="blocked"} 3' in lines
+    assert 'verdicts_total{layer="ml",verdict="say \\"hi\\"\\n"} 1' in lines
+    with pytest.raises(ValueError, match="expects labels"):
+        verdicts.labels("static")
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value)
+    lines = registry.render().splitlines()[2:]
+    assert lines == [
+        'latency_seconds_bucket{le="0.1"} 2',  # a value on a bound counts in that bucket
+        'latency_seconds_bucket{le="1.0"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 3.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_sampled_metrics_read_their_source_at_scrape_time():
+    registry = MetricsRegistry()
+    stats = {"requests": 1}
+    registry.sampled("gateway_events_total", "Events.", lambda: {(key,): value for key, value in stats.items()},
+                     labels=["event"], type="counter")
+    registry.sampled("broken", "Fails to read.", lambda: 1 / 0)
+    assert 'gateway_events_total{event="requests"} 1' in registry.render()
+    stats["requests"] = 5
+    rendered = registry.render()
+    assert 'gateway_events_total{event="requests"} 5' in rendered
+    # A failing source only loses its own samples.
+    assert "# TYPE broken gauge" in rendered and "\nbroken " not in rendered
+
+
+def test_metrics_endpoint_exposes_layer_metrics():
+    from fastapi.testclient import TestClient
+
+    from app import main
+    from app.metrics import VERDICTS
+
+    VERDICTS.labels("static", "blocked").inc()
+    response = TestClient(main.app).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == CONTENT_TYPE
+    assert "# TYPE promptshield_layer_latency_seconds histogram" in response.text
+    assert 'promptshield_verdicts_total{layer="static",verdict="blocked"}' in response.text
+    assert "promptshield_llm_gateway_events_total" in response.text
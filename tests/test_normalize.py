@@ -0,0 +1,37 @@
+# tests/test_normalize.py
+import pytest
+
+from app.normalize import normalize
+
+
+@pytest.mark.parametrize("raw, text", [
+    ("i.g.n.o.r.e all rules", "ignore all rules"),
+    ("p a s s w o r d", "password"),
+    ("r-e-v-e-a-l it", "reveal it"),
+    ("\uff49\uff47\uff4e\uff4f\uff52\uff45", "ignore"),  # full-width
+    ("ign\u200bore", "ignore"),
+    ("раssword", "password"),  # Cyrillic "р" and "а"
+])
+def test_obfuscation_is_undone(raw, text):
+    normalized = normalize(raw)
+    assert normalized.text == text
+    assert normalized.changed and normalized.obfuscated
+
+
+@pytest.mark.parametrize("raw", ["U.S.A.", "a, b, c", "a, b, c, d", "Plan A/B/C", "Ignore the noise"])
+def test_ordinary_text_is_not_rejoined(raw):
+    normalized = normalize(raw)
+    assert normalized.text == raw.lower()
+    assert not normalized.obfuscated
+
+
+def test_accents_change_the_view_but_are_not_obfuscation():
+    normalized = normalize("Café crème")
+    assert normalized.text == "cafe creme"
+    assert normalized.changed and not normalized.obfuscated
+
+
+def test_offsets_point_back_into_the_raw_text():
+    normalized = normalize("say P.A.S.S.W.O.R.D now")
+    start = normalized.text.index("password")
+    assert normalized.raw_slice(start, start + len("password")) == "P.A.S.S.W.O.R.D"
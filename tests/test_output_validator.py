@@ -0,0 +1,57 @@
+# tests/test_output_validator.py
+import random
+
+import pytest
+
+from app.layers import StreamingOutputValidator, output_layer
+from app.normalize import normalize
+
+LEAKS = [
+    "Your pass" + "\u200b" * 60 + "word is hunter2",
+    "the secret_" + "\u0301" * 60 + "token is abc",
+    "p a s s" + "\u200b" * 20 + " w o r d: 1234",
+    "aws" + "\u200d\u0301" * 30 + "_key=AKIA",
+    "plain password here",
+]
+SAFE = [
+    "Nothing to see" + "\u200b" * 80 + " here, pass the salt.",
+    "The word is spelled p-a-s-s, then a gap.",
+    "Café crème " * 20,
+]
+
+
+def _splits(text, seed):
+    rng = random.Random(seed)
+    yield list(text)  # one character per chunk
+    for _ in range(20):
+        cuts = sorted(rng.sample(range(1, len(text)), rng.randint(1, 6)))
+        yield [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+def _stream(chunks):
+    validator = StreamingOutputValidator("prompt")
+    emitted = []
+    for chunk in chunks:
+        safe, text = validator.feed(chunk)
+        emitted.append(text)
+        if not safe:
+            return False, "".join(emitted)
+    emitted.append(validator.finish())
+    return True, "".join(emitted)
+
+
+@pytest.mark.parametrize("text", LEAKS)
+def test_stuffed_leaks_are_caught_across_chunk_boundaries(text):
+    assert not output_layer(text, "prompt")[0]
+    for chunks in _splits(text, seed=len(text)):
+        safe, emitted = _stream(chunks)
+        assert not safe, chunks
+        leaked = normalize(emitted).text
+        assert not any(word in leaked for word in ("password", "aws_key", "secret_token")), chunks
+
+
+@pytest.mark.parametrize("text", SAFE)
+def test_safe_text_is_forwarded_whole(text):
+    assert output_layer(text, "prompt")[0]
+    for chunks in _splits(text, seed=len(text)):
+        assert _stream(chunks) == (True, text)
@@ -0,0 +1,136 @@
+# tests/test_pipeline.py
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app import pipeline
+from app.gateway import LLMGateway
+from app.layers import Screening
+from app.metrics import LAYER_TIMEOUTS, PIPELINE_DISCARDED_LLM_CALLS
+from app.normalize import normalize
+from app.pipeline import LayerTimeout, PipelineExecutor, PipelinePolicy
+
+SAFE = {"safe": True, "layer": None, "score": 0.1, "details": "Safe"}
+BLOCKED = {"safe": False, "layer": "ML Classifier", "score": 0.99, "details": "Blocked by ML (Confidence: 0.99)"}
+
+
+class SlowLLM:
+    """chat.completions.create() that answers after `delay` seconds, recording cancellations."""
+
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = 0
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, **params):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="answer"))])
+
+
+@pytest.fixture
+def layers(monkeypatch):
+    """Stand-in Layers 1-2: `screen_delay` / `ml_delay` seconds, then `ml_verdict`."""
+    fake = SimpleNamespace(screen_delay=0.0, ml_delay=0.0, ml_verdict=SAFE)
+
+    def prescreen(prompt):
+        time.sleep(fake.screen_delay)
+        return Screening(normalize(prompt), None, None)
+
+    def finish_screen(screening):
+        time.sleep(fake.ml_delay)
+        return fake.ml_verdict
+
+    monkeypatch.setattr(pipeline, "prescreen", prescreen)
+    monkeypatch.setattr(pipeline, "finish_screen", finish_screen)
+    return fake
+
+
+def _executor(client, route, **policy):
+    llm = LLMGateway(client, coalesce=True, cache_ttl=0, max_retries=0)
+    return PipelineExecutor(llm, policies={route: PipelinePolicy(**policy)})
+
+
+def test_speculative_call_is_cancelled_when_ml_blocks(layers):
+    layers.ml_delay, layers.ml_verdict = 0.05, BLOCKED
+    client = SlowLLM(delay=0.5)
+    executor = _executor(client, "/spec-block", mode="speculative")
+    discarded = PIPELINE_DISCARDED_LLM_CALLS.labels("/spec-block")
+
+    async def scenario():
+        result = await executor.run("tell me a story", "/spec-block")
+        await asyncio.sleep(0.01)  # let the cancellation reach the upstream call
+        return result
+
+    assert asyncio.run(scenario()) == (BLOCKED, None)
+    assert (client.calls, client.cancelled) == (1, 1)
+    assert discarded.value == 1
+    assert executor.gateway.stats()["abandoned"] == 1
+
+
+def test_speculative_call_overlaps_ml_when_it_passes(layers):
+    layers.ml_delay = 0.2
+    client = SlowLLM(delay=0.2)
+    executor = _executor(client, "/spec-pass", mode="speculative")
+    started = time.perf_counter()
+    assert asyncio.run(executor.run("tell me a story", "/spec-pass")) == (SAFE, "answer")
+    assert time.perf_counter() - started < 0.35
+    assert PIPELINE_DISCARDED_LLM_CALLS.labels("/spec-pass").value == 0
+
+
+def test_sequential_block_never_calls_the_llm(layers):
+    layers.ml_verdict = BLOCKED
+    client = SlowLLM()
+    executor = _executor(client, "/seq-block", mode="sequential")
+    assert asyncio.run(executor.run("tell me a story", "/seq-block")) == (BLOCKED, None)
+    assert client.calls == 0
+
+
+def test_screen_timeout_fails_closed(layers):
+    layers.screen_delay = 0.2
+    client = SlowLLM()
+    executor = _executor(client, "/screen-timeout", screen_timeout=0.02)
+    timeouts = LAYER_TIMEOUTS.labels("static", "closed")
+    before = timeouts.value
+    with pytest.raises(LayerTimeout) as raised:
+        asyncio.run(executor.run("tell me a story", "/screen-timeout"))
+    assert raised.value.layer == "Static Rule Checker"
+    assert timeouts.value == before + 1
+    assert client.calls == 0
+
+
+def test_ml_timeout_fails_closed_or_open_per_policy(layers):
+    layers.ml_delay = 0.2
+    closed = _executor(SlowLLM(delay=0), "/ml-closed", ml_timeout=0.02, ml_timeout_policy="closed")
+    with pytest.raises(LayerTimeout) as raised:
+        asyncio.run(closed.run("tell me a story", "/ml-closed"))
+    assert raised.value.layer == "ML Classifier"
+
+    client = SlowLLM(delay=0)
+    opened = _executor(client, "/ml-open", ml_timeout=0.02, ml_timeout_policy="open")
+    before = LAYER_TIMEOUTS.labels("ml", "open").value
+    verdict, response = asyncio.run(opened.run("tell me a story", "/ml-open"))
+    assert verdict["safe"] and verdict["details"] == "Safe (ML timed out, failed open)"
+    assert response == "answer"
+    assert LAYER_TIMEOUTS.labels("ml", "open").value == before + 1
+
+
+def test_speculative_call_is_cancelled_when_ml_times_out_closed(layers):
+    layers.ml_delay = 0.2
+    client = SlowLLM(delay=0.5)
+    executor = _executor(client, "/spec-timeout", mode="speculative", ml_timeout=0.02)
+
+    async def scenario():
+        with pytest.raises(LayerTimeout):
+            await executor.run("tell me a story", "/spec-timeout")
+        await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+    assert client.cancelled == 1
@@ -0,0 +1,81 @@
+# tests/test_queries.py
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from app import retention
+from app.models import FlaggedPrompt
+from evolution import queries
+
+START = datetime(2026, 3, 1, 22, 0, 0)
+LAYERS = ("Static Rule Checker", "ML Classifier", "Output Validator")
+
+
+@pytest.fixture
+def log(db, tmp_path, monkeypatch):
+    """Scratch logs.db with 60 events over 15 hours; returns (db path, events)."""
+    monkeypatch.setattr(retention, "engine", db)
+    rows = [{"prompt": f"attack {i}" + (" 50% off" if i % 10 == 0 else ""), "blocked_layer": LAYERS[i % 3],
+             "confidence_score": 1.0, "timestamp": START + timedelta(minutes=15 * i)} for i in range(60)]
+    with db.begin() as conn:
+        conn.execute(insert(FlaggedPrompt.__table__), rows)
+    queries.clear_cache()
+    yield str(tmp_path / "logs.db"), rows
+    queries.clear_cache()
+
+
+def test_layer_counts_and_time_buckets(log):
+    path, rows = log
+    assert queries.layer_counts(db_path=path) == {layer: 20 for layer in LAYERS}
+    since = START + timedelta(hours=10)
+    assert sum(queries.layer_counts(db_path=path, since=since).values()) == 20
+
+    hours = queries.time_buckets(db_path=path, bucket="hour", layers=("ML Classifier",))
+    assert sum(n for _, _, n in hours) == 20
+    assert {layer for _, layer, _ in hours} == {"ML Classifier"}
+    assert [bucket for bucket, _, _ in hours] == sorted(bucket for bucket, _, _ in hours)
+    with pytest.raises(ValueError, match="bucket"):
+        queries.time_buckets(db_path=path, bucket="week")
+
+
+def test_keyset_pages_cover_every_event_once(log):
+    path, rows = log
+    seen, cursor = [], None
+    while True:
+        page, cursor = queries.events_page(db_path=path, cursor=cursor, page_size=7)
+        seen.extend(page)
+        if cursor is None:
+            break
+    assert [event["prompt"] for event in seen] == [row["prompt"] for row in reversed(rows)]
+    assert set(seen[0]) >= {"id", "timestamp", "blocked_layer", "matched_event_id"}
+
+
+def test_search_matches_literal_wildcards(log):
+    path, _ = log
+    page, _ = queries.events_page(db_path=path, search="50%", page_size=100)
+    assert sorted(event["prompt"] for event in page) == sorted(f"attack {i} 50% off" for i in range(0, 60, 10))
+    assert queries.events_page(db_path=path, search="attack_1", page_size=100)[0] == []
+
+
+def test_counts_include_archived_history(log, tmp_path):
+    path, rows = log
+    now = START + timedelta(days=2)
+    retention.run_rollups(now=now, lag_minutes=0)
+    assert retention.archive_and_prune(now=now, retention_days=1, pause=0, archive_dir=str(tmp_path / "archive"))
+    queries.clear_cache()
+    assert queries.events_page(db_path=path)[0] == []  # every raw event is archived
+    assert queries.layer_counts(db_path=path) == {layer: 20 for layer in LAYERS}
+    since = START + timedelta(hours=10)
+    assert sum(queries.layer_counts(db_path=path, since=since).values()) == 20
+
+
+def test_results_are_cached_until_cleared(log, db):
+    path, _ = log
+    before = queries.layer_counts(db_path=path)
+    with db.begin() as conn:
+        conn.execute(insert(FlaggedPrompt.__table__), [{"prompt": "late", "blocked_layer": "ML Classifier",
+                                                        "confidence_score": 1.0, "timestamp": START}])
+    assert queries.layer_counts(db_path=path) == before
+    queries.clear_cache()
+    assert queries.layer_counts(db_path=path)["ML Classifier"] == 21
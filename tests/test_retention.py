@@ -0,0 +1,100 @@
+# tests/test_retention.py
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert, text
+
+from app import retention
+from app.models import FlaggedPrompt
+
+START = datetime(2026, 3, 1, 22, 0, 0)
+LAYERS = ("Static Rule Checker", "ML Classifier")
+
+
+@pytest.fixture
+def events(db, monkeypatch):
+    """Scratch logs.db holding 30 hours of events, two layers, one every 15 minutes."""
+    monkeypatch.setattr(retention, "engine", db)
+    rows = []
+    for i in range(120):
+        moment = START + timedelta(minutes=15 * i, seconds=i % 7)
+        layer = LAYERS[i % 2]
+        score = 1.0 if layer == "Static Rule Checker" else round(0.5 + (i % 5) / 10, 2)
+        rows.append({"prompt": f"attack {i}", "blocked_layer": layer, "confidence_score": score, "timestamp": moment})
+    with db.begin() as conn:
+        conn.execute(insert(FlaggedPrompt.__table__), rows)
+    return rows
+
+
+def _rollups(db, period):
+    with db.connect() as conn:
+        return [dict(row._mapping) for row in conn.execute(text(
+            "SELECT * FROM flagged_prompt_rollups WHERE period = :period ORDER BY bucket_start, blocked_layer"
+        ), {"period": period})]
+
+
+def _totals(rows):
+    totals = {}
+    for row in rows:
+        layer = totals.setdefault(row["blocked_layer"], {"events": 0, "score_sum": 0.0, "histogram": [0] * 10})
+        layer["events"] += row["events"]
+        layer["score_sum"] += row["score_sum"]
+        histogram = json.loads(row["score_histogram"])
+        layer["histogram"] = [a + b for a, b in zip(layer["histogram"], histogram)]
+    return totals
+
+
+def _expected(events):
+    totals = {}
+    for event in events:
+        layer = totals.setdefault(event["blocked_layer"], {"events": 0, "score_sum": 0.0, "histogram": [0] * 10})
+        layer["events"] += 1
+        layer["score_sum"] += event["confidence_score"]
+        layer["histogram"][min(int(event["confidence_score"] * 10), 9)] += 1
+    return totals
+
+
+def test_hour_and_day_rollups_match_raw_totals(db, events):
+    end = START + timedelta(hours=30)
+    assert retention.run_rollups(now=end, lag_minutes=0) == 30
+    expected = _expected(events)
+    for period in ("hour", "day"):
+        totals = _totals(_rollups(db, period))
+        assert totals.keys() == expected.keys()
+        for layer, values in expected.items():
+            assert totals[layer]["events"] == values["events"]
+            assert totals[layer]["score_sum"] == pytest.approx(values["score_sum"])
+            assert totals[layer]["histogram"] == values["histogram"]
+    days = {row["bucket_start"] for row in _rollups(db, "day")}
+    assert days == {"2026-03-01 00:00:00", "2026-03-02 00:00:00", "2026-03-03 00:00:00"}
+
+
+def test_rollups_are_incremental_and_idempotent(db, events):
+    retention.run_rollups(now=START + timedelta(hours=10), lag_minutes=0)
+    assert retention.rollup_watermark() == "2026-03-02 08:00:00"
+    assert retention.run_rollups(now=START + timedelta(hours=10), lag_minutes=0) == 0
+    retention.run_rollups(now=START + timedelta(hours=30), lag_minutes=0)
+    assert _totals(_rollups(db, "day"))["ML Classifier"]["events"] == 60
+    assert _totals(_rollups(db, "hour"))["Static Rule Checker"]["events"] == 60
+
+
+def test_archive_keeps_rollups_and_history_complete(db, events, tmp_path):
+    now = START + timedelta(days=2, hours=6)
+    retention.run_rollups(now=now, lag_minutes=0)
+    before = _totals(_rollups(db, "hour"))
+    archive = str(tmp_path / "archive")
+    moved = retention.archive_and_prune(now=now, retention_days=1, pause=0, archive_dir=archive)
+
+    with db.connect() as conn:
+        live = conn.execute(text("SELECT COUNT(*) FROM flagged_prompts")).scalar()
+    assert moved > 0 and moved + live == len(events)
+    assert _totals(_rollups(db, "hour")) == before
+    history = list(retention.iter_history(archive_dir=archive))
+    assert [event["prompt"] for event in history] == [event["prompt"] for event in events]
+
+
+def test_unrolled_events_are_never_pruned(db, events, tmp_path):
+    archive = str(tmp_path / "archive")
+    assert retention.archive_and_prune(now=START + timedelta(days=30), retention_days=1, pause=0,
+                                       archive_dir=archive) == 0
@@ -0,0 +1,61 @@
+# tests/test_rulecost.py
+import json
+
+from evolution import rulecost
+
+LENGTHS = (256, 512, 1024)
+
+
+def test_adversarial_inputs_are_built_from_the_pattern():
+    assert rulecost.pattern_words(r"(?i)\bignore\s+(all|previous)\s+[a-z]+") == ["previous", "ignore", "all"]
+    assert rulecost.pattern_words(r"\d+") == list(rulecost.FALLBACK_WORDS)
+    for family, make in rulecost.adversarial_families(r"ignore.*directions").items():
+        text = make(512)
+        assert len(text) == 512 and text.endswith("!"), family
+    near_miss = rulecost.adversarial_families(r"ignore.*directions")["near_miss"](512)
+    assert near_miss.startswith("directions ") and near_miss.endswith(" ignor!")  # the last word never completes
+
+
+def test_growth_exponent():
+    assert rulecost._exponent([(256, 0.001), (512, 0.002)]) == 1.0
+    assert rulecost._exponent([(256, 0.001), (512, 0.004)]) == 2.0
+    assert rulecost._exponent([(256, 1e-8), (512, 2e-8)]) is None  # below the noise floor
+
+
+def test_linear_pattern_is_ok():
+    report = rulecost.profile_rule(r"(?i)ignore\s+previous", lengths=LENGTHS)
+    assert report["status"] == "ok"
+    assert set(report["timings_ms"]) == set(rulecost.adversarial_families(r"ignore\s+previous"))
+    assert [n for n, _ in report["timings_ms"]["near_miss"]] == list(LENGTHS)
+    assert rulecost.passes(report)
+
+
+def test_catastrophic_pattern_is_killed():
+    report = rulecost.profile_rule(r"^(a+)+$", lengths=LENGTHS, match_timeout=0.2)
+    assert report["status"] == "catastrophic"
+    assert report["worst_family"] == "repeat_char"
+    assert "exceeded 200 ms" in report["error"]
+    assert report["profiled_seconds"] < 5
+    assert not rulecost.passes(report)
+
+
+def test_invalid_and_superlinear_verdicts():
+    assert rulecost.profile_rule(r"(unclosed")["status"] == "invalid"
+    superlinear = {"status": "superlinear"}
+    assert not rulecost.passes(superlinear, reject_superlinear=True)
+    assert rulecost.passes(superlinear, reject_superlinear=False)
+
+
+def test_active_rules_are_profiled_once(tmp_path, monkeypatch):
+    rules_path = tmp_path / "rules.json"
+    costs_path = tmp_path / "costs" / "rule_costs.json"
+    profiled = []
+    monkeypatch.setattr(rulecost, "profile_rule", lambda p: profiled.append(p) or {"pattern": p, "status": "ok"})
+
+    rules_path.write_text(json.dumps({"patterns": ["alpha", "beta"]}))
+    assert set(rulecost.active_rule_costs(str(rules_path), str(costs_path))) == {"alpha", "beta"}
+    rules_path.write_text(json.dumps({"patterns": ["beta", "gamma"]}))
+    assert set(rulecost.active_rule_costs(str(rules_path), str(costs_path))) == {"beta", "gamma"}
+
+    assert profiled == ["alpha", "beta", "gamma"]
+    assert set(rulecost.load_costs(str(costs_path))) == {"beta", "gamma"}  # retired rules are dropped
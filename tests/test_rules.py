@@ -0,0 +1,108 @@
+# tests/test_rules.py
+import json
+import os
+import random
+import re
+
+import pytest
+
+from app.normalize import normalize
+from app.rules import CompiledRuleSet, RuleHitCounter, extract_anchors, read_rule_hits
+from conftest import ROOT
+
+with open(os.path.join(ROOT, "data", "rules.json")) as f:
+    SHIPPED = json.load(f)["patterns"]
+
+EXTRA = [
+    r"reveal (the|your) (system )?prompt",
+    r"\bpass(word|phrase)\b",
+    r"(?i)act as (an? )?unrestricted",
+    r"(\w+) \1 \1",  # backreference: never combined
+    r"(?s)begin.*end",  # flags other than (?i): scanned on its own
+    r"[0-9]{4}-[0-9]{4}",  # no literal anchor
+    r"\d+ tokens?",
+    r"x{3,}",
+    r"(",  # invalid: skipped
+    r"ignore previous instruction",  # duplicate of a shipped rule
+]
+PATTERNS = SHIPPED + EXTRA
+
+WORDS = ["ignore", "previous", "instruction", "instructions", "system", "override", "drop", "table", "sudo",
+         "dan", "danger", "do", "anything", "now", "switch", "to", "developer", "mode", "disable", "content",
+         "filters", "security", "directions", "reveal", "the", "your", "prompt", "password", "passwords",
+         "act", "as", "an", "unrestricted", "begin", "end", "1234-5678", "42", "tokens", "xxxx", "hello",
+         "please", "summarise", "report", "break", "rules", "protocols", "enabled", "\n", "DAN", "Sudo"]
+
+
+def reference_match(patterns, text):
+    """What a pattern-by-pattern scan reports: the first valid pattern, in file order, that matches."""
+    for pattern in patterns:
+        try:
+            if re.search(pattern, text, re.IGNORECASE):
+                return pattern
+        except re.error:
+            continue
+    return None
+
+
+def sample_texts(count=2000, seed=7):
+    rng = random.Random(seed)
+    texts = ["", "hello", "DROP TABLE users;", "I am Dan", "abandon", "the the the", "begin\nend"]
+    for _ in range(count):
+        texts.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 12))))
+    return texts
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 200])
+def test_matches_pattern_by_pattern_scan(chunk_size):
+    ruleset = CompiledRuleSet(PATTERNS, chunk_size=chunk_size)
+    assert ruleset.invalid == ["("]
+    for text in sample_texts():
+        assert ruleset.match(text) == reference_match(PATTERNS, text), text
+
+
+def test_plan_changes_order_not_result():
+    plan = list(reversed(PATTERNS))[:8]
+    planned = CompiledRuleSet(PATTERNS, plan=plan)
+    for text in sample_texts(seed=11):
+        assert planned.match(text) == reference_match(PATTERNS, text), text
+
+
+def test_match_normalized_checks_raw_view_too():
+    ruleset = CompiledRuleSet([r"ignore previous", r"p\.a\.s\.s"])
+    assert ruleset.match_normalized(normalize("i.g.n.o.r.e previous")) == "ignore previous"
+    # Only the raw text still has the dots this rule was written against.
+    assert ruleset.match_normalized(normalize("P.A.S.S.W.O.R.D")) == r"p\.a\.s\.s"
+    assert ruleset.match_normalized(normalize("hello there")) is None
+
+
+def test_anchors_are_required_literals():
+    assert extract_anchors(r"drop table") == ["drop table"]
+    assert set(extract_anchors(r"pass(word|phrase)")) == {"password", "passphrase"}
+    assert extract_anchors(r"[0-9]{4}-[0-9]{4}") is None
+
+
+def test_rule_hit_counters_add_up_across_flushes(db):
+    first = RuleHitCounter(db, flush_interval=3600)
+    second = RuleHitCounter(db, flush_interval=3600)
+    for _ in range(3):
+        first.hit("drop table")
+    second.hit("drop table")
+    second.hit("system override")
+    assert first.flush() == 3
+    assert second.flush() == 2
+    assert first.flush() == 0
+    assert read_rule_hits(db) == {"drop table": 4, "system override": 1}
+
+
+def test_hits_are_only_counted_in_memory_until_a_flush_is_due(db):
+    counter = RuleHitCounter(db, flush_interval=0)
+    counter.hit("drop table")  # overdue, but hit() never writes
+    assert read_rule_hits(db) == {}
+    counter.flush_due([])
+    assert read_rule_hits(db) == {"drop table": 1}
+
+    counter = RuleHitCounter(db, flush_interval=3600)
+    counter.hit("drop table")
+    counter.flush_due([])
+    assert read_rule_hits(db) == {"drop table": 1}
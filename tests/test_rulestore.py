@@ -0,0 +1,111 @@
+# tests/test_rulestore.py
+import json
+import threading
+
+import pytest
+
+from app.rules import RuleEngine, ruleset_version
+from app.rulestore import RuleStore, StaleProposal
+from conftest import add_rule
+
+
+def _proposal(store, patterns, base=None):
+    return store.queue({"type": "ruleset", "patterns": patterns, "plan": None, "reason": "test",
+                        "base_version": base or store.active()["digest"]})
+
+
+def test_approve_appends_a_version(store):
+    assert store.head() == 0
+    pending_id = store.queue({"pattern": "drop table"})
+    assert [entry["pattern"] for entry in store.pending()] == ["drop table"]
+    assert store.approve(pending_id) == 1
+    document = store.active()
+    assert document["patterns"] == ["drop table"]
+    assert document["digest"] == ruleset_version(["drop table"])
+    assert document["note"] == "Added rule: drop table"
+    assert store.pending() == []
+    assert store.approve(pending_id) is None  # already handled
+
+
+def test_queue_deduplicates_rules(store):
+    assert store.queue({"pattern": "drop table"}) is not None
+    assert store.queue({"pattern": "drop table"}) is None
+    assert len(store.pending()) == 1
+
+
+def test_reject_drops_the_entry(store):
+    pending_id = store.queue({"pattern": "drop table"})
+    assert store.reject(pending_id)
+    assert not store.reject(pending_id)
+    assert store.head() == 0 and store.pending() == []
+
+
+def test_concurrent_approvals_apply_once(store):
+    pending_id = store.queue({"pattern": "drop table"})
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(store.approve(pending_id))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results, key=str) == [1] + [None] * 7
+    assert store.head() == 1
+
+
+def test_stale_ruleset_proposal_is_refused_and_kept(store):
+    add_rule(store, "drop table")
+    proposal = _proposal(store, ["drop table"])
+    add_rule(store, "system override")  # the rules moved on
+    with pytest.raises(StaleProposal):
+        store.approve(proposal)
+    assert [entry["id"] for entry in store.pending()] == [proposal]
+    assert store.active()["patterns"] == ["drop table", "system override"]
+
+
+def test_newer_ruleset_proposal_replaces_the_older(store):
+    add_rule(store, "drop table")
+    _proposal(store, ["drop table"])
+    newest = _proposal(store, ["drop table"])
+    assert [entry["id"] for entry in store.pending()] == [newest]
+    assert store.approve(newest) == 2
+
+
+def test_rollback_appends_a_copy(store):
+    add_rule(store, "drop table")
+    add_rule(store, "system override")
+    assert store.rollback(1) == 3
+    assert store.active()["patterns"] == ["drop table"]
+    assert [item["action"] for item in store.history()] == ["rollback", "approve", "approve"]
+    with pytest.raises(ValueError):
+        store.rollback(42)
+
+
+def test_rule_engine_follows_the_store(store):
+    add_rule(store, "drop table")
+    engine = RuleEngine(store, reload_interval=0)
+    assert engine.current().match("please DROP TABLE users") == "drop table"
+    add_rule(store, "system override")
+    assert engine.current().match("system override now") == "system override"
+    store.rollback(1)
+    assert engine.current().match("system override now") is None
+
+
+def test_legacy_files_are_imported_once(db, tmp_path):
+    rules_path, pending_path = tmp_path / "rules.json", tmp_path / "pending.json"
+    rules_path.write_text(json.dumps({"patterns": ["drop table"]}))
+    pending_path.write_text(json.dumps([{"pattern": "system override"}, {"pattern": "system override"}]))
+    first = RuleStore(db, rules_path=str(rules_path), pending_path=str(pending_path))
+    assert first.active()["patterns"] == ["drop table"]
+    assert len(first.pending()) == 1
+
+    rules_path.write_text(json.dumps({"patterns": ["changed"]}))
+    second = RuleStore(db, rules_path=str(rules_path), pending_path=str(pending_path))
+    assert second.head() == 1
+    assert second.active()["patterns"] == ["drop table"]
+
+
+def test_export_writes_rules_json(store, tmp_path):
+    add_rule(store, "drop table")
+    path = tmp_path / "out" / "rules.json"
+    store.export(str(path))
+    assert json.loads(path.read_text()) == {"patterns": ["drop table"], "version": "1"}
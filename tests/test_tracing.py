@@ -0,0 +1,92 @@
+# tests/test_tracing.py
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import concurrency
+from app.concurrency import run_blocking
+from app.tracing import TraceRecorder, TracingMiddleware, current_trace, span
+
+
+@pytest.fixture(autouse=True)
+def executor(monkeypatch):
+    # The shared pool is shut down by app.main's lifespan once another test has run it.
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(concurrency, "cpu_executor", pool)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def _app(recorder):
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware, recorder=recorder)
+
+    def layer():
+        with span("static", rules=3):
+            time.sleep(0.01)
+
+    @app.get("/check")
+    async def check():
+        with span("screen"):
+            await run_blocking(layer)
+        return {"traced": current_trace() is not None}
+
+    return app
+
+
+def _traces(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_request_ids_are_echoed_or_generated(tmp_path):
+    client = TestClient(_app(TraceRecorder(path=str(tmp_path / "traces.jsonl"), sample_rate=0, slow_ms=1e9)))
+    assert client.get("/check", headers={"X-Request-ID": "abc-123"}).headers["x-request-id"] == "abc-123"
+    generated = client.get("/check", headers={"X-Request-ID": "bad id/../x"}).headers["x-request-id"]
+    assert generated != "bad id/../x" and generated.isalnum()
+
+
+def test_slow_requests_are_written_with_nested_spans(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    client = TestClient(_app(TraceRecorder(path=str(path), slow_ms=0, sample_rate=0)))
+    response = client.get("/check", headers={"X-Request-ID": "slow-1"})
+    assert response.json() == {"traced": True}
+
+    [trace] = _traces(path)
+    assert trace["request_id"] == "slow-1" and trace["name"] == "GET /check"
+    assert trace["slow"] is True and trace["status"] == 200
+    spans = {item["name"]: item for item in trace["spans"]}
+    # The layer ran on an executor thread and still landed in this request's trace.
+    assert spans["screen"]["parent"] is None
+    assert spans["static"]["parent"] == "screen" and spans["static"]["rules"] == 3
+    assert spans["static"]["duration_ms"] >= 10
+
+
+def test_fast_requests_are_not_written_unless_sampled(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    recorder = TraceRecorder(path=str(path), slow_ms=1e9, sample_rate=0)
+    TestClient(_app(recorder)).get("/check")
+    assert recorder.written == 0 and not path.exists()
+
+
+def test_every_nth_request_is_profiled(tmp_path):
+    recorder = TraceRecorder(path=str(tmp_path / "traces.jsonl"), slow_ms=1e9, sample_rate=0,
+                             profile_every=2, profile_dir=str(tmp_path / "profiles"))
+    client = TestClient(_app(recorder))
+    for _ in range(4):
+        client.get("/check")
+    profiled = _traces(tmp_path / "traces.jsonl")
+    assert len(profiled) == 2  # profiled traces are always kept
+    for trace in profiled:
+        assert trace["profile"].endswith(".folded")
+        with open(trace["profile"], encoding="utf-8") as f:
+            assert all(line.rsplit(" ", 1)[1].strip().isdigit() for line in f)
+
+
+def test_span_outside_a_request_does_nothing():
+    with span("idle"):
+        assert current_trace() is None
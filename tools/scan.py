@@ -0,0 +1,140 @@
+# tools/scan.py
+"""Offline screener: streams a JSONL/NDJSON prompt file through Layers 1-2.
+
+Usage:
+    python -m tools.scan prompts.jsonl --output verdicts.jsonl --workers 4
+
+Input lines are JSON strings, objects with a "prompt" field (and an optional
+"id"), or plain text. No LLM calls are made and nothing is logged. The file is
+read lazily and split into chunks that are scored (with batched ML inference)
+in a pool of worker processes; at most `--max-pending` chunks are in memory at
+once, and results are written incrementally in input order.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from collections import Counter, deque
+from itertools import islice
+
+from app.config import SCAN_CHUNK_SIZE
+from app.scanning import parse_record
+
+_scan = None
+
+
+def _init_worker(threads):
+    # app.config is already imported when this runs, so the thread count is
+    # handed to the model directly rather than through the environment.
+    global _scan
+    from app.layers import model_manager, scan_prompts
+    if model_manager.state == "unloaded":
+        model_manager.threads = threads
+    model_manager.load()
+    _scan = scan_prompts
+
+
+def _scan_chunk(lines):
+    from app.scanning import scan_records
+    records = []
+    results = []
+    for index, line in lines:
+        try:
+            record = parse_record(line, index)
+        except ValueError as e:
+            results.append({"id": index, "status": "error", "details": str(e)})
+            continue
+        if record is not None:
+            records.append(record)
+    return results + scan_records(records, _scan)
+
+
+def read_chunks(path, chunk_size):
+    """Yields lists of (line index, raw line), never holding more than one chunk."""
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        numbered = enumerate(stream)
+        while True:
+            chunk = list(islice(numbered, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def scan_file(path, out, workers=1, chunk_size=SCAN_CHUNK_SIZE, max_pending=None, progress=True):
+    """Scans `path` into the writable `out`; returns summary counts."""
+    workers = max(1, workers)
+    max_pending = max_pending or workers * 2
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    counts = Counter()
+    started = time.perf_counter()
+
+    ctx = mp.get_context("spawn")
+    # Spawned workers copy the environment at start-up; "lazy" keeps a preload
+    # setting from loading the model at import, before its thread count is set.
+    previous = os.environ.get("PROMPTSHIELD_MODEL_LOAD")
+    os.environ["PROMPTSHIELD_MODEL_LOAD"] = "lazy"
+    try:
+        pool = ctx.Pool(workers, initializer=_init_worker, initargs=(threads,))
+    finally:
+        if previous is None:
+            del os.environ["PROMPTSHIELD_MODEL_LOAD"]
+        else:
+            os.environ["PROMPTSHIELD_MODEL_LOAD"] = previous
+    with pool:
+        pending = deque()
+
+        def drain_one():
+            for result in pending.popleft().get():
+                counts[result.get("layer") or result["status"]] += 1
+                counts["total"] += 1
+                out.write(json.dumps(result) + "\n")
+            out.flush()
+
+        for chunk in read_chunks(path, chunk_size):
+            # Bounded memory: wait for the oldest chunk before reading further.
+            while len(pending) >= max_pending:
+                drain_one()
+            pending.append(pool.apply_async(_scan_chunk, (chunk,)))
+            if progress and counts["total"]:
+                rate = 60 * counts["total"] / (time.perf_counter() - started)
+                print(f"\r{counts['total']} prompts ({rate:.0f}/min)", end="", file=sys.stderr)
+        while pending:
+            drain_one()
+
+    elapsed = time.perf_counter() - started
+    counts["seconds"] = elapsed
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL/NDJSON file, or - for stdin")
+    parser.add_argument("--output", "-o", help="Write verdicts here (default: stdout)")
+    parser.add_argument("--workers", "-w", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--chunk-size", type=int, default=SCAN_CHUNK_SIZE)
+    parser.add_argument("--max-pending", type=int, help="Chunks in flight (default: 2 x workers)")
+    args = parser.parse_args()
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        counts = scan_file(args.input, out, args.workers, args.chunk_size, args.max_pending,
+                           progress=out is not sys.stdout)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    total = counts.pop("total", 0)
+    seconds = counts.pop("seconds")
+    rate = 60 * total / seconds if seconds else 0.0
+    summary = ", ".join(f"{layer}: {count}" for layer, count in sorted(counts.items()))
+    print(f"\nScanned {total} prompts in {seconds:.1f}s ({rate:.0f}/min). {summary}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()